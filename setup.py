@@ -14,6 +14,8 @@ setup(
 	url='https://github.com/miili/wavePicker',
 	long_description=read('README.md'),
 	packages=['wavePicker'],
-	package_data={'wavePicker': ['icons/*.png']}
+	package_data={'wavePicker': ['icons/*.png']},
+	entry_points={'console_scripts': ['wavepicker-batch = wavePicker.batch:main',
+	                                  'wavepicker-compare = wavePicker.comparison:main']}
 	#install_requires=['pyqtgraph', 'pyside', 'obspy']
 	)
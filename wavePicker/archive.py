@@ -0,0 +1,338 @@
+import numpy as np
+
+from cache import cacheDir
+
+from obspy.core import read, Stream, UTCDateTime
+
+from fnmatch import fnmatch
+from io import BytesIO
+from multiprocessing import Pool, cpu_count
+import hashlib
+import json
+import os
+
+# 'code' is the row of the 'NET.STA.LOC.CHA' string in the code table
+INDEX_DTYPE = [('code', 'i4'), ('starttime', 'f8'), ('endtime', 'f8'),
+               ('file', 'i4'), ('offset', 'i8'), ('length', 'i4')]
+
+
+def _headerDtype(byteorder, reclen):
+    '''
+    Fixed section of the miniSEED data header, strided by the record
+    length so a whole file is parsed as one array
+    '''
+    return np.dtype({
+        'names': ['station', 'location', 'channel', 'network', 'year', 'doy',
+                  'hour', 'minute', 'second', 'fraction', 'nsamples',
+                  'factor', 'multiplier', 'activity', 'correction'],
+        'formats': ['S5', 'S2', 'S3', 'S2', byteorder + 'u2',
+                    byteorder + 'u2', 'u1', 'u1', 'u1', byteorder + 'u2',
+                    byteorder + 'u2', byteorder + 'i2', byteorder + 'i2',
+                    'u1', byteorder + 'i4'],
+        'offsets': [8, 13, 15, 18, 20, 22, 24, 25, 26, 28, 30, 32, 34, 36,
+                    40],
+        'itemsize': reclen})
+
+
+def _recordLength(header):
+    '''
+    Byte order and record length from blockette 1000 of the first record
+
+    ::return::
+    ('>' or '<', record length) or None
+    '''
+    for byteorder in '><':
+        year = np.frombuffer(header[20:22], dtype=byteorder + 'u2')[0]
+        if not 1900 <= year <= 2100:
+            continue
+        offset = np.frombuffer(header[46:48], dtype=byteorder + 'u2')[0]
+        while 48 <= offset < len(header) - 8:
+            blockette = np.frombuffer(header[offset:offset + 4],
+                                      dtype=byteorder + 'u2')
+            if blockette[0] == 1000:
+                return byteorder, 2 ** int(np.frombuffer(
+                    header[offset + 6:offset + 7], dtype='u1')[0])
+            offset = blockette[1]
+        return None
+
+
+def _samplingRates(factor, multiplier):
+    factor = factor.astype(float)
+    multiplier = multiplier.astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.select(
+            [(factor > 0) & (multiplier > 0), (factor > 0) & (multiplier < 0),
+             (factor < 0) & (multiplier > 0), (factor < 0) & (multiplier < 0)],
+            [factor * multiplier, -factor / multiplier,
+             -multiplier / factor, 1. / (factor * multiplier)], 0.)
+
+
+def _epoch(year, doy):
+    '''
+    Timestamp of day of year 00:00, vectorized
+    '''
+    days = (year.astype('i8') - 1970) * 365 + (doy.astype('i8') - 1) +\
+        (year.astype('i8') - 1969) // 4 - (year.astype('i8') - 1901) // 100 +\
+        (year.astype('i8') - 1601) // 400
+    return days * 86400.
+
+
+def indexFile(args):
+    '''
+    Indexes the records of one miniSEED file, runs in the process pool.
+    Files with a constant record length are parsed as one strided array,
+    others record by record with ObsPy
+
+    :param args: (filename, file id)
+    ::return::
+    list of the file's codes and the index rows as structured array, the
+    'code' field refers to that list
+    '''
+    filename, file_id = args
+    try:
+        size = os.path.getsize(filename)
+        with open(filename, 'rb') as mseed:
+            first = mseed.read(4096)
+    except (IOError, OSError):
+        return [], np.zeros(0, dtype=INDEX_DTYPE)
+    layout = _recordLength(first) if len(first) >= 48 else None
+    if layout is None or size % layout[1]:
+        return _indexFileObspy(filename, file_id, size)
+    byteorder, reclen = layout
+
+    # memory mapped, only the pages holding headers are read
+    headers = np.memmap(filename, dtype=_headerDtype(byteorder, reclen),
+                        mode='r')
+    rates = _samplingRates(headers['factor'], headers['multiplier'])
+    starttimes = _epoch(headers['year'], headers['doy']) +\
+        headers['hour'] * 3600. + headers['minute'] * 60. +\
+        headers['second'] + headers['fraction'] * 1e-4
+    # time correction is applied unless activity flag bit 1 is set
+    starttimes += np.where(headers['activity'] & 2, 0.,
+                           headers['correction'] * 1e-4)
+    with np.errstate(divide='ignore'):
+        durations = np.where(rates > 0, headers['nsamples'] / rates, 0.)
+
+    codes = [np.char.strip(np.char.decode(headers[key], 'ascii'))
+             for key in ('network', 'station', 'location', 'channel')]
+    codes = np.char.add(np.char.add(np.char.add(codes[0], '.'),
+                                    np.char.add(codes[1], '.')),
+                        np.char.add(np.char.add(codes[2], '.'), codes[3]))
+    codes, inverse = np.unique(codes, return_inverse=True)
+    index = np.zeros(len(headers), dtype=INDEX_DTYPE)
+    index['code'] = inverse
+    index['starttime'] = starttimes
+    index['endtime'] = starttimes + durations
+    index['file'] = file_id
+    index['offset'] = np.arange(len(headers), dtype='i8') * reclen
+    index['length'] = reclen
+    index = index[headers['nsamples'] > 0]
+    del headers
+    return [str(code) for code in codes], index
+
+
+def _indexFileObspy(filename, file_id, size):
+    from obspy.io.mseed.util import get_record_information
+    codes = {}
+    rows = []
+    offset = 0
+    while offset < size:
+        try:
+            info = get_record_information(filename, offset=offset)
+        except Exception:
+            break
+        code = '%s.%s.%s.%s' % (info['network'], info['station'],
+                                info['location'], info['channel'])
+        rows.append((codes.setdefault(code, len(codes)),
+                     info['starttime'].timestamp,
+                     info['endtime'].timestamp + 1. / info['samp_rate'],
+                     file_id, offset, info['record_length']))
+        offset += info['record_length']
+    return (sorted(codes, key=codes.get),
+            np.array(rows, dtype=INDEX_DTYPE).reshape(-1))
+
+
+class WaveformArchive(object):
+    '''
+    Record index of a miniSEED directory tree, e.g. an SDS archive
+
+    Every record is indexed with its code id, start and end time, file
+    and byte offset, the SEED codes are kept once in a code table. The
+    index is kept sorted by start time in the cache directory, memory
+    mapped and updated incrementally, only new or modified files are
+    read. Time window requests read just the overlapping records.
+    '''
+    def __init__(self, root, update=True, nprocesses=None):
+        '''
+        :param root: Archive root directory, type string
+        :param update: Index new and modified files, type bool
+        :param nprocesses: Processes used for indexing (default: cpu count)
+        '''
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(
+            cacheDir('archive'),
+            hashlib.md5(self.root.encode('utf-8')).hexdigest())
+        self.nprocesses = nprocesses
+        self.files = []
+        self.codes = []      # 'NET.STA.LOC.CHA' of the index 'code' ids
+        self.stat = {}
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.longest = 0.    # longest record in s
+        self._load()
+        if update:
+            self.update()
+
+    def _load(self):
+        if not os.path.exists(self.path + '.json'):
+            return
+        with open(self.path + '.json', 'r') as meta_file:
+            meta = json.load(meta_file)
+        if 'codes' not in meta:
+            return  # index of an older layout, rebuilt by update()
+        self.files = meta['files']
+        self.codes = meta['codes']
+        self.longest = meta['longest']
+        self.stat = dict((filename, tuple(stat))
+                         for filename, stat in meta['stat'].items())
+        self.index = np.load(self.path + '.npy', mmap_mode='r')
+
+    def _save(self):
+        with open(self.path + '.npy.tmp', 'wb') as npy_file:
+            np.save(npy_file, self.index)
+        os.rename(self.path + '.npy.tmp', self.path + '.npy')
+        with open(self.path + '.json.tmp', 'w') as meta_file:
+            json.dump({'root': self.root, 'files': self.files,
+                       'codes': self.codes, 'longest': self.longest,
+                       'stat': self.stat}, meta_file)
+        os.rename(self.path + '.json.tmp', self.path + '.json')
+        self.index = np.load(self.path + '.npy', mmap_mode='r')
+
+    def _scan(self):
+        '''
+        :return: dict of all files below root and their (size, mtime)
+        '''
+        stat = {}
+        for root, dirs, names in os.walk(self.root):
+            dirs.sort()
+            for name in sorted(names):
+                filename = os.path.join(root, name)
+                info = os.stat(filename)
+                stat[os.path.relpath(filename, self.root)] =\
+                    (info.st_size, int(info.st_mtime))
+        return stat
+
+    def update(self):
+        '''
+        Indexes new and modified files in parallel and drops records of
+        deleted or modified ones
+
+        :return: number of (re)indexed files
+        '''
+        current = self._scan()
+        changed = [filename for filename, stat in current.items()
+                   if self.stat.get(filename) != stat]
+        stale = set(filename for filename in self.stat
+                    if current.get(filename) != self.stat[filename])
+        if not changed and not stale:
+            return 0
+
+        file_ids = dict((filename, i) for i, filename in enumerate(self.files))
+        stale_ids = np.array([file_ids[filename] for filename in stale
+                              if filename in file_ids], dtype='i4')
+        index = self.index[~np.isin(self.index['file'], stale_ids)]
+
+        jobs = []
+        for filename in changed:
+            if filename not in file_ids:
+                file_ids[filename] = len(self.files)
+                self.files.append(filename)
+            jobs.append((os.path.join(self.root, filename),
+                         file_ids[filename]))
+        pool = Pool(self.nprocesses or cpu_count())
+        try:
+            parts = pool.map(indexFile, jobs, chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+
+        # map the code ids of each file onto the code table
+        code_ids = dict((code, i) for i, code in enumerate(self.codes))
+        for codes, rows in parts:
+            for code in codes:
+                if code not in code_ids:
+                    code_ids[code] = len(self.codes)
+                    self.codes.append(code)
+            rows['code'] = np.array([code_ids[code] for code in codes],
+                                    dtype='i4')[rows['code']]
+        index = np.concatenate([index] + [rows for _, rows in parts])
+        self.index = index[np.argsort(index['starttime'], kind='mergesort')]
+        self.longest = float((self.index['endtime'] -
+                              self.index['starttime']).max()
+                             if len(self.index) else 0.)
+        self.stat = current
+        self._save()
+        return len(changed)
+
+    def select(self, starttime, endtime, network='*', station='*',
+               location='*', channel='*'):
+        '''
+        Records overlapping the time window, codes may contain wildcards
+
+        :return: index rows as structured array
+        '''
+        starttime, endtime = (UTCDateTime(starttime).timestamp,
+                              UTCDateTime(endtime).timestamp)
+        if not len(self.index):
+            return self.index
+        first = np.searchsorted(self.index['starttime'],
+                                starttime - self.longest)
+        last = np.searchsorted(self.index['starttime'], endtime)
+        rows = np.array(self.index[first:last])
+        rows = rows[rows['endtime'] > starttime]
+
+        patterns = (network, station, location, channel)
+        if any(pattern != '*' for pattern in patterns):
+            pattern = '.'.join(patterns)
+            matches = np.array([fnmatch(code, pattern)
+                                for code in self.codes], dtype=bool)
+            rows = rows[matches[rows['code']]]
+        return rows
+
+    def getWaveforms(self, starttime, endtime, network='*', station='*',
+                     location='*', channel='*'):
+        '''
+        Reads only the records overlapping the window, consecutive records
+        of a file are read in one go
+
+        :return: obspy.core.Stream trimmed to the window
+        '''
+        rows = self.select(starttime, endtime, network, station, location,
+                           channel)
+        rows = rows[np.lexsort((rows['offset'], rows['file']))]
+        st = Stream()
+        i = 0
+        while i < len(rows):
+            j = i + 1
+            while j < len(rows) and rows['file'][j] == rows['file'][i] and\
+                    rows['offset'][j] == rows['offset'][j - 1] +\
+                    rows['length'][j - 1]:
+                j += 1
+            with open(os.path.join(self.root,
+                                   self.files[rows['file'][i]]), 'rb') as f:
+                f.seek(rows['offset'][i])
+                chunk = f.read(rows['offset'][j - 1] + rows['length'][j - 1] -
+                               rows['offset'][i])
+            st += read(BytesIO(chunk), format='MSEED')
+            i = j
+        st.merge()
+        return st.trim(UTCDateTime(starttime), UTCDateTime(endtime))
+
+    def eventWindow(self, time, before=30., after=120., **codes):
+        '''
+        Waveforms around an event or pick time in s
+        '''
+        time = UTCDateTime(time)
+        return self.getWaveforms(time - before, time + after, **codes)
+
+    def __len__(self):
+        return len(self.index)
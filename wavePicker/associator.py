@@ -0,0 +1,203 @@
+'''
+Association of candidate picks into events
+
+Picks of automatic pickers or imported catalogs are sorted by time once,
+every P pick opens a window found by binary search. Within the window
+only picks whose delay to the opening pick can be explained by the
+moveout between the two stations are counted, so that coincident picks
+of distant stations do not form events. A window with P picks of at
+least min_stations stations becomes an event and its picks are consumed.
+'''
+import numpy as np
+
+from guiContainer import getPhase
+from travelTimes import VelocityModel, epicentralDistance
+from comparison import _timestamps
+
+from obspy.core import UTCDateTime
+
+import json
+
+
+def _timestamp(time):
+    if isinstance(time, UTCDateTime):
+        return time.timestamp
+    if isinstance(time, (str, type(u''))):
+        return UTCDateTime(time).timestamp
+    return float(time)
+
+
+def _times(picks):
+    '''
+    Timestamps of the picks, ISO strings are parsed vectorized
+    '''
+    times = [pick['time'] for pick in picks]
+    if times and all(isinstance(time, (str, type(u''))) for time in times):
+        return _timestamps(times)
+    return np.array([_timestamp(time) for time in times], dtype=float)
+
+
+def _phaseName(phase):
+    return getattr(phase, 'name', phase)
+
+
+def stationCoordinates(stations):
+    '''
+    :param stations: Stations() container
+    :return: dict of (network, station) and (latitude, longitude), stations
+             without coordinates are left out
+    '''
+    return dict(((station.stats.network, station.stats.station),
+                 station.getCoordinates())
+                for station in stations
+                if station.getCoordinates() != (0., 0.))
+
+
+def moveoutMatrix(codes, coordinates, velocity, tolerance, window):
+    '''
+    Maximum delay in s between P picks of each pair of stations, the
+    inter station distance over the slowest apparent velocity plus
+    tolerance. Stations without coordinates get the full window
+
+    :param codes: list of (network, station)
+    '''
+    lat = np.array([coordinates.get(code, (np.nan, np.nan))[0]
+                    for code in codes], dtype=float)
+    lon = np.array([coordinates.get(code, (np.nan, np.nan))[1]
+                    for code in codes], dtype=float)
+    distance = epicentralDistance(lat[:, np.newaxis], lon[:, np.newaxis],
+                                  lat[np.newaxis, :], lon[np.newaxis, :])
+    moveout = np.where(np.isnan(distance), window,
+                       distance / velocity + tolerance)
+    return np.minimum(moveout, window)
+
+
+def associate(picks, window=15., min_stations=4, max_sp=30.,
+              coordinates=None, velocity=None, tolerance=1.):
+    '''
+    Groups picks into events. A P pick opens a window of window seconds,
+    later P picks count if their delay is within the moveout from the
+    opening station. If at least min_stations stations count, they form
+    an event together with the P picks explained by the moveout from any
+    of them. Each station contributes its first P pick and its first S
+    pick up to max_sp after the last P. Picks are used by one event at
+    most
+
+    :param picks: list of pick dicts, 'time' as timestamp, UTCDateTime
+                  or ISO string, 'phase' as name or Phase
+    :param coordinates: dict of (network, station) and (lat, lon), without
+                        coordinates only the window is applied
+    :param velocity: Slowest apparent P velocity in km/s, type float
+                     (default: top layer of the default VelocityModel)
+    :param tolerance: Pick uncertainty added to the moveout in s
+    ::return::
+    list of pick lists, one per event ordered by time
+    '''
+    if not picks:
+        return []
+    if velocity is None:
+        velocity = VelocityModel().vp[0]
+    phases = np.array([_phaseName(pick['phase']) for pick in picks])
+    times = _times(picks)
+    codes = [tuple(pick['station_id'].split('.')[:2]) for pick in picks]
+    unique = sorted(set(codes))
+    index = dict((code, i) for i, code in enumerate(unique))
+    stations = np.array([index[code] for code in codes], dtype=int)
+    moveout = moveoutMatrix(unique, coordinates or {}, velocity, tolerance,
+                            window)
+
+    p = np.nonzero(phases == 'P')[0]
+    p = p[np.argsort(times[p], kind='mergesort')]
+    s = np.nonzero(phases == 'S')[0]
+    s = s[np.argsort(times[s], kind='mergesort')]
+    p_times, p_stations = times[p], stations[p]
+    s_times, s_stations = times[s], stations[s]
+    p_used = np.zeros(len(p), dtype=bool)
+    s_used = np.zeros(len(s), dtype=bool)
+
+    ends = np.searchsorted(p_times, p_times + window, side='right')
+    # windows with less picks than stations needed cannot form an event
+    seeds = np.nonzero(ends - np.arange(len(p)) >= min_stations)[0]
+    events = []
+    for i in seeds:
+        if p_used[i]:
+            continue
+        j = ends[i]
+        delay = p_times[i:j] - p_times[i]
+        free = ~p_used[i:j]
+        consistent = delay <= moveout[p_stations[i], p_stations[i:j]]
+        if np.unique(p_stations[i:j][free & consistent]).size < min_stations:
+            continue
+        # picks up to one window after the last consistent pick join if
+        # the moveout to any consistent pick explains them, so an early
+        # noise pick opening the window does not cut the event in two
+        anchors = i + np.nonzero(free & consistent)[0]
+        j = ends[anchors[-1]]
+        offsets = np.abs(p_times[i:j, np.newaxis] - p_times[anchors])
+        consistent = (offsets <= moveout[p_stations[i:j, np.newaxis],
+                                         p_stations[anchors]]).any(axis=1)
+        candidates = i + np.nonzero(~p_used[i:j] & consistent)[0]
+        members, first = np.unique(p_stations[candidates], return_index=True)
+        # later picks of the member stations are retriggers of this event
+        p_used[candidates] = True
+        first = np.sort(candidates[first])
+        event = [picks[k] for k in p[first]]
+
+        first_s = np.searchsorted(s_times, p_times[i])
+        last_s = np.searchsorted(s_times, p_times[first[-1]] + max_sp,
+                                 side='right')
+        found = first_s + np.nonzero(
+            ~s_used[first_s:last_s] &
+            np.isin(s_stations[first_s:last_s], members))[0]
+        _, first = np.unique(s_stations[found], return_index=True)
+        s_used[found[first]] = True
+        event += [picks[k] for k in s[np.sort(found[first])]]
+        events.append(event)
+    return events
+
+
+def readCandidates(filename):
+    '''
+    Reads the picks of an Events.exportJSON file for associate(), event
+    ids of the file are ignored
+    '''
+    with open(filename, 'r') as json_file:
+        return json.load(json_file)
+
+
+def addEvents(events, groups, coordinates=None):
+    '''
+    Adds associated pick lists as new Event()s in one undo step, each
+    event is written to the project store in one transaction. The last
+    new event becomes the active one
+
+    :param events: Events() container
+    :param groups: list of pick lists as returned by associate()
+    :param coordinates: dict of (network, station) and (lat, lon) for
+                        picks without station coordinates
+    ::return::
+    list of the new Event()
+    '''
+    coordinates = coordinates or {}
+    next_id = max([event.id for event in events] + [0]) + 1
+    created = []
+    with events.parent.undo.group():
+        for event_id, picks in enumerate(groups, next_id):
+            events.addEvent(event_id, activate=False)
+            event = events.events[-1]
+            pickevts = []
+            for pick in picks:
+                code = tuple(pick['station_id'].split('.')[:2])
+                lat, lon = coordinates.get(code, (0., 0.))
+                pickevts.append({
+                    'station_id': pick['station_id'],
+                    'station_lat': pick.get('station_lat', lat),
+                    'station_lon': pick.get('station_lon', lon),
+                    'time': UTCDateTime(_timestamp(pick['time'])),
+                    'phase': getPhase(_phaseName(pick['phase'])),
+                    'amplitude': pick.get('amplitude', '')})
+            event.addPicksToEvent(pickevts)
+            created.append(event)
+    if created:
+        events.setActiveEvent(created[-1])
+    return created
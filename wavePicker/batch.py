@@ -0,0 +1,415 @@
+'''
+Batch auto-picking of miniSEED directories
+
+    wavepicker-batch /data/2014/*/ -o picks -n month --inventory network.xml
+
+Files are scanned and picked across a process pool, picks are associated
+into events and written with the Events() and Stations() exporters, so
+the results can be reviewed in the wavePicker GUI.
+'''
+import numpy as np
+
+from guiContainer import Stations, Events
+from response import ResponseCorrector
+from magnitude import MagnitudeEngine
+from rotation import Rotator
+from memory import MemoryManager
+from undo import UndoStack
+from locator import GridLocator
+from travelTimes import TravelTimeTable
+from associator import associate, addEvents, stationCoordinates
+
+from obspy.core import read, Stream, Trace, UTCDateTime, AttribDict
+
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+import argparse
+import glob
+import os
+import sys
+import time
+import traceback
+
+DEFAULT_PICKER = {
+    'freqmin': 1.,
+    'freqmax': 15.,
+    'sta': 1.,
+    'lta': 10.,
+    'trigger_on': 3.5,
+    'trigger_off': 1.,
+    'min_sp': 1.,
+    'max_sp': 30.
+}
+
+
+def findFiles(paths):
+    '''
+    Files in the given directories (recursively) or matching the globs
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.extend(glob.glob(path))
+    return sorted(set(files))
+
+
+def scanFile(filename):
+    '''
+    Reads the headers of a waveform file, runs in the process pool
+
+    ::return::
+    list of (filename, seed id, starttime, endtime, sampling rate)
+    '''
+    try:
+        st = read(filename, headonly=True)
+    except Exception:
+        return []
+    return [(filename, tr.id, tr.stats.starttime.timestamp,
+             tr.stats.endtime.timestamp, tr.stats.sampling_rate)
+            for tr in st]
+
+
+def staltaPicks(st, start, params, end=None):
+    '''
+    Recursive STA/LTA picker, P on vertical and S on horizontal channels.
+    An S pick is the first horizontal trigger between min_sp and max_sp
+    after a P pick
+
+    :param start: picks before this timestamp are dropped, they belong
+                  to the previous chunk
+    :param end: P picks from this timestamp on are dropped, they belong
+                to the next chunk. S picks of earlier P picks are kept
+    ::return::
+    list of pick dicts with timestamps
+    '''
+    from obspy.signal.trigger import recursive_sta_lta, trigger_onset
+
+    st.detrend('demean')
+    st.filter('bandpass', freqmin=params['freqmin'],
+              freqmax=params['freqmax'])
+
+    def _onsets(tr):
+        df = tr.stats.sampling_rate
+        if tr.stats.npts <= params['lta'] * df:
+            return np.array([], dtype=int)
+        cft = recursive_sta_lta(tr.data, int(params['sta'] * df),
+                                int(params['lta'] * df))
+        onsets = trigger_onset(cft, params['trigger_on'],
+                               params['trigger_off'])
+        return np.array([onset[0] for onset in onsets], dtype=int)
+
+    horizontal = []
+    for tr in st:
+        if tr.stats.channel[-1] in 'NE12':
+            onsets = _onsets(tr)
+            horizontal.append((tr, tr.stats.starttime.timestamp +
+                               onsets / tr.stats.sampling_rate, onsets))
+
+    picks = []
+    for tr in st:
+        if tr.stats.channel[-1] != 'Z':
+            continue
+        for onset in _onsets(tr):
+            time_p = tr.stats.starttime.timestamp +\
+                onset / tr.stats.sampling_rate
+            if time_p < start or end is not None and time_p >= end:
+                continue
+            picks.append({'station_id': tr.id, 'phase': 'P', 'time': time_p,
+                          'amplitude': float(tr.data[onset])})
+            s_picks = []
+            for h_tr, times, onsets in horizontal:
+                i = np.searchsorted(times, time_p + params['min_sp'])
+                if i < len(times) and times[i] < time_p + params['max_sp']:
+                    s_picks.append((times[i], h_tr, onsets[i]))
+            if s_picks:
+                time_s, h_tr, onset_s = min(s_picks, key=lambda s: s[0])
+                picks.append({'station_id': h_tr.id, 'phase': 'S',
+                              'time': time_s,
+                              'amplitude': float(h_tr.data[onset_s])})
+    return picks
+
+
+def pickChunk(task):
+    '''
+    Reads and picks one station for one time chunk, runs in the process
+    pool. Only this chunk of data is in memory. The data is read from lta
+    before the chunk for the STA/LTA to settle and up to max_sp after it,
+    so S picks of P picks at the end of the chunk are found. Unreadable
+    files are skipped
+
+    :param task: (files, starttime, endtime, picker parameters)
+
+    ::return::
+    dict with the picks, the amount of data processed and the list of
+    (filename, error message) of the skipped files
+    '''
+    files, start, end, params = task
+    st = Stream()
+    errors = []
+    for filename in files:
+        try:
+            st += read(filename, starttime=UTCDateTime(start - params['lta']),
+                       endtime=UTCDateTime(end + params['max_sp']))
+        except Exception as e:
+            errors.append((filename, str(e)))
+    st.merge(fill_value=0)
+    stats = {'samples': sum(tr.stats.npts for tr in st),
+             'bytes': sum(tr.data.nbytes for tr in st),
+             'seconds': sum(tr.stats.npts / tr.stats.sampling_rate
+                            for tr in st),
+             'errors': errors}
+    stats['picks'] = staltaPicks(st, start, params, end)
+    return stats
+
+
+class BatchScheduler(object):
+    '''
+    UpdateScheduler without an event loop, flushed explicitly
+    '''
+    def __init__(self):
+        self._dirty = OrderedDict()
+
+    def schedule(self, key, callback):
+        self._dirty[key] = callback
+
+    def isDirty(self, key):
+        return key in self._dirty
+
+    def flush(self):
+        while self._dirty:
+            dirty, self._dirty = self._dirty, OrderedDict()
+            for callback in dirty.values():
+                callback()
+
+
+class SerialWorkers(object):
+    '''
+    WorkerPool replacement running jobs immediately
+    '''
+    npending = 0
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        try:
+            result = func(*args)
+        except Exception:
+            if errback is None:
+                raise
+            errback(traceback.format_exc())
+            return
+        if callback is not None:
+            callback(result)
+
+    def close(self):
+        pass
+
+
+class BatchSession(object):
+    '''
+    Headless stand-in for the wavePicker main window, holds Stations()
+    and Events() so the locator and the exporters run without a GUI
+    '''
+    def __init__(self, stream, project_name='batch'):
+        '''
+        :param stream: obspy.core.Stream, header only traces suffice
+        '''
+        self.project_name = project_name
+        self.nplots = 0
+        self.visibleChannel = 'Z'
+        self.stackedComponents = False
+        self.rotatedComponents = False
+        self.spectrogramEnabled = False
+        self.filterArgs = None
+        self.qtGraphLayout = None
+
+        self.scheduler = BatchScheduler()
+        self.workers = SerialWorkers()
+        self.responses = ResponseCorrector(self)
+        self.rotator = Rotator(self)
+        self.memory = MemoryManager(self)
+        self.undo = UndoStack(self, limit=0)
+        self.events = Events(self)
+        self.stations = Stations(stream, self)
+        self.locator = GridLocator(self, table=TravelTimeTable())
+        self.magnitudes = MagnitudeEngine(self)
+
+    def addEvents(self, events):
+        '''
+        Adds associated pick lists as Event()s and locates them
+        '''
+        addEvents(self.events, events, stationCoordinates(self.stations))
+        self.scheduler.flush()
+
+    def export(self, output):
+        '''
+        Writes JSON, CSV and Hypoinverse phase and station files
+        '''
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        base = os.path.join(output, self.project_name)
+        self.events.exportJSON(base + '.json')
+        self.events.exportCSV(base + '.csv')
+        self.events.exportAllEventsPhases(base + '.phs')
+        self.stations.exportHypStaFile(base + '.sta')
+
+
+def headerStream(records, inventory=None):
+    '''
+    Stream of data-less traces, one per channel, for Stations()
+    '''
+    st = Stream()
+    for seed_id, starttime, sampling_rate in records:
+        network, station, location, channel = seed_id.split('.')
+        tr = Trace(header={'network': network, 'station': station,
+                           'location': location, 'channel': channel,
+                           'starttime': UTCDateTime(starttime),
+                           'sampling_rate': sampling_rate})
+        tr.stats.coordinates = AttribDict(
+            {'latitude': 0., 'longitude': 0., 'elevation': 0.})
+        if inventory is not None:
+            try:
+                tr.stats.coordinates.update(
+                    inventory.get_coordinates(seed_id, tr.stats.starttime))
+            except Exception:
+                pass
+        st += tr
+    return st
+
+
+class Throughput(object):
+    '''
+    Running throughput statistics of a batch run
+    '''
+    def __init__(self, ntasks):
+        self.ntasks = ntasks
+        self.ndone = 0
+        self.samples = 0
+        self.bytes = 0
+        self.seconds = 0.
+        self.npicks = 0
+        self.started = time.time()
+
+    def add(self, result):
+        self.ndone += 1
+        self.samples += result['samples']
+        self.bytes += result['bytes']
+        self.seconds += result['seconds']
+        self.npicks += len(result['picks'])
+
+    def report(self):
+        wall = max(time.time() - self.started, 1e-6)
+        return ('%d/%d chunks, %.1f h of data, %.2e samples/s, %.1f MB/s, '
+                '%.0fx realtime, %d picks, %.0f s elapsed'
+                % (self.ndone, self.ntasks, self.seconds / 3600.,
+                   self.samples / wall, self.bytes / wall / 1024.**2,
+                   self.seconds / wall, self.npicks, wall))
+
+
+def run(paths, output, project_name='batch', inventory=None,
+        chunk_length=86400., nprocesses=None, picker=None,
+        window=15., min_stations=4, log=sys.stderr):
+    '''
+    Scans, picks, associates and exports a set of waveform files
+
+    :param paths: list of directories or globs
+    :param chunk_length: Seconds of data per station and task, bounds the
+                         memory of each process, type float (default: 1 day)
+    :param picker: STA/LTA parameters updating DEFAULT_PICKER, type dict
+    :return: BatchSession() with the picked events
+    '''
+    params = dict(DEFAULT_PICKER, **(picker or {}))
+    if inventory is not None and not hasattr(inventory, 'get_coordinates'):
+        from obspy import read_inventory
+        inventory = read_inventory(inventory)
+
+    pool = Pool(nprocesses or cpu_count(), maxtasksperchild=100)
+    try:
+        files = findFiles(paths)
+        log.write('Scanning %d files\n' % len(files))
+        station_files = OrderedDict()
+        channels = OrderedDict()
+        for records in pool.imap_unordered(scanFile, files, chunksize=16):
+            for filename, seed_id, start, end, sampling_rate in records:
+                key = tuple(seed_id.split('.')[:2])
+                entry = station_files.setdefault(key, {'files': {},
+                                                       'start': start,
+                                                       'end': end})
+                span = entry['files'].setdefault(filename, [start, end])
+                span[0], span[1] = min(span[0], start), max(span[1], end)
+                entry['start'] = min(entry['start'], start)
+                entry['end'] = max(entry['end'], end)
+                channels.setdefault(seed_id, (seed_id, start, sampling_rate))
+
+        tasks = []
+        for entry in station_files.values():
+            start = entry['start']
+            while start < entry['end']:
+                end = min(start + chunk_length, entry['end'])
+                # only the files overlapping the read window of the chunk
+                files = sorted(filename for filename, (first, last)
+                               in entry['files'].items()
+                               if first <= end + params['max_sp'] and
+                               last >= start - params['lta'])
+                tasks.append((files, start, end, params))
+                start += chunk_length
+
+        throughput = Throughput(len(tasks))
+        picks = []
+        for result in pool.imap_unordered(pickChunk, tasks):
+            throughput.add(result)
+            picks.extend(result['picks'])
+            for filename, error in result['errors']:
+                log.write('Skipped %s: %s\n' % (filename, error))
+            if throughput.ndone % max(len(tasks) // 20, 1) == 0:
+                log.write(throughput.report() + '\n')
+    finally:
+        pool.close()
+        pool.join()
+
+    session = BatchSession(headerStream(channels.values(), inventory),
+                           project_name)
+    events = associate(picks, window=window, min_stations=min_stations,
+                       max_sp=params['max_sp'],
+                       coordinates=stationCoordinates(session.stations))
+    session.addEvents(events)
+    session.export(output)
+    log.write('%s\n%d events written to %s\n'
+              % (throughput.report(), len(events), output))
+    return session
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Auto-pick and associate directories of waveform files')
+    parser.add_argument('paths', nargs='+',
+                        help='directories or globs of waveform files')
+    parser.add_argument('-o', '--output', default='.',
+                        help='output directory')
+    parser.add_argument('-n', '--name', default='batch',
+                        help='project name of the output files')
+    parser.add_argument('--inventory', help='StationXML with coordinates')
+    parser.add_argument('--chunk', type=float, default=24.,
+                        help='hours of data per task (default: 24)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of processes (default: cpu count)')
+    parser.add_argument('--window', type=float, default=15.,
+                        help='association window in s (default: 15)')
+    parser.add_argument('--min-stations', type=int, default=4,
+                        help='stations per event (default: 4)')
+    for key, value in sorted(DEFAULT_PICKER.items()):
+        parser.add_argument('--%s' % key.replace('_', '-'), type=float,
+                            default=value, dest=key,
+                            help='picker %s (default: %g)' % (key, value))
+    args = parser.parse_args(argv)
+
+    run(args.paths, args.output, project_name=args.name,
+        inventory=args.inventory, chunk_length=args.chunk * 3600.,
+        nprocesses=args.processes,
+        picker=dict((key, getattr(args, key)) for key in DEFAULT_PICKER),
+        window=args.window, min_stations=args.min_stations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import os
+
+
+def cacheDir(subdir=''):
+    '''
+    Returns the on-disk cache directory ~/.wavePicker/<subdir>, the
+    directory is created if necessary
+    '''
+    path = os.path.join(os.path.expanduser('~'), '.wavePicker', subdir)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+class LRUCache(object):
+    '''
+    Least recently used cache for NumPy arrays bounded by bytes
+
+    Values need an nbytes attribute, a data array like obspy traces or a
+    tuple of those, the oldest entries are evicted once maxbytes is
+    exceeded. Callables in listeners are called with key, value and
+    whether the entry was added or removed, e.g. for memory accounting.
+    '''
+    def __init__(self, maxbytes=256*1024**2):
+        '''
+        :param maxbytes: Size limit in bytes, type int (default: 256 MB)
+        '''
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.listeners = []
+        self._items = OrderedDict()
+
+    @staticmethod
+    def sizeOf(value):
+        if isinstance(value, (tuple, list)):
+            return sum(LRUCache.sizeOf(v) for v in value)
+        if hasattr(value, 'data') and hasattr(value.data, 'nbytes'):
+            return value.data.nbytes
+        return getattr(value, 'nbytes', 0)
+
+    def _notify(self, key, value, added):
+        for listener in self.listeners:
+            listener(key, value, added)
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        if key in self._items:
+            old = self._items.pop(key)
+            self.nbytes -= self.sizeOf(old)
+            self._notify(key, old, False)
+        self._items[key] = value
+        self.nbytes += self.sizeOf(value)
+        self._notify(key, value, True)
+        self.evict(self.maxbytes)
+
+    def evict(self, maxbytes):
+        '''
+        Drops least recently used entries until nbytes <= maxbytes
+        '''
+        while self.nbytes > maxbytes and self._items:
+            key, value = self._items.popitem(last=False)
+            self.nbytes -= self.sizeOf(value)
+            self._notify(key, value, False)
+
+    def pop(self, key, default=None):
+        if key not in self._items:
+            return default
+        value = self._items.pop(key)
+        self.nbytes -= self.sizeOf(value)
+        self._notify(key, value, False)
+        return value
+
+    def clear(self):
+        items, self._items = self._items, OrderedDict()
+        self.nbytes = 0
+        for key, value in items.items():
+            self._notify(key, value, False)
+
+    def keys(self):
+        return list(self._items.keys())
+
+    def items(self):
+        '''
+        :return: list of (key, value), least recently used first
+        '''
+        return list(self._items.items())
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
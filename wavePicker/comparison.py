@@ -0,0 +1,314 @@
+'''
+Comparison of two pick catalogs, e.g. automatic against analyst picks
+
+Picks are matched per station and phase within a time tolerance using
+sorted arrays and binary search. Precision, recall and residual
+statistics are reported per station and phase. Run headless as
+
+    wavepicker-compare reference.json candidate.json --tolerance 0.5
+
+or from the GUI through File > Compare Picks, which draws the candidate
+picks over the station plots.
+'''
+import numpy as np
+import pyqtgraph as pg
+from PySide.QtCore import Qt
+
+import argparse
+import json
+import sys
+
+PICK_DTYPE = [('station', 'U16'), ('phase', 'U8'), ('time', 'f8'),
+              ('event_id', 'i8')]
+
+REPORT_DTYPE = [('station', 'U16'), ('phase', 'U8'), ('n_reference', 'i8'),
+                ('n_candidate', 'i8'), ('n_matched', 'i8'),
+                ('precision', 'f8'), ('recall', 'f8'), ('mean', 'f8'),
+                ('std', 'f8'), ('median', 'f8'), ('p05', 'f8'),
+                ('p95', 'f8')]
+
+
+def _timestamps(times):
+    '''
+    Timestamps of ISO time strings as written by UTCDateTime, vectorized
+    '''
+    times = np.array([time.rstrip('Z') for time in times],
+                     dtype='datetime64[us]')
+    return times.astype('i8') / 1e6
+
+
+def readPicks(filename):
+    '''
+    Reads the picks of an Events.exportJSON file
+
+    ::return::
+    picks as structured array of PICK_DTYPE
+    '''
+    with open(filename, 'r') as json_file:
+        rows = json.load(json_file)
+    picks = np.zeros(len(rows), dtype=PICK_DTYPE)
+    picks['station'] = ['.'.join(row['station_id'].split('.')[:2])
+                        for row in rows]
+    picks['phase'] = [row['phase'] for row in rows]
+    picks['time'] = _timestamps([row['time'] for row in rows])
+    picks['event_id'] = [row.get('event_id', -1) for row in rows]
+    return picks
+
+
+def eventPicks(events):
+    '''
+    Picks of an Events() container as structured array of PICK_DTYPE
+    '''
+    events.loadAllEvents()
+    picks = [pick for event in events for pick in event.picks]
+    table = np.zeros(len(picks), dtype=PICK_DTYPE)
+    table['station'] = ['%s.%s' % (pick.network, pick.station)
+                        for pick in picks]
+    table['phase'] = [pick.phase.name for pick in picks]
+    table['time'] = [pick.time.timestamp for pick in picks]
+    table['event_id'] = [pick.event.id for pick in picks]
+    return table
+
+
+def _groupIds(reference, candidate):
+    '''
+    Integer id of the (station, phase) group of every pick of both sets
+
+    ::return::
+    unique (station, phase) pairs, ids of reference and of candidate
+    '''
+    keys = np.char.add(np.char.add(
+        np.concatenate([reference['station'], candidate['station']]), ' '),
+        np.concatenate([reference['phase'], candidate['phase']]))
+    unique, ids = np.unique(keys, return_inverse=True)
+    return unique, ids[:len(reference)], ids[len(reference):]
+
+
+def matchPicks(reference, candidate, tolerance=.5, groups=None):
+    '''
+    One to one matching of picks with the same station and phase
+
+    Both sets are sorted by group and time into one key, every candidate
+    is looked up with a binary search and paired with the nearest
+    reference pick within tolerance. Conflicts are resolved in order of
+    the absolute residual, a candidate losing its nearest reference pick
+    stays unmatched.
+
+    :param tolerance: Maximum time difference in s, type float
+    :param groups: _groupIds() of the sets if already computed
+
+    ::return::
+    indices into reference and candidate of the matched pairs
+    '''
+    if not len(reference) or not len(candidate):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    _, ref_group, cand_group = groups or _groupIds(reference, candidate)
+    tmin = min(reference['time'].min(), candidate['time'].min())
+    span = max(reference['time'].max(), candidate['time'].max()) - tmin +\
+        4. * tolerance + 1.
+    ref_key = ref_group * span + (reference['time'] - tmin)
+    cand_key = cand_group * span + (candidate['time'] - tmin)
+
+    order = np.argsort(ref_key, kind='mergesort')
+    ref_sorted = ref_key[order]
+    right = np.clip(np.searchsorted(ref_sorted, cand_key), 0, len(order) - 1)
+    left = np.clip(right - 1, 0, len(order) - 1)
+    nearest = np.where(np.abs(ref_sorted[left] - cand_key) <
+                       np.abs(ref_sorted[right] - cand_key), left, right)
+    distance = np.abs(ref_sorted[nearest] - cand_key)
+    valid = (distance <= tolerance) & (ref_group[order[nearest]] == cand_group)
+
+    cand_idx = np.nonzero(valid)[0]
+    ref_idx = order[nearest[valid]]
+    by_distance = np.argsort(distance[valid], kind='mergesort')
+    cand_idx, ref_idx = cand_idx[by_distance], ref_idx[by_distance]
+    _, first = np.unique(ref_idx, return_index=True)
+    first.sort()
+    return ref_idx[first], cand_idx[first]
+
+
+def _quantiles(values, groups, ngroups, qs):
+    '''
+    Quantiles of values per group, vectorized over all groups
+    '''
+    order = np.lexsort((values, groups))
+    values, groups = values[order], groups[order]
+    counts = np.bincount(groups, minlength=ngroups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    result = np.full((len(qs), ngroups), np.nan)
+    has = counts > 0
+    for i, q in enumerate(qs):
+        position = starts[has] + q * (counts[has] - 1)
+        low = np.floor(position).astype(int)
+        high = np.ceil(position).astype(int)
+        result[i, has] = values[low] + (position - low) *\
+            (values[high] - values[low])
+    return result
+
+
+def evaluate(reference, candidate, tolerance=.5):
+    '''
+    Matches two pick sets and computes the statistics per station and
+    phase, the last row '*' '*' holds the totals
+
+    Residuals are candidate minus reference time in s.
+
+    ::return::
+    report as structured array of REPORT_DTYPE, residuals of the
+    matched pairs and the (reference, candidate) indices of the pairs
+    '''
+    groups = _groupIds(reference, candidate)
+    ref_idx, cand_idx = matchPicks(reference, candidate, tolerance, groups)
+    unique, ref_group, cand_group = groups
+    ngroups = len(unique)
+    residuals = candidate['time'][cand_idx] - reference['time'][ref_idx]
+    groups = ref_group[ref_idx]
+
+    report = np.zeros(ngroups + 1, dtype=REPORT_DTYPE)
+    report['station'][:-1] = [key.split(' ')[0] for key in unique]
+    report['phase'][:-1] = [key.split(' ')[1] for key in unique]
+    report['station'][-1] = report['phase'][-1] = '*'
+    report['n_reference'][:-1] = np.bincount(ref_group, minlength=ngroups)
+    report['n_candidate'][:-1] = np.bincount(cand_group, minlength=ngroups)
+    report['n_matched'][:-1] = np.bincount(groups, minlength=ngroups)
+    report['mean'][:-1] = np.bincount(groups, residuals, ngroups)
+    report['std'][:-1] = np.bincount(groups, residuals ** 2, ngroups)
+    quantiles = _quantiles(residuals, groups, ngroups, (.5, .05, .95))
+    report['median'][:-1], report['p05'][:-1], report['p95'][:-1] = quantiles
+
+    total = report[-1]
+    for key in ('n_reference', 'n_candidate', 'n_matched', 'mean', 'std'):
+        total[key] = report[key][:-1].sum()
+    if len(residuals):
+        total['median'], total['p05'], total['p95'] = np.percentile(
+            residuals, [50, 5, 95])
+    else:
+        total['median'] = total['p05'] = total['p95'] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        matched = report['n_matched'].astype(float)
+        report['precision'] = matched / report['n_candidate']
+        report['recall'] = matched / report['n_reference']
+        report['mean'] /= matched
+        report['std'] = np.sqrt(np.maximum(report['std'] / matched -
+                                           report['mean'] ** 2, 0.))
+    return report, residuals, (ref_idx, cand_idx)
+
+
+def formatReport(report):
+    '''
+    Report of evaluate() as text table
+    '''
+    lines = ['%-12s %-5s %7s %7s %7s %6s %6s %7s %7s %7s %7s %7s' %
+             ('station', 'phase', 'nref', 'ncand', 'nmatch', 'prec',
+              'recall', 'mean', 'std', 'median', 'p05', 'p95')]
+    for row in report:
+        lines.append('%-12s %-5s %7d %7d %7d %6.3f %6.3f %7.3f %7.3f %7.3f '
+                     '%7.3f %7.3f' % tuple(row))
+    return '\n'.join(lines)
+
+
+class ComparisonOverlay(object):
+    '''
+    Candidate picks drawn over the visible station plots, matched picks
+    to the current Events() in green and unmatched ones in red
+    '''
+    def __init__(self, parent, tolerance=.5):
+        '''
+        :param parent: wavePicker main window
+        :param tolerance: Matching tolerance in s, type float
+        '''
+        self.parent = parent
+        self.tolerance = tolerance
+        self.enabled = False
+        self.candidates = np.zeros(0, dtype=PICK_DTYPE)
+        self.matched = np.zeros(0, dtype=bool)
+        self.report = None
+        self.lines = {}
+
+    def load(self, filename):
+        '''
+        Compares the picks of filename against the current events
+
+        ::return::
+        report of evaluate()
+        '''
+        self._removeLines(list(self.lines))
+        candidates = readPicks(filename)
+        self.report, _, (_, cand_idx) = evaluate(
+            eventPicks(self.parent.events), candidates, self.tolerance)
+        matched = np.zeros(len(candidates), dtype=bool)
+        matched[cand_idx] = True
+        order = np.lexsort((candidates['time'], candidates['station']))
+        self.candidates, self.matched = candidates[order], matched[order]
+        self.enabled = True
+        self.updateOverlay()
+        return self.report
+
+    def setEnabled(self, enabled=True):
+        self.enabled = enabled
+        self.updateOverlay()
+
+    def _stationPicks(self, station, start, end):
+        '''
+        Candidate picks of a Station() between start and end timestamps
+        '''
+        code = '%s.%s' % (station.stats.network, station.stats.station)
+        first = np.searchsorted(self.candidates['station'], code, 'left')
+        last = np.searchsorted(self.candidates['station'], code, 'right')
+        times = self.candidates['time'][first:last]
+        first, last = (first + np.searchsorted(times, start),
+                       first + np.searchsorted(times, end))
+        return self.candidates[first:last], self.matched[first:last]
+
+    def updateOverlay(self):
+        '''
+        Draws the candidate picks of all visible stations
+        '''
+        stations = []
+        if self.enabled:
+            stations = [station for station in
+                        self.parent.stations.visibleStations()
+                        if station.plotItem is not None]
+        self._removeLines([station for station in self.lines
+                           if station not in stations or
+                           self.lines[station][0] is not station.plotItem])
+        for station in stations:
+            if station in self.lines:
+                continue
+            channel = station.getSelectedChannel() or station.channels[0]
+            stats = channel.tr.stats
+            picks, matched = self._stationPicks(
+                station, stats.starttime.timestamp, stats.endtime.timestamp)
+            lines = []
+            for pick, match in zip(picks, matched):
+                line = pg.InfiniteLine(
+                    pos=(pick['time'] - stats.starttime.timestamp) /
+                    stats.delta,
+                    pen=pg.mkPen('g' if match else 'r', style=Qt.DotLine))
+                station.plotItem.addItem(line)
+                lines.append(line)
+            self.lines[station] = (station.plotItem, lines)
+
+    def _removeLines(self, stations):
+        for station in stations:
+            for line in self.lines.pop(station)[1]:
+                if line.getViewBox() is not None:
+                    line.getViewBox().removeItem(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare two pick catalogs written by wavePicker')
+    parser.add_argument('reference', help='reference picks, JSON')
+    parser.add_argument('candidate', help='candidate picks, JSON')
+    parser.add_argument('-t', '--tolerance', type=float, default=.5,
+                        help='matching tolerance in s (default: 0.5)')
+    parser.add_argument('--totals', action='store_true',
+                        help='only print the totals')
+    args = parser.parse_args(argv)
+
+    report, _, _ = evaluate(readPicks(args.reference),
+                            readPicks(args.candidate), args.tolerance)
+    sys.stdout.write(formatReport(report[-1:] if args.totals else report) +
+                     '\n')
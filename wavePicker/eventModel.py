@@ -0,0 +1,249 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+from guiContainer import Event
+
+
+class EventStation(object):
+    '''
+    Lightweight node for the station level of the event tree, created on
+    demand when the view asks for the row
+    '''
+    __slots__ = ('event', 'station')
+
+    def __init__(self, event, station):
+        self.event = event
+        self.station = station
+
+    def picks(self):
+        return self.event.station_picks[self.station]
+
+
+class EventTreeModel(QAbstractItemModel):
+    '''
+    Item model presenting Events() as tree Event > Station > Pick
+
+    No items are stored, rows are derived from Event.station_picks when the
+    view asks for them. Events and Event call the insert/remove helpers
+    around their changes so only the affected rows are signalled. Rows of
+    events and stations are looked up in maps, appending keeps them valid
+    and removals rebuild them on the next lookup.
+    '''
+    def __init__(self, events):
+        '''
+        :param events: Events() container backing the model
+        '''
+        super(EventTreeModel, self).__init__()
+        self.events = events
+        self._eventRows = {}    # Event() and row
+        self._stationRows = {}  # Event() and (dict of station and row,
+                                # list of stations)
+        self.modelAboutToBeReset.connect(self._clearRows)
+
+    def _clearRows(self):
+        self._eventRows = {}
+        self._stationRows = {}
+
+    def _eventRow(self, event):
+        events = self.events.events
+        row = self._eventRows.get(event)
+        if row is not None and row < len(events) and events[row] is event:
+            return row
+        if events and events[-1] is event:
+            row = self._eventRows[event] = len(events) - 1
+            return row
+        self._eventRows = dict((e, i) for i, e in enumerate(events))
+        return self._eventRows[event]
+
+    def _stations(self, event):
+        '''
+        :return: (dict of station and row, list of stations) of event
+        '''
+        rows = self._stationRows.get(event)
+        nstations = len(event.station_picks)
+        if rows is not None and len(rows[1]) == nstations:
+            return rows
+        if rows is not None and len(rows[1]) + 1 == nstations:
+            station = next(reversed(event.station_picks))
+            if station not in rows[0]:
+                rows[0][station] = len(rows[1])
+                rows[1].append(station)
+                return rows
+        stations = list(event.station_picks.keys())
+        rows = self._stationRows[event] = (
+            dict((station, i) for i, station in enumerate(stations)),
+            stations)
+        return rows
+
+    '''
+    Index helpers
+    '''
+    def itemFromIndex(self, index):
+        '''
+        :return: Event(), EventStation() or Pick() of index
+        '''
+        if not index.isValid():
+            return None
+        return index.internalPointer()
+
+    def eventIndex(self, event, column=0):
+        return self.createIndex(self._eventRow(event), column, event)
+
+    def stationIndex(self, event, station, column=0):
+        row = self._stations(event)[0][station]
+        return self.createIndex(row, column, self._stationNode(event, station))
+
+    def pickIndex(self, pick, column=0):
+        row = pick.event.station_picks[pick.station].index(pick)
+        return self.createIndex(row, column, pick)
+
+    def _stationNode(self, event, station):
+        node = event.station_nodes.get(station)
+        if node is None:
+            node = event.station_nodes[station] = EventStation(event, station)
+        return node
+
+    '''
+    QAbstractItemModel interface
+    '''
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        item = self.itemFromIndex(parent)
+        if item is None:
+            return self.createIndex(row, column, self.events.events[row])
+        if isinstance(item, EventStation):
+            return self.createIndex(row, column, item.picks()[row])
+        station = self._stations(item)[1][row]
+        return self.createIndex(row, column, self._stationNode(item, station))
+
+    def parent(self, index):
+        item = self.itemFromIndex(index)
+        if item is None or isinstance(item, Event):
+            return QModelIndex()
+        if isinstance(item, EventStation):
+            return self.eventIndex(item.event)
+        return self.stationIndex(item.event, item.station)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        item = self.itemFromIndex(parent)
+        if item is None:
+            return len(self.events.events)
+        if isinstance(item, Event):
+            return len(item.station_picks)
+        if isinstance(item, EventStation):
+            return len(item.picks())
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 2
+
+    def hasChildren(self, parent=QModelIndex()):
+        item = self.itemFromIndex(parent)
+        if isinstance(item, Event) and not item.loaded:
+            return item.nstations > 0
+        return self.rowCount(parent) > 0
+
+    def canFetchMore(self, parent):
+        item = self.itemFromIndex(parent)
+        return isinstance(item, Event) and not item.loaded
+
+    def fetchMore(self, parent):
+        self.itemFromIndex(parent).loadPicks()
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        item = self.itemFromIndex(index)
+        if item is None:
+            return None
+        column = index.column()
+        if isinstance(item, Event):
+            return self._eventData(item, column, role)
+        if isinstance(item, EventStation):
+            return self._stationData(item, column, role)
+        return self._pickData(item, column, role)
+
+    def _eventData(self, event, column, role):
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return 'Ev %d' % event.id
+            text = '%d Stations' % event.nstations
+            if event.location is not None:
+                text += ' RMS %.2fs' % event.location['rms']
+            if event.magnitude is not None:
+                text += ' ML %.1f' % event.magnitude
+            return text
+        if role == Qt.ToolTipRole and event.location is not None:
+            return ('%(origin_time)s\n%(latitude).4f N %(longitude).4f E '
+                    '%(depth).1f km\nRMS %(rms).3f s from %(npicks)d picks'
+                    % event.location)
+        if role == Qt.FontRole:
+            return QFont('', 10, QFont.Bold if event.active else QFont.Normal)
+
+    def _stationData(self, node, column, role):
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return node.station
+            npicks = len(node.picks())
+            return '%d %s' % (npicks, 'Pick' if npicks == 1 else 'Picks')
+
+    def _pickData(self, pick, column, role):
+        if column != 1:
+            return None
+        if role == Qt.DisplayRole:
+            return '%s - %s\n%s' % (pick.phase.name, pick.station_id,
+                                    pick.time)
+        if role == Qt.FontRole:
+            return QFont('', 8, QFont.Bold if pick.pickHighlighted
+                         else QFont.Normal)
+        if role == Qt.BackgroundRole:
+            return QBrush(pick.phase.qcolor)
+
+    '''
+    Change notifications called by Events() and Event()
+    '''
+    def beginInsertEvent(self, row):
+        self.beginInsertRows(QModelIndex(), row, row)
+
+    def beginRemoveEvent(self, event):
+        row = self._eventRow(event)
+        self._eventRows.pop(event, None)
+        self._stationRows.pop(event, None)
+        self.beginRemoveRows(QModelIndex(), row, row)
+
+    def beginInsertStation(self, event):
+        row = len(event.station_picks)
+        self.beginInsertRows(self.eventIndex(event), row, row)
+
+    def beginRemoveStation(self, event, station):
+        row = self._stations(event)[0][station]
+        self._stationRows.pop(event, None)
+        self.beginRemoveRows(self.eventIndex(event), row, row)
+
+    def beginInsertPick(self, event, station):
+        row = len(event.station_picks[station])
+        self.beginInsertRows(self.stationIndex(event, station), row, row)
+
+    def beginRemovePick(self, pick):
+        row = pick.event.station_picks[pick.station].index(pick)
+        self.beginRemoveRows(self.stationIndex(pick.event, pick.station),
+                             row, row)
+
+    def eventChanged(self, event):
+        self.dataChanged.emit(self.eventIndex(event, 0),
+                              self.eventIndex(event, 1))
+
+    def stationChanged(self, event, station):
+        if station not in event.station_picks:
+            return
+        self.dataChanged.emit(self.stationIndex(event, station, 0),
+                              self.stationIndex(event, station, 1))
+
+    def pickChanged(self, pick):
+        self.dataChanged.emit(self.pickIndex(pick, 0), self.pickIndex(pick, 1))
@@ -1,20 +1,117 @@
 from PySide.QtGui import *
 from PySide.QtCore import *
 
-from obspy.core import UTCDateTime, AttribDict, Stream
+from obspy.core import UTCDateTime, AttribDict, Stream, Trace
 
 import pyqtgraph as pg
+import numpy as np
 
 import os
+from collections import OrderedDict
+
+from undo import pickFields
+
+
+def bandpassSOS(filterArgs, sampling_rate):
+    '''
+    Butterworth second order sections of the bandpass, falls back to a
+    highpass if freqmax is above Nyquist as obspy.signal.filter.bandpass
+    '''
+    from scipy.signal import iirfilter
+    nyquist = .5 * sampling_rate
+    low = filterArgs['freqmin'] / nyquist
+    high = filterArgs['freqmax'] / nyquist
+    if low > 1:
+        raise ValueError('Selected low corner frequency is above Nyquist.')
+    if high - 1. > -1e-6:
+        return iirfilter(filterArgs.get('corners', 4), low, btype='highpass',
+                         ftype='butter', output='sos')
+    return iirfilter(filterArgs.get('corners', 4), [low, high], btype='band',
+                     ftype='butter', output='sos')
+
+
+def sosFilter(sos, data, out, zerophase=False, chunk=2**16):
+    '''
+    Applies the filter chunk by chunk into out, so only chunk sized
+    temporaries are allocated. The zerophase backward pass runs in place
+    on out, same as obspy's forward-backward filter
+
+    :param data: input samples
+    :param out: output array of len(data), may be float32
+    '''
+    from scipy.signal import sosfilt
+
+    def _pass(source, target):
+        zi = np.zeros((sos.shape[0], 2))
+        for start in range(0, len(source), chunk):
+            target[start:start + chunk], zi = sosfilt(
+                sos, source[start:start + chunk], zi=zi)
+    _pass(data, out)
+    if zerophase:
+        _pass(out[::-1], out[::-1])
+    return out
+
+
+def processTrace(tr, filterArgs, out=None):
+    '''
+    Filters a trace into a float32 display array, runs in the WorkerPool.
+    The header is shared with tr and the samples are not copied first
+
+    :param out: float32 work buffer of at least npts samples, a new
+                array is allocated if None
+
+    ::return::
+    processed obspy.core.trace and its absolute peak
+    '''
+    npts = tr.stats.npts
+    if out is None or len(out) < npts:
+        out = np.empty(npts, dtype=np.float32)
+    data = out[:npts]
+    if npts and filterArgs is not None:
+        sosFilter(bandpassSOS(filterArgs, tr.stats.sampling_rate), tr.data,
+                  data, zerophase=filterArgs.get('zerophase', False))
+    else:
+        data[:] = tr.data
+    plotTrace = Trace()
+    plotTrace.stats = tr.stats
+    plotTrace.data = data
+    return plotTrace, (float(np.abs(data).max()) if npts else 0.)
+
+
+_sample_indices = {}
+
+
+def sampleIndex(npts):
+    '''
+    Shared x array 0..npts-1 for pg.PlotCurveItem.setData, so the curves
+    do not allocate their own
+    '''
+    index = _sample_indices.get(npts)
+    if index is None:
+        if len(_sample_indices) > 16:
+            _sample_indices.clear()
+        index = np.arange(npts, dtype=np.float32 if npts < 2**24
+                          else np.float64)
+        _sample_indices[npts] = index
+    return index
+
+
+def filterKey(filterArgs):
+    '''
+    Hashable key of the filter arguments, None if unfiltered
+    '''
+    return (None if filterArgs is None
+            else tuple(sorted(filterArgs.items())))
 
 
 class Channel(object):
     '''
     Channel Container Object handels an individual channel
 
-    self.QChannelItem represents the QTreeWidgetItem
     self.traceItem is the inherited pyqtgraph.PlotCurveItem
     '''
+    rotated = False
+
     def __init__(self, tr, station):
         '''
         init the channel with parent Station() and obspy trace
@@ -26,28 +123,103 @@ class Channel(object):
         self.station = station
         self.channel = tr.stats.channel
 
-        self.QChannelItem = QTreeWidgetItem()
-        self.QChannelItem.setText(1, '%s @ %d Hz' %
-                                  (self.tr.stats.channel,
-                                   1./self.tr.stats.delta))
-        self.QChannelItem.setText(2, '%s\n%s' %
-                                  (self.tr.stats.starttime,
-                                   self.tr.stats.endtime))
-        self.QChannelItem.setFont(1, QFont('', 7))
-        self.QChannelItem.setFont(2, QFont('', 7))
-        self.station.QStationItem.addChild(self.QChannelItem)
+        self.traceItem = None
+        self.plotTrace = None
+        self.plot_key = None        # processing key last requested
+        self.plotTrace_key = None   # processing key of self.plotTrace
+        self.peak = None
+        self._front = None
+        self._free = []
+        self._coarse = None  # envelope while panning, see InteractionRenderer
+
+    def processingKey(self):
+        '''
+        Hashable key of the current instrument correction and filter
+        '''
+        main = self.station.parent.parent
+        return (main.responses.output, filterKey(main.filterArgs))
+
+    def processTraceData(self, callback, out=None, errback=None):
+        '''
+        Corrects and filters the trace in the WorkerPool
+
+        :param callback: called with (processed trace, peak)
+        :param out: float32 work buffer, see processTrace
+        :param errback: called with the traceback if the processing failed
+        '''
+        main = self.station.parent.parent
+        filterArgs = main.filterArgs
+
+        def _filter(traces):
+            main.workers.submit(processTrace, (traces[0], filterArgs, out),
+                                callback=callback, errback=errback)
+        if main.responses.output is None:
+            _filter([self.tr])
+        else:
+            main.responses.request([self.tr], _filter, errback=errback)
+
+    def _acquireBuffer(self):
+        '''
+        Work buffer for the next display array. Buffers are recycled once
+        a newer result is displayed, so slider drags do not allocate
+        '''
+        while self._free:
+            buffer = self._free.pop()
+            if len(buffer) >= self.tr.stats.npts:
+                return buffer
+        return np.empty(self.tr.stats.npts, dtype=np.float32)
+
+    def _releaseBuffer(self, buffer):
+        if buffer is not None and len(self._free) < 2:
+            self._free.append(buffer)
 
     def plotTraceItem(self):
         '''
-        Plots the pg.PlotCurveItem into self.station.plotItem
+        Processes the trace in the WorkerPool, the pg.PlotCurveItem is
+        updated once the data is ready
+        '''
+        key = self.processingKey()
+        if key == self.plot_key:
+            return
+        self.plot_key = key
+        prefetched = self.station.parent.parent.prefetcher.get(self, key)
+        if prefetched is not None:
+            self._setTraceData(key, prefetched)
+            return
+        buffer = self._acquireBuffer()
+        self.processTraceData(
+            lambda result: self._setTraceData(key, result, buffer),
+            out=buffer,
+            errback=lambda error: self._processingFailed(key))
+
+    def _processingFailed(self, key):
+        if key == self.plot_key:
+            self.plot_key = None  # replot on the next update
+
+    def _setTraceData(self, key, result, buffer=None):
         '''
-        self.plotTrace = self.tr.copy()
-        # Filter if necessary
-        if self.station.parent.parent.filterArgs is not None:
-            self.plotTrace.filter('bandpass',
-                                  **self.station.parent.parent.filterArgs)
-        self.traceItem.setData(y=self.plotTrace.data, antialias=True)
+        WorkerPool callback of plotTraceItem, stale results are dropped
+
+        :param buffer: work buffer holding the result, recycled once it
+                       is no longer displayed
+        '''
+        if key != self.plot_key or self.traceItem is None:
+            if self.traceItem is not None:
+                self._releaseBuffer(buffer)
+            return
+        self._releaseBuffer(self._front)
+        self._front = buffer
+        self.plotTrace, self.peak = result
+        self.plotTrace_key = key
+        renderer = self.station.parent.parent.renderer
+        if renderer.interacting:
+            renderer.setCoarse(self)
+        else:
+            self.traceItem.setData(x=sampleIndex(len(self.plotTrace.data)),
+                                   y=self.plotTrace.data, antialias=True)
         self.station.plotItem.getAxis('bottom').setScale(self.tr.stats.delta)
+        self.station.updateStackLayout()
+        self.station.parent.parent.memory.stationChanged(self.station)
 
     def plotPickItems(self):
         '''
@@ -66,22 +238,28 @@ class Channel(object):
 
     def initTracePlot(self):
         '''
-        Inits the station.plotItem title and the self.PlotCurveItem
-        also connects the graph to self.pickPhase()
+        Inits the self.PlotCurveItem in station.plotItem and connects the
+        graph to self.pickPhase(). The curve stays resident while the
+        station is visible
         '''
-        self.station.plotItem.setTitle(self.tr.id)
-        self.station.plotItem.titleLabel.setAttr('justify', 'left')
-        self.station.plotItem.titleLabel.setMaximumHeight(0)
-        self.station.plotItem.layout.setRowFixedHeight(0, 0)
-
         self.traceItem = pg.PlotCurveItem()
         self.traceItem.setClickable(True, width=50)
         self.traceItem.sigClicked.connect(self.pickPhase)
+        self.plot_key = None
 
         self.station.plotItem.addItem(self.traceItem)
 
         self.plotTraceItem()
-        self.plotPickItems()
+
+    def delTracePlot(self):
+        '''
+        Drops the curve, its envelope and the spare work buffers, pending
+        WorkerPool results are ignored
+        '''
+        self.traceItem = None
+        self.plot_key = None
+        self._free = []
+        self._coarse = None
 
     def pickPhase(self, evt):
         '''
@@ -90,7 +268,7 @@ class Channel(object):
         _thisPick = {'time':
                      self._pickTime(evt.pos()),
                      'amplitude':
-                     self.traceItem.getData()[1][int(evt.pos().x())],
+                     self._amplitude(evt.pos()),
                      'station_id':
                      self.tr.id,
                      'station_lat':
@@ -98,7 +276,21 @@ class Channel(object):
                      'station_lon':
                      self.station.getCoordinates()[1]}
         self.station.parent.parent.events.pickSignal(_thisPick)
-        self.plotPickItems()
+        if self.station.plotItem is not None:
+            self.plotPickItems()
+
+    def _amplitude(self, pos):
+        '''
+        Processed sample at :QtCore.Point:, the raw sample if the channel
+        is not processed yet, e.g. when picking in the RecordSection. The
+        plotted curve is not used, it is an envelope while interacting.
+        Empty traces have no amplitude
+        '''
+        data = (self.plotTrace.data if self.plotTrace is not None and
+                self.plotTrace_key is not None else self.tr.data)
+        if not len(data):
+            return ''
+        return data[min(max(int(pos.x()), 0), len(data) - 1)]
 
     def _pickTime(self, pos):
         '''
@@ -107,6 +299,47 @@ class Channel(object):
         return self.tr.stats.starttime + pos.x() * self.tr.stats.delta
 
 
+class RotatedChannel(Channel):
+    '''
+    Radial or transverse component of a Station(), rotated from its
+    north and east channels by the Rotator
+    '''
+    rotated = True
+
+    def __init__(self, north, east, component, station):
+        '''
+        :param north, east: Channel() the component is rotated from
+        :param component: 'R' or 'T'
+        '''
+        header = north.tr.stats.copy()
+        header.starttime = max(north.tr.stats.starttime,
+                               east.tr.stats.starttime)
+        header.channel = header.channel[:-1] + component
+        super(RotatedChannel, self).__init__(Trace(header=header), station)
+        self.source = north if component == 'R' else east
+        self.component = component
+
+    def plotTraceItem(self):
+        '''
+        Requests the rotated component for the current filter and back
+        azimuth, cached results are set immediately
+        '''
+        main = self.station.parent.parent
+        baz = main.rotator.backAzimuth(self.station)
+        key = self.processingKey() + (baz,)
+        if key == self.plot_key:
+            return
+        self.plot_key = key
+        index = 'RT'.index(self.component)
+        main.rotator.request(
+            self.station, main.filterArgs, baz,
+            callback=lambda result: self._setTraceData(key, result[index]),
+            errback=self._rotationFailed)
+
+    def _rotationFailed(self):
+        self.plot_key = None  # replot on the next update
+
+
 class Station(object):
     '''
     Represents a single Station and hold the plotItem in the layout
@@ -119,26 +352,20 @@ class Station(object):
         '''
         self.parent = parent
         self.plotItem = None
+        self.spectrogram = None
 
         self.st = stream.merge()
         self.stats = self.st[0].stats.copy()
         self.stats.channel = None
         self.channel_components = set([tr.stats.channel for tr in self.st])
 
-        self.QStationItem = QTreeWidgetItem()
-        self.QStationItem.setText(1, '%s.%s' %
-                                  (self.stats.network,
-                                   self.stats.station))
-        #self.QStationItem.setText(2, '%.3f N, %.3f E' %
-        #                              (self.getCoordinates()[0],
-        #                               self.getCoordinates()[1]))
-
         self.picks = []
         self.station_events = []
 
         self.channels = []
         for tr in self.st:
             self.channels.append(Channel(tr, station=self))
+        self.rotated = self._initRotatedChannels()
 
         self.setVisible(False)
 
@@ -146,19 +373,18 @@ class Station(object):
         '''
         Sets wheather the station is visible in the plot view
         '''
-        basedir = os.path.dirname(__file__)
-
         self.visible = visible
         if visible:
-            self.QStationItem.setIcon(0,
-                                      QIcon(os.path.join(basedir,
-                                            'icons/eye-24.png')))
             self.initPlot()
         else:
-            self.QStationItem.setIcon(0,
-                                      QIcon(os.path.join(basedir,
-                                            'icons/eye-hidden-24.png')))
             self.delPlot()
+        if self.parent.model is not None:
+            self.parent.parent.scheduler.schedule(
+                ('station', self),
+                lambda: self.parent.model.stationChanged(self))
+        if visible:
+            self.parent.parent.memory.touch(self)
+        self.parent.parent.memory.stationChanged(self)
 
     def initPlot(self):
         '''
@@ -166,8 +392,13 @@ class Station(object):
         '''
         if not self.visible:
             return
+        self.setSpectrogramVisible(False)
+        if self.plotItem is not None:
+            self.parent.parent.rangeController.unsubscribe(
+                self.plotItem.getViewBox())
         self.plotItem = pg.PlotItem(name='%s.%s' %
                                     (self.stats.network, self.stats.station),
+                                    viewBox=self.parent.parent.renderer.viewBox(),
                                     clipToView=True, autoDownsample=True)
         self.plotItem.hideButtons()
 
@@ -177,39 +408,174 @@ class Station(object):
         self.plotItem.enableAutoRange('y', 1.)
 
         self.plotItem.getAxis('bottom').setStyle(showValues=False)
+        self.plotItem.titleLabel.setAttr('justify', 'left')
+        self.plotItem.titleLabel.setMaximumHeight(0)
+        self.plotItem.layout.setRowFixedHeight(0, 0)
 
+        for channel in self.channels + self.rotated:
+            channel.delTracePlot()
         self.plotSelectedChannel()
         self.parent.GraphicsLayout.addItem(self.plotItem,
                                            row=self.parent.stations.index(self))
+        self.parent.parent.rangeController.subscribe(
+            self.plotItem.getViewBox())
 
         self.parent.GraphicsLayout.nextRow()
+        self.setSpectrogramVisible(self.parent.parent.spectrogramEnabled)
         self.parent.updateAllPlots()
 
-    def plotSelectedChannel(self):
+    def _initRotatedChannels(self):
         '''
-        Plots the in the GUI selected channel
+        RotatedChannel() R and T if the station has N and E channels
         '''
+        components = dict((channel.channel[-1], channel)
+                          for channel in self.channels)
+        if 'N' not in components or 'E' not in components:
+            return []
+        return [RotatedChannel(components['N'], components['E'], component,
+                               station=self)
+                for component in 'RT']
+
+    def setStream(self, stream, starttime):
+        '''
+        Replaces the traces of the channels in place, e.g. by the window of
+        the next event in review mode. Channels missing in stream get an
+        empty trace at starttime, coordinates and responses are kept
+
+        :param stream: obspy.core.Stream of the station
+        :param starttime: window start, type obspy.core.UTCDateTime
+        '''
+        visible = self.visible
+        if visible:
+            self.setVisible(False)
+        traces = dict((tr.id, tr) for tr in stream)
         for channel in self.channels:
+            tr = traces.get(channel.tr.id)
+            if tr is None:
+                tr = Trace(data=np.zeros(0), header=channel.tr.stats.copy())
+                tr.stats.starttime = starttime
+            for attrib in ('coordinates', 'response'):
+                if attrib in channel.tr.stats and attrib not in tr.stats:
+                    tr.stats[attrib] = channel.tr.stats[attrib]
+            channel.tr = tr
+            # the displayed data belongs to the previous trace
+            channel.plotTrace_key = None
+        self.st = Stream([channel.tr for channel in self.channels])
+        self.stats.starttime = min(tr.stats.starttime for tr in self.st)
+        self.rotated = self._initRotatedChannels()
+        self.parent.parent.memory.stationChanged(self)
+        if visible:
+            self.setVisible(True)
+
+    def plotChannels(self):
+        '''
+        Channels of the active component set, Z with R and T in the
+        rotated view, otherwise the recorded channels
+        '''
+        if not self.parent.parent.rotatedComponents or not self.rotated:
+            return self.channels
+        return [channel for channel in self.channels
+                if channel.channel[-1] not in 'NE'] + self.rotated
+
+    def getSelectedChannel(self):
+        '''
+        :return: the Channel() selected in the GUI or None
+        '''
+        for channel in self.plotChannels():
             if channel.channel[-1] == self.parent.parent.visibleChannel:
-                self.plotItem.clear()
+                return channel
+
+    def plotSelectedChannel(self):
+        '''
+        Shows the in the GUI selected channel. The curves of all components
+        are resident, switching only flips their visibility
+        '''
+        if self.plotItem is None:
+            return
+        stacked = self.parent.parent.stackedComponents
+        selected = self.getSelectedChannel()
+        plotted = self.componentOrder(self.plotChannels())
+        for channel in self.channels + self.rotated:
+            if channel in plotted and channel.traceItem is None:
                 channel.initTracePlot()
-                break
+            if channel.traceItem is not None:
+                channel.traceItem.setVisible(channel in plotted and
+                                             (stacked or channel is selected))
+        self.updateStackLayout()
+
+        if stacked or selected is None:
+            self.plotItem.setTitle('%s.%s' % (self.stats.network,
+                                              self.stats.station))
+        else:
+            self.plotItem.setTitle(selected.tr.id)
+        (selected or self.channels[0]).plotPickItems()
+        if self.spectrogram is not None and selected is not None\
+           and not selected.rotated:
+            self.spectrogram.setChannel(selected)
+
+    def componentOrder(self, channels=None):
+        '''
+        Channels sorted Z, N, E, R, T and then the remaining components
+        '''
+        order = 'ZNERT'
+        return sorted(channels or self.channels,
+                      key=lambda channel: (order.find(channel.channel[-1])
+                                           % (len(order) + 1),
+                                           channel.channel))
+
+    def updateStackLayout(self):
+        '''
+        In the stacked three component view every curve is normalised
+        by its peak and offset, the curve data itself stays untouched
+        '''
+        stacked = self.parent.parent.stackedComponents
+        for i, channel in enumerate(self.componentOrder(self.plotChannels())):
+            if channel.traceItem is None:
+                continue
+            if stacked and channel.peak:
+                channel.traceItem.setTransform(
+                    QTransform.fromScale(1., 1. / channel.peak))
+                channel.traceItem.setPos(0, -2. * i)
+            else:
+                channel.traceItem.setTransform(QTransform())
+                channel.traceItem.setPos(0, 0)
 
     def updateTraceFilter(self):
         '''
-        Passes on the updated filter
+        Passes on the updated filter, the selected channel is processed first
         '''
-        for channel in self.channels:
-            if channel.channel[-1] == self.parent.parent.visibleChannel:
+        selected = self.getSelectedChannel()
+        if selected is not None and selected.traceItem is not None:
+            selected.plotTraceItem()
+        for channel in self.channels + self.rotated:
+            if channel.traceItem is not None:
                 channel.plotTraceItem()
-                break
+
+    def setSpectrogramVisible(self, visible=True):
+        '''
+        Shows a SpectrogramView of the selected channel behind the trace
+        '''
+        from spectrogram import SpectrogramView
+        if not visible or self.plotItem is None:
+            if self.spectrogram is not None:
+                self.spectrogram.remove()
+                self.spectrogram = None
+            return
+        if self.spectrogram is None and self.plotItem.scene() is not None:
+            self.spectrogram = SpectrogramView(self)
+            channel = self.getSelectedChannel()
+            if channel is not None and not channel.rotated:
+                self.spectrogram.setChannel(channel)
 
     def getPicks(self):
         '''
-        Gets all the stations picks from parent.events
+        Gets all the stations picks from parent.events, lazy events with
+        picks of the station are loaded
         '''
+        events = self.parent.parent.events
+        events.loadStationPicks(self.stats.network, self.stats.station)
         self.picks = []
-        for event in self.parent.parent.events:
+        for event in events:
             for pick in event.picks:
                 if pick.station == self.stats.station and\
                    pick.network == self.stats.network:
@@ -221,6 +587,11 @@ class Station(object):
         Delete the stations plot from layout
         '''
         try:
+            self.setSpectrogramVisible(False)
+            for channel in self.channels + self.rotated:
+                channel.delTracePlot()
+            self.parent.parent.rangeController.unsubscribe(
+                self.plotItem.getViewBox())
             self.parent.GraphicsLayout.removeItem(self.plotItem)
             self.plotItem = None
             self.parent.updateAllPlots()
@@ -346,9 +717,12 @@ class Stations:
 
         :parent: grapePicker QtGui.QMainWindow
         '''
+        from stationModel import StationTreeModel
         self.parent = parent
         self.GraphicsLayout = parent.qtGraphLayout
         self.stream = st
+        self.model = None
+        self._labeled = None  # plotItem showing the time axis labels
 
         self.stations = []
         for stat in set([tr.stats.station for tr in st]):
@@ -356,6 +730,7 @@ class Stations:
 
         self.sorted_by = None
         self.sortableAttribs()
+        self.model = StationTreeModel(self)
 
     def addStation(self, st):
         '''
@@ -364,8 +739,17 @@ class Stations:
         :param st: obspy stream
         '''
         self.stations.append(Station(stream=st, parent=self))
-        self.parent.stationTree.addTopLevelItem(
-            self.stations[-1].QStationItem)
+        self.parent.memory.stationAdded(self.stations[-1])
+        if self.model is not None:
+            self.model.rebuildIndex()
+
+    def setStationsVisible(self, stations, visible=True):
+        '''
+        Sets the visibility of a list of Station()
+        '''
+        for station in stations:
+            if station.visible != visible:
+                station.setVisible(visible)
 
     def visibleStations(self):
         '''
@@ -376,6 +760,25 @@ class Stations:
         return [station for station in self.stations
                 if station.visible]
 
+    def restoreOrder(self, ids, visible_ids):
+        '''
+        Restores a station order and visibility saved as lists of
+        'network.station' ids, unknown stations are appended
+        '''
+        rank = dict((id, i) for i, id in enumerate(ids))
+        key = lambda station: '%s.%s' % (station.stats.network,
+                                         station.stats.station)
+        self.stations = sorted(self.stations,
+                               key=lambda station: rank.get(key(station),
+                                                            len(rank)))
+        self.sorted_by = None
+        visible_ids = set(visible_ids)
+        self.setStationsVisible([station for station in self.stations
+                                 if key(station) not in visible_ids], False)
+        self._sortStationsOnGUI()
+        self.setStationsVisible([station for station in self.stations
+                                 if key(station) in visible_ids], True)
+
     def sortableAttribs(self):
         ignore_attribs = ['channel', 'mseed', 'SAC', 'sampling_rate',
                           '_format', 'delta', 'calib']
@@ -409,13 +812,13 @@ class Stations:
         '''
         # Clear all plots
         self.parent.qtGraphLayout.clear()
-        # Update QtreeWidget
+        # Update station tree
+        self.model.rebuildIndex()
         for station in self.stations:
-            self.parent.stationTree.takeTopLevelItem(self.parent.stationTree.indexOfTopLevelItem(station.QStationItem))
-        for station in self.stations:
-            self.parent.stationTree.addTopLevelItem(station.QStationItem)
             station.initPlot()
         self.updateAllPlots()
+        # the station order sets the offsets of the record section
+        self.parent.recordSection.update()
 
     def showSortQMenu(self, pos):
         '''
@@ -449,15 +852,28 @@ class Stations:
 
     def updateAllPlots(self):
         '''
-        Updates the plots, links the axis and clears the labeling
+        Schedules _updateAllPlots, so toggling many stations relinks once
+        '''
+        self.parent.scheduler.schedule(('stations', self),
+                                       self._updateAllPlots)
+
+    def _updateAllPlots(self):
         '''
+        Updates the plots and moves the time labels to the last station,
+        the time axes are shared through the RangeController
+        '''
+        self.parent.prefetcher.schedule()
+        self.parent.trialHypocenter.updateOverlay()
+        self.parent.comparison.updateOverlay()
         visible_stations = self.visibleStations()
-        for station in visible_stations:
-            station.plotItem.setXLink(visible_stations[0].plotItem)
-            station.plotItem.getAxis('bottom').setStyle(showValues=False)
-        visible_stations[-1].plotItem.getAxis('bottom').setStyle(showValues=True)
-            #except:
-            #    pass
+        last = visible_stations[-1].plotItem if visible_stations else None
+        if last is self._labeled:
+            return
+        if self._labeled is not None:
+            self._labeled.getAxis('bottom').setStyle(showValues=False)
+        self._labeled = last
+        if last is not None:
+            last.getAxis('bottom').setStyle(showValues=True)
 
     def exportHypStaFile(self, filename):
         with open(filename, 'w') as stat_file:
@@ -476,8 +892,8 @@ class Stations:
 
 class Pick:
     '''
-    This object holds a pick, the correspoding QTreeWidgetItem and
-    the pyqtgraph.InfiniteLine object
+    This object holds a pick and the pyqtgraph.InfiniteLine object,
+    it is presented in the event tree through EventTreeModel
     '''
     def __init__(self, event, pickevt):
         '''
@@ -495,6 +911,9 @@ class Pick:
         self.time = pickevt['time']
         self.phase = pickevt['phase']
         self.amplitude = str(pickevt['amplitude'])
+        self.store_id = pickevt.get('store_id', None)
+        self.wa_amplitude = None  # Wood-Anderson peak to peak in mm
+        self.magnitude = None
 
         self.pickLineItem = None
         self.pickHighlighted = False
@@ -502,26 +921,17 @@ class Pick:
         self.network, self.station,\
             self.location, self.component = self.station_id.split('.')
 
-        self.QPickItem = QTreeWidgetItem()
-        self.QPickItem.setText(1, '%s - %s\n%s'
-                               % (self.phase.name,
-                                  self.station_id, self.time))
-
-        self.QPickItem.setFont(1, QFont('', 8))
-        self.QPickItem.setBackground(1, QBrush(self.phase.qcolor))
-        #self.event.QEventItem.addChild(self.QPickItem)
-        self.event.getStationItem(self.station).addChild(self.QPickItem)
-
     def getPickLineItem(self, channel, forceNew=False):
         '''
         Function returns an pyqtgraph.InfiniteLine
         for plotting through Channel()
         '''
         self.channel = channel
+        pos = (self.time - channel.tr.stats.starttime) / channel.tr.stats.delta
         if self.pickLineItem is not None and not forceNew:
+            self.pickLineItem.setValue(pos)
             return self.pickLineItem
         self.pickLineItem = pg.InfiniteLine()
-        pos = (self.time - channel.tr.stats.starttime) / channel.tr.stats.delta
         self.pickLineItem.setValue(pos)
         self.pickLineItem.setPen(color=self.phase.color, width=1)
         #self.pickLineItem.setMovable(True)
@@ -534,11 +944,10 @@ class Pick:
         if self.pickHighlighted:
             self.pickLineItem.setPen(color=self.phase.color, width=1)
             self.pickHighlighted = False
-            self.QPickItem.setFont(1, QFont('', 8, QFont.Normal))
         else:
             self.pickLineItem.setPen(color=self.phase.color, width=3)
             self.pickHighlighted = True
-            self.QPickItem.setFont(1, QFont('', 8, QFont.Bold))
+        self.event.parent.model.pickChanged(self)
 
     def asDict(self):
         '''
@@ -560,7 +969,6 @@ class Pick:
         pass
 
     def __del__(self):
-        self.event.getStationItem(self.station).removeChild(self.QPickItem)
         try:
             self.pickLineItem.getViewBox().removeItem(self.pickLineItem)
         except:
@@ -570,57 +978,115 @@ class Pick:
 
 class Event:
     '''
-    Event container holds a list of the associated picks and a
-    QTreeWidgetItem
+    Event container holds a list of the associated picks, grouped by
+    station in self.station_picks for the EventTreeModel
     '''
-    def __init__(self, parent, id):
+    def __init__(self, parent, id, nstations=None):
         '''
         Inits the event with
 
         :id: integer
         :parent: parent Events() object
+        :nstations: if given the event is a lazy shell from the project
+                    store and its picks are loaded on expansion
         '''
         self.parent = parent
         self.active = False
         self.id = id
         self.picks = []
+        self.station_picks = OrderedDict()
+        self.station_nodes = {}
+        self._dirty_stations = set()
+        self.location = None
+        self.magnitude = None
+        self.loaded = nstations is None
+        self._nstations = nstations or 0
+
+    @property
+    def nstations(self):
+        if not self.loaded:
+            return self._nstations
+        return len(self.station_picks)
 
-        self.QEventItem = QTreeWidgetItem()
-        self.QEventItem.setText(0, 'Ev %d' % self.id)
-        self._initQStationItems()
+    def loadPicks(self):
+        '''
+        Loads the event's picks from the project store
+        '''
+        if self.loaded:
+            return
+        self.loaded = True
+        for pickevt in self.parent.store.getEventPicks(self.id):
+            pickevt['phase'] = getPhase(pickevt['phase'])
+            self._appendPick(Pick(self, pickevt))
         self._updateItemText()
 
-    def _initQStationItems(self):
-        self.QStationEventItems = {}
-        for station in [station.stats.station for
-                        station in self.parent.parent.stations]:
-            self.QStationEventItems[station] = QTreeWidgetItem()
-            self.QStationEventItems[station].setText(0, station)
-            self.QStationEventItems[station].setHidden(True)
-            self.QEventItem.addChild(self.QStationEventItems[station])
-
-    def getStationItem(self, station):
-        if station in self.QStationEventItems:
-            return self.QStationEventItems.get(station)
-        else:
-            self.QStationEventItems[station] = QTreeWidgetItem()
-            self.QEventItem.addChild(self.QStationEventItems[station])
-            self.QStationEventItems[station].setHidden(True)
-            return self.QStationEventItems.get(station)
+    def _appendPick(self, pick):
+        '''
+        Adds a Pick() to self.picks and self.station_picks and notifies
+        the EventTreeModel
+        '''
+        model = self.parent.model
+        if pick.station not in self.station_picks:
+            model.beginInsertStation(self)
+            self.station_picks[pick.station] = []
+            model.endInsertRows()
+        model.beginInsertPick(self, pick.station)
+        self.station_picks[pick.station].append(pick)
+        self.picks.append(pick)
+        model.endInsertRows()
+        self.parent.parent.locator.pickAdded(pick)
+        self.parent.parent.magnitudes.update(self)
+
+    def _removePick(self, pick):
+        model = self.parent.model
+        self.parent.parent.locator.pickRemoved(pick)
+        self.parent.parent.magnitudes.update(self)
+        model.beginRemovePick(pick)
+        self.station_picks[pick.station].remove(pick)
+        self.picks.remove(pick)
+        model.endRemoveRows()
+        if not self.station_picks[pick.station]:
+            model.beginRemoveStation(self, pick.station)
+            del self.station_picks[pick.station]
+            self.station_nodes.pop(pick.station, None)
+            model.endRemoveRows()
 
     def addPickToEvent(self, pickevt):
         '''
         Adds a pick to the events
         '''
-        # Check if station already has P or S Pick
-        station_picks = self._getPicksForStation(pickevt['station_id'].split('.')[1])
-        for pick in station_picks:
-            if pick.phase is pickevt['phase']:
-                self.deletePick(pick)
-        # Add pick to event
-        self.picks.append(Pick(self, pickevt))
-        self._updateItemText()
-        return self.picks[-1]
+        return self.addPicksToEvent([pickevt])[0]
+
+    def addPicksToEvent(self, pickevts):
+        '''
+        Adds a list of picks as one undo step, a pick replaces an earlier
+        pick of the same phase at the station. The project store is
+        written in one transaction
+
+        :return: list of the new Pick()
+        '''
+        self.loadPicks()
+        undo = self.parent.parent.undo
+        picks = []
+        with undo.group():
+            for pickevt in pickevts:
+                # Check if station already has P or S Pick
+                station_picks = self._getPicksForStation(pickevt['station_id'].split('.')[1])
+                for pick in station_picks:
+                    if pick.phase.name == pickevt['phase'].name:
+                        self.deletePick(pick)
+                # Add pick to event
+                pick = Pick(self, pickevt)
+                self._appendPick(pick)
+                undo.record('addPick', self.id, pickFields(pick))
+                picks.append(pick)
+        if self.parent.store is not None:
+            self.parent.store.addPicks([pick for pick in picks
+                                        if pick in self.station_picks.get(
+                                            pick.station, [])])
+        for station in set(pick.station for pick in picks):
+            self._updateItemText(station)
+        return picks
 
     def setActive(self, active=True):
         '''
@@ -628,23 +1094,21 @@ class Event:
 
         :param active: whether the stations plot is active, type bool
         '''
-        if active:
-            self.active = True
-            self.QEventItem.setFont(0, QFont('', 10, QFont.Bold))
-            self.QEventItem.setFont(1, QFont('', 10, QFont.Bold))
-        else:
-            self.active = False
-            self.QEventItem.setFont(0, QFont('', 10, QFont.Normal))
-            self.QEventItem.setFont(1, QFont('', 10, QFont.Normal))
+        if self.active != active:
+            self.active = active
+            self._updateItemText()
         return self
 
     def deletePick(self, pick):
         '''
         Deletes a Pick() from the event
         '''
-        self.picks.remove(pick)
+        self.parent.parent.undo.record('deletePick', self.id, pickFields(pick))
+        self._removePick(pick)
+        if self.parent.store is not None:
+            self.parent.store.deletePick(pick)
         pick.__del__()
-        self._updateItemText()
+        self._updateItemText(pick.station)
 
     def getEventPicksAsDict(self):
         '''
@@ -657,33 +1121,29 @@ class Event:
         return picks
 
     def _getPickedStations(self):
-        return [pick.station for pick in self.picks]
+        return list(self.station_picks.keys())
 
     def _getPicksForStation(self, station_id):
-        return [pick for pick in self.picks if pick.station == station_id]
+        return list(self.station_picks.get(station_id, []))
 
-    def _updateQStationEventItems(self):
+    def _updateItemText(self, station=None):
         '''
-        Updates the Event Stations QTreeWidgetItems
+        Marks the event row and the row of station dirty, the event tree
+        is updated once on the next UpdateScheduler flush
         '''
-        picked_stations = self._getPickedStations()
-        for station, item in self.QStationEventItems.iteritems():
-            npicks = picked_stations.count(station)
-            p_text = ('Pick' if npicks == 1 else 'Picks')
-            item.setText(1, '%d %s' % (npicks, p_text))
-            if station in picked_stations:
-                item.setHidden(False)
-            else:
-                item.setHidden(True)
+        if station is not None:
+            self._dirty_stations.add(station)
+        self.parent.parent.scheduler.schedule(('event', self),
+                                              self._flushItemText)
 
-    def _updateItemText(self):
-        '''
-        Updates the text of QTreeWidgetItem
-        '''
-        self.QEventItem.setText(1, '%d Stations'
-                                % len(set([pick.station for
-                                      pick in self.picks])))
-        self._updateQStationEventItems()
+    def _flushItemText(self):
+        dirty_stations, self._dirty_stations = self._dirty_stations, set()
+        if self not in self.parent.events.events:
+            return
+        model = self.parent.model
+        model.eventChanged(self)
+        for station in dirty_stations:
+            model.stationChanged(self, station)
 
     def getHypPhasesForStation(self, station_id):
         '''
@@ -693,11 +1153,14 @@ class Event:
         picks = self._getPicksForStation(station_id)
         p_pick = None
         s_pick = None
+        amp_pick = None
         for pick in picks:
             if pick.phase.name == 'P':
                 p_pick = pick
             elif pick.phase.name == 'S':
                 s_pick = pick
+            if pick.wa_amplitude is not None:
+                amp_pick = pick
         if p_pick is None:
             return
         # General information
@@ -737,10 +1200,16 @@ class Event:
             # S Travel Time residual (blank)
             rstr += '%4s' % ''
         # Amplitude Stuff
-        # Amplitude Peak to Peak
-        rstr += '%7s' % ''
-        # Amp unit
-        rstr += '%2s' % ''
+        if amp_pick is None:
+            # Amplitude Peak to Peak
+            rstr += '%7s' % ''
+            # Amp unit
+            rstr += '%2s' % ''
+        else:
+            # Wood-Anderson Amplitude Peak to Peak
+            rstr += '%7.2f' % min(amp_pick.wa_amplitude, 9999.99)
+            # Amp unit 0 = PP mm
+            rstr += '%2d' % 0
 
         return '%-121s' % rstr
 
@@ -764,21 +1233,36 @@ class Events:
         Inits the container
         :parent: parent grapePicker // QMainWindow
         '''
+        from eventModel import EventTreeModel
+        from pickQueue import PickQueue
         self.parent = parent
         self.active_event = None
         self.events = []
+        self.store = None
+        self._loaded_stations = set()  # stations of the loaded store picks
+        self.model = EventTreeModel(self)
+        self.queue = PickQueue(self)  # picks from worker threads
 
-    def addEvent(self, id=None):
+    def addEvent(self, id=None, activate=True):
         '''
         Adds event to the container with
 
         :id: Integer, if None it counts up
+        :activate: Bool, make the new event the active one
         '''
         if id is None:
             id = len(self.events)+1
-        self.events.append(Event(parent=self, id=id))
-        self.setActiveEvent(self.events[-1])
-        self.parent.eventTree.addTopLevelItem(self.events[-1].QEventItem)
+        self.parent.undo.record('addEvent', id)
+        self._appendEvent(Event(parent=self, id=id))
+        if self.store is not None:
+            self.store.addEvent(id)
+        if activate:
+            self.setActiveEvent(self.events[-1])
+
+    def _appendEvent(self, event):
+        self.model.beginInsertEvent(len(self.events))
+        self.events.append(event)
+        self.model.endInsertRows()
 
     def getEvent(self, id):
         '''
@@ -798,18 +1282,27 @@ class Events:
                 ev.setActive(True)
             else:
                 ev.setActive(False)
+        self.parent.rotator.update()
 
     def deleteEvent(self, event):
         '''
         :event: Event() to be deleted from container object
         '''
-        _id = self.parent.eventTree.indexOfTopLevelItem(event.QEventItem)
-        self.parent.eventTree.takeTopLevelItem(_id)
+        if self.store is not None:
+            event.loadPicks()
+        self.parent.undo.record('deleteEvent', event.id,
+                                tuple(pickFields(pick) for pick in event.picks))
+        self.model.beginRemoveEvent(event)
         self.events.remove(event)
+        self.model.endRemoveRows()
+        self.parent.locator.eventRemoved(event)
+        if self.store is not None:
+            self.store.deleteEvent(event.id)
         event.__del__()
-        self.setActiveEvent(self.events[-1])
+        self.setActiveEvent(self.events[-1] if self.events else None)
 
     def getAllPicks(self):
+        self.loadAllEvents()
         return [pick for event in self.events for pick in event.picks]
 
     def pickSignal(self, pickevt):
@@ -824,7 +1317,7 @@ class Events:
         if self.active_event is None:
             return
         _p = self.active_event.addPickToEvent(pickevt)
-        self.parent.eventTree.scrollToItem(_p.QPickItem)
+        self.parent.eventTree.scrollTo(self.model.pickIndex(_p))
 
     '''
     File IO for the event class
@@ -836,6 +1329,7 @@ class Events:
         :filename: Filepath as string
         '''
         import json
+        self.loadAllEvents()
         picks = [pick for event in self.events
                  for pick in event.getEventPicksAsDict()]
         with file(filename, 'w') as json_file:
@@ -848,6 +1342,7 @@ class Events:
         :filename: Filepath as string
         '''
         import csv
+        self.loadAllEvents()
         picks = [pick for event in self.events
                  for pick in event.getEventPicksAsDict()]
         if len(picks) == 0:
@@ -868,7 +1363,7 @@ class Events:
             events_json = json.load(json_file)
             for pick in events_json:
                 try:
-                    pick['phase'] = eval('pick%s()' % pick['phase'].upper())
+                    pick['phase'] = getPhase(pick['phase'])
                 except:
                     raise ValueError('Could not import Phase %s in file %s'
                                      % (pick['phase'], filename))
@@ -877,12 +1372,142 @@ class Events:
                 pick['event_id'] = int(pick['event_id'])
 
         unique_events = set([pick['event_id'] for pick in events_json])
-        for e in unique_events:
-            self.addEvent(e)
-        for pick in events_json:
-            self.getEvent(pick['event_id']).addPickToEvent(pick)
+        with self.parent.undo.group():
+            for e in unique_events:
+                self.addEvent(e)
+            for pick in events_json:
+                self.getEvent(pick['event_id']).addPickToEvent(pick)
+
+    '''
+    SQLite project store
+    '''
+    def saveProject(self, filename):
+        '''
+        Creates a new project file from the current events and attaches it,
+        subsequent picks are written incrementally
+
+        :filename: Filepath as string
+        '''
+        from projectStore import ProjectStore
+        # a stale write-ahead log would be replayed into the new database
+        for path in (filename, filename + '-wal', filename + '-shm',
+                     filename + '-journal'):
+            if os.path.exists(path):
+                os.remove(path)
+        store = ProjectStore(filename)
+        store.updateStations(self.parent.stations)
+        for event in self.events:
+            event.loadPicks()
+            store.addEvent(event.id)
+            store.addPicks(event.picks)
+        self._setStore(store)
+
+    def openProject(self, filename):
+        '''
+        Opens a project file, only the event list is read. Picks are loaded
+        when an event is expanded in the event tree
+
+        :filename: Filepath as string
+        '''
+        from projectStore import ProjectStore
+        self._setStore(None)
+        while self.events:
+            self.deleteEvent(self.events[-1])
+        store = ProjectStore(filename)
+        store.updateStations(self.parent.stations)
+        self.model.beginResetModel()
+        self.events = [Event(parent=self, id=event_id, nstations=nstations)
+                       for event_id, npicks, nstations
+                       in store.getEventSummary()]
+        self.model.endResetModel()
+        self._setStore(store)
+        self.parent.undo.clear()
+        if self.events:
+            self.setActiveEvent(self.events[-1])
+
+    def restoreSnapshot(self, events, picks, active_id=None):
+        '''
+        Replaces all events by the event and pick tables of a Snapshot()
+
+        :events, picks: structured arrays from snapshot.eventTable() and
+                        snapshot.pickTable()
+        '''
+        self._setStore(None)
+        self.model.beginResetModel()
+        for event in self.events:
+            self.parent.locator.eventRemoved(event)
+            event.__del__()
+        self.events = []
+        events_by_id = {}
+        for row in events:
+            event = Event(parent=self, id=int(row['id']))
+            if not np.isnan(row['rms']):
+                event.location = {
+                    'latitude': float(row['latitude']),
+                    'longitude': float(row['longitude']),
+                    'depth': float(row['depth']),
+                    'origin_time': UTCDateTime(float(row['origin_time'])),
+                    'rms': float(row['rms']),
+                    'npicks': int(row['npicks'])
+                }
+            if not np.isnan(row['magnitude']):
+                event.magnitude = float(row['magnitude'])
+            self.events.append(event)
+            events_by_id[event.id] = event
+        for row in picks:
+            event = events_by_id[int(row['event_id'])]
+            amplitude = row['amplitude']
+            if picks.dtype['amplitude'].kind == 'f':
+                # snapshots of version 1 stored amplitudes as float
+                amplitude = '' if np.isnan(amplitude) else float(amplitude)
+            pick = Pick(event, {'station_id': str(row['station_id']),
+                                'station_lat': float(row['station_lat']),
+                                'station_lon': float(row['station_lon']),
+                                'time': UTCDateTime(float(row['time'])),
+                                'phase': getPhase(str(row['phase'])),
+                                'amplitude': str(amplitude)})
+            if not np.isnan(row['wa_amplitude']):
+                pick.wa_amplitude = float(row['wa_amplitude'])
+            event.station_picks.setdefault(pick.station, []).append(pick)
+            event.picks.append(pick)
+        self.model.endResetModel()
+
+        for event in self.events:
+            for pick in event.picks:
+                self.parent.locator.pickAdded(pick)
+        self.parent.undo.clear()
+        self.setActiveEvent(events_by_id.get(active_id,
+                                             self.events[-1] if self.events
+                                             else None))
+
+    def loadAllEvents(self):
+        '''
+        Loads the picks of all lazy events, needed before exporting
+        '''
+        for event in self.events:
+            event.loadPicks()
+
+    def loadStationPicks(self, network, station):
+        '''
+        Loads the lazy events with picks of a station, looked up once per
+        station through the store index
+        '''
+        if self.store is None or (network, station) in self._loaded_stations:
+            return
+        self._loaded_stations.add((network, station))
+        events = dict((event.id, event) for event in self.events)
+        for event_id in self.store.getStationEvents(network, station):
+            if event_id in events:
+                events[event_id].loadPicks()
+
+    def _setStore(self, store):
+        if self.store is not None:
+            self.store.close()
+        self.store = store
+        self._loaded_stations = set()
 
     def exportAllEventsPhases(self, filename):
+        self.loadAllEvents()
         with file(filename, 'w') as phs_file:
             # Write Header
             phs_file.write('20140123 0 8 64735 5775120 3094  355  0\n')
@@ -901,6 +1526,16 @@ Different picks and their colors
 '''
 
 
+def getPhase(name):
+    '''
+    Returns a new pick phase object from its name, e.g. 'P' or 'Amp'
+    '''
+    for phase in (pickP, pickS, pickAmp, pick1, pick2):
+        if phase().name.upper() == name.upper():
+            return phase()
+    raise ValueError('Unknown phase %s' % name)
+
+
 class pickP:
     def __init__(self):
         self.name = 'P'
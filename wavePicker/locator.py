@@ -0,0 +1,155 @@
+import numpy as np
+
+from travelTimes import epicentralDistance
+
+
+class LocationState(object):
+    '''
+    Running residual sums of one event over all grid nodes
+
+    For every node the origin time is the mean of t - T and the RMS
+    follows from the first and second moments, so adding or removing a
+    pick is a single vectorized update. Nodes outside of the travel-time
+    table of a pick's station do not count the pick.
+    '''
+    def __init__(self, reference_time, nnodes):
+        self.reference_time = reference_time
+        self.n = np.zeros(nnodes)
+        self.s1 = np.zeros(nnodes)
+        self.s2 = np.zeros(nnodes)
+        self.picks = {}
+
+    def update(self, residuals, sign=1.):
+        valid = np.isfinite(residuals)
+        residuals = np.where(valid, residuals, 0.)
+        self.n += sign * valid
+        self.s1 += sign * residuals
+        self.s2 += sign * residuals**2
+
+
+class GridLocator(object):
+    '''
+    Grid search hypocenter locator over a precomputed travel-time volume
+
+    The grid spans the station network, travel times of every node are
+    interpolated once per station from the TravelTimeTable and kept.
+    Residuals of all nodes are evaluated at once by NumPy broadcasting.
+    '''
+    min_picks = 4
+
+    def __init__(self, parent, nx=41, ny=41, depth_step=2., margin=.2,
+                 table=None):
+        '''
+        :param parent: wavePicker main window
+        :param nx, ny: Number of longitude and latitude nodes, type int
+        :param depth_step: Depth node spacing in km, type float
+        :param margin: Grid margin as fraction of the network extent
+        :param table: TravelTimeTable (default: the trial hypocenter's)
+        '''
+        self.parent = parent
+        self.table = table or parent.trialHypocenter.table
+        self.states = {}
+        self._volumes = {}
+        self._stations = dict(((station.stats.network, station.stats.station),
+                               station) for station in parent.stations)
+
+        coordinates = np.array([station.getCoordinates()
+                                for station in parent.stations])
+        lat_min, lon_min = coordinates.min(axis=0)
+        lat_max, lon_max = coordinates.max(axis=0)
+        lat_pad = max((lat_max - lat_min) * margin, .1)
+        lon_pad = max((lon_max - lon_min) * margin, .1)
+        self.latitudes = np.linspace(lat_min - lat_pad, lat_max + lat_pad, ny)
+        self.longitudes = np.linspace(lon_min - lon_pad, lon_max + lon_pad, nx)
+        self.depths = np.arange(0., self.table.depths[-1] + depth_step / 2.,
+                                depth_step)
+        self.shape = (ny, nx, len(self.depths))
+        self.nnodes = ny * nx * len(self.depths)
+
+    def _volume(self, pick):
+        '''
+        Travel times of all grid nodes for the pick's station and phase,
+        computed on first use and kept per station
+
+        :return: float32 array of shape (nnodes,)
+        '''
+        key = (pick.network, pick.station)
+        if key not in self._volumes:
+            station = self._stations.get(key)
+            lat, lon = (station.getCoordinates() if station is not None
+                        else (pick.station_lat, pick.station_lon))
+            lats, lons = np.meshgrid(self.latitudes, self.longitudes,
+                                     indexing='ij')
+            distances = epicentralDistance(lat, lon, lats, lons)
+            self._volumes[key] = dict(
+                (phase, self.table.travelTimes(
+                    phase, distances[:, :, np.newaxis],
+                    self.depths[np.newaxis, np.newaxis, :])
+                 .astype(np.float32).ravel())
+                for phase in ('P', 'S'))
+        return self._volumes[key][pick.phase.name]
+
+    def _residuals(self, state, pick):
+        return (pick.time - state.reference_time) - self._volume(pick)
+
+    def pickAdded(self, pick):
+        '''
+        Adds the pick to its event's running sums and schedules relocation
+        '''
+        if pick.phase.name not in ('P', 'S'):
+            return
+        event = pick.event
+        state = self.states.get(event)
+        if state is None:
+            state = self.states[event] = LocationState(pick.time, self.nnodes)
+        state.update(self._residuals(state, pick))
+        state.picks[pick] = pick.time
+        self._schedule(event)
+
+    def pickRemoved(self, pick):
+        state = self.states.get(pick.event)
+        if state is None or pick not in state.picks:
+            return
+        del state.picks[pick]
+        state.update(self._residuals(state, pick), sign=-1.)
+        self._schedule(pick.event)
+
+    def eventRemoved(self, event):
+        self.states.pop(event, None)
+
+    def _schedule(self, event):
+        self.parent.scheduler.schedule(('locate', event),
+                                       lambda: self.locate(event))
+
+    def locate(self, event):
+        '''
+        Picks the grid node with the lowest RMS and stores it on
+        event.location, events with too few picks get None. Only nodes
+        within the travel-time table of at least min_picks picks count
+        '''
+        state = self.states.get(event)
+        npicks = len(state.picks) if state is not None else 0
+        counted = (state.n >= self.min_picks if npicks >= self.min_picks
+                   else None)
+        if counted is None or not counted.any():
+            event.location = None
+        else:
+            n = np.maximum(state.n, 1.)
+            mean = state.s1 / n
+            rms = np.sqrt(np.clip(state.s2 / n - mean**2, 0., None))
+            rms[~counted] = np.inf
+            node = int(np.argmin(rms))
+            iy, ix, iz = np.unravel_index(node, self.shape)
+            event.location = {
+                'latitude': float(self.latitudes[iy]),
+                'longitude': float(self.longitudes[ix]),
+                'depth': float(self.depths[iz]),
+                'origin_time': state.reference_time + float(mean[node]),
+                'rms': float(rms[node]),
+                'npicks': int(round(state.n[node]))
+            }
+        event._updateItemText()
+        self.parent.magnitudes.update(event)
+        if event is self.parent.events.active_event:
+            self.parent.rotator.update()
+        return event.location
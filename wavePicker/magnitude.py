@@ -0,0 +1,181 @@
+import numpy as np
+
+from response import nextPow2, responseSpectrum, invertSpectrum
+from travelTimes import epicentralDistance
+
+# Wood-Anderson seismometer, IASPEI static magnification of 2080
+WOOD_ANDERSON = {
+    'poles': [-6.283 + 4.7124j, -6.283 - 4.7124j],
+    'zeros': [0j, 0j],
+    'gain': 2080.
+}
+
+
+def woodAndersonSpectrum(freqs):
+    '''
+    Displacement response of the Wood-Anderson seismometer at freqs in Hz
+    '''
+    s = 2j * np.pi * np.asarray(freqs)
+    response = np.full(s.shape, WOOD_ANDERSON['gain'], dtype=complex)
+    for zero in WOOD_ANDERSON['zeros']:
+        response *= s - zero
+    for pole in WOOD_ANDERSON['poles']:
+        response /= s - pole
+    return response
+
+
+def localMagnitude(amplitudes, distances):
+    '''
+    Hutton and Boore (1987) local magnitude, vectorized
+
+    :param amplitudes: Wood-Anderson zero to peak amplitudes in mm
+    :param distances: hypocentral distances in km
+    '''
+    distances = np.asarray(distances, dtype=float)
+    return (np.log10(amplitudes) + 1.11 * np.log10(distances / 100.) +
+            .00189 * (distances - 100.) + 3.)
+
+
+def measureAmplitudes(jobs, water_level=60., taper=.05):
+    '''
+    Simulates Wood-Anderson records and measures peak to peak amplitudes
+    in the given windows, runs in the WorkerPool. Traces with the same
+    number of samples and sampling rate are deconvolved, simulated and
+    measured at once
+
+    :param jobs: list of (trace, window start, window end)
+
+    ::return::
+    peak to peak amplitudes in mm as numpy.ndarray, NaN for traces
+    without response or data in the window
+    '''
+    from obspy.signal.invsim import cosine_taper
+
+    amplitudes = np.full(len(jobs), np.nan)
+    groups = {}
+    for i, (tr, start, end) in enumerate(jobs):
+        if getattr(tr.stats, 'response', None) is None or not tr.stats.npts:
+            continue
+        groups.setdefault((tr.stats.npts, tr.stats.sampling_rate),
+                          []).append(i)
+
+    for (npts, sampling_rate), indices in groups.items():
+        nfft = nextPow2(2 * npts)
+        traces = [jobs[i][0] for i in indices]
+        data = np.array([tr.data for tr in traces], dtype=float)
+        data -= data.mean(axis=1)[:, np.newaxis]
+        data *= cosine_taper(npts, taper)
+        spectra = np.array([responseSpectrum(tr, nfft, 'DISP')
+                            for tr in traces])
+        freqs = np.fft.rfftfreq(nfft, 1. / sampling_rate)
+        wood_anderson = np.fft.irfft(
+            np.fft.rfft(data, nfft, axis=1) *
+            invertSpectrum(spectra, water_level) *
+            woodAndersonSpectrum(freqs), nfft, axis=1)[:, :npts] * 1e3
+
+        first = np.array([(jobs[i][1] - jobs[i][0].stats.starttime) *
+                          sampling_rate for i in indices]).astype(int)
+        last = np.array([(jobs[i][2] - jobs[i][0].stats.starttime) *
+                         sampling_rate for i in indices]).astype(int)
+        samples = np.arange(npts)
+        window = (samples >= first[:, np.newaxis]) &\
+            (samples < last[:, np.newaxis])
+        valid = window.any(axis=1)
+        peak_to_peak = (np.where(window, wood_anderson, -np.inf).max(axis=1) -
+                        np.where(window, wood_anderson, np.inf).min(axis=1))
+        amplitudes[indices] = np.where(valid, peak_to_peak, np.nan)
+    return amplitudes
+
+
+class MagnitudeEngine(object):
+    '''
+    Wood-Anderson amplitudes and local magnitudes of an event
+
+    The horizontal channels of all stations with an S pick (or else an
+    Amp pick) are simulated and measured in one WorkerPool job. Station
+    amplitudes and magnitudes are stored on the anchoring Pick(), the
+    event magnitude is the median of the station magnitudes.
+    '''
+    def __init__(self, parent, window_length=10., pad=20.):
+        '''
+        :param parent: wavePicker main window
+        :param window_length: Measurement window after the pick in s
+        :param pad: Data around the window used for deconvolution in s
+        '''
+        self.parent = parent
+        self.window_length = window_length
+        self.pad = pad
+
+    def update(self, event):
+        '''
+        Schedules the measurement of the event
+        '''
+        self.parent.scheduler.schedule(('magnitude', event),
+                                       lambda: self.measure(event))
+
+    def _anchorPicks(self, event):
+        '''
+        :return: dict of station code and the Pick() the window starts at
+        '''
+        anchors = {}
+        for pick in event.picks:
+            if pick.phase.name == 'S' or\
+               (pick.phase.name == 'Amp' and pick.station not in anchors):
+                anchors[pick.station] = pick
+        return anchors
+
+    def measure(self, event):
+        stations = dict(((station.stats.network, station.stats.station),
+                         station) for station in self.parent.stations)
+        jobs, picks = [], []
+        for pick in self._anchorPicks(event).values():
+            station = stations.get((pick.network, pick.station))
+            if station is None:
+                continue
+            for channel in station.channels:
+                if channel.channel[-1] not in 'NE12':
+                    continue
+                tr = channel.tr.slice(pick.time - self.pad,
+                                      pick.time + self.window_length +
+                                      self.pad)
+                jobs.append((tr, pick.time, pick.time + self.window_length))
+                picks.append(pick)
+        if not jobs:
+            self._setMagnitudes(event, [], [])
+            return
+        self.parent.workers.submit(
+            measureAmplitudes, (jobs, self.parent.responses.water_level),
+            callback=lambda amplitudes:
+            self._setMagnitudes(event, picks, amplitudes),
+            errback=lambda error: self._setMagnitudes(event, [], []))
+
+    def _setMagnitudes(self, event, picks, amplitudes):
+        '''
+        WorkerPool callback of measure, keeps the larger horizontal
+        amplitude per station
+        '''
+        station_amplitudes = {}
+        for pick, amplitude in zip(picks, amplitudes):
+            if not np.isnan(amplitude) and\
+               amplitude > station_amplitudes.get(pick, 0.):
+                station_amplitudes[pick] = amplitude
+        for pick in self._anchorPicks(event).values():
+            pick.wa_amplitude = station_amplitudes.get(pick)
+            pick.magnitude = None
+
+        picks = [pick for pick in station_amplitudes if pick in event.picks]
+        event.magnitude = None
+        if picks and event.location is not None:
+            location = event.location
+            distances = np.hypot(epicentralDistance(
+                [pick.station_lat for pick in picks],
+                [pick.station_lon for pick in picks],
+                location['latitude'], location['longitude']),
+                location['depth'])
+            magnitudes = localMagnitude(
+                np.array([pick.wa_amplitude for pick in picks]) / 2.,
+                distances)
+            for pick, magnitude in zip(picks, magnitudes):
+                pick.magnitude = float(magnitude)
+            event.magnitude = float(np.median(magnitudes))
+        event._updateItemText()
@@ -35,7 +35,7 @@ class Ui_MainWindow(object):
         self.verticalLayout = QtGui.QVBoxLayout(self.layoutWidget)
         self.verticalLayout.setContentsMargins(-1, -1, -1, 0)
         self.verticalLayout.setObjectName("verticalLayout")
-        self.stationTree = QtGui.QTreeWidget(self.layoutWidget)
+        self.stationTree = QtGui.QTreeView(self.layoutWidget)
         self.stationTree.setEnabled(True)
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
@@ -49,7 +49,6 @@ class Ui_MainWindow(object):
         self.stationTree.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
         self.stationTree.setAnimated(True)
         self.stationTree.setObjectName("stationTree")
-        self.stationTree.headerItem().setText(0, "1")
         self.stationTree.header().setVisible(False)
         self.verticalLayout.addWidget(self.stationTree)
         self.groupBox = QtGui.QGroupBox(self.layoutWidget)
@@ -149,7 +148,7 @@ class Ui_MainWindow(object):
         self.pick2.setAutoExclusive(True)
         self.pick2.setObjectName("pick2")
         self.gridLayout.addWidget(self.pick2, 0, 4, 1, 1)
-        self.eventTree = QtGui.QTreeWidget(self.pageEvents)
+        self.eventTree = QtGui.QTreeView(self.pageEvents)
         self.eventTree.setGeometry(QtCore.QRect(0, 0, 260, 231))
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Maximum)
         sizePolicy.setHorizontalStretch(0)
@@ -347,7 +346,6 @@ class Ui_MainWindow(object):
         self.pick2.setText(QtGui.QApplication.translate("MainWindow", "2", None, QtGui.QApplication.UnicodeUTF8))
         self.pick2.setShortcut(QtGui.QApplication.translate("MainWindow", "F6", None, QtGui.QApplication.UnicodeUTF8))
         self.eventTree.setStatusTip(QtGui.QApplication.translate("MainWindow", "Double click to change active event or highlight pick.", None, QtGui.QApplication.UnicodeUTF8))
-        self.eventTree.headerItem().setText(0, QtGui.QApplication.translate("MainWindow", "ID", None, QtGui.QApplication.UnicodeUTF8))
         self.addEventBtn.setText(QtGui.QApplication.translate("MainWindow", "Add Event", None, QtGui.QApplication.UnicodeUTF8))
         self.deleteItemBtn.setText(QtGui.QApplication.translate("MainWindow", "Delete Item", None, QtGui.QApplication.UnicodeUTF8))
         self.toolBox.setItemText(self.toolBox.indexOf(self.pageEvents), QtGui.QApplication.translate("MainWindow", "Event Picks", None, QtGui.QApplication.UnicodeUTF8))
@@ -0,0 +1,337 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+import numpy as np
+
+import heapq
+import itertools
+
+CATEGORIES = ('raw', 'processed', 'cached', 'graphics')
+DERIVED = ('processed', 'cached', 'graphics')
+
+
+def _owner(array):
+    '''
+    The array owning the memory of a view, so shared buffers are counted
+    once
+    '''
+    while isinstance(getattr(array, 'base', None), np.ndarray):
+        array = array.base
+    return array
+
+
+def _arrays(value):
+    '''
+    Yields the arrays held by a cache value, see LRUCache.sizeOf
+    '''
+    if isinstance(value, (tuple, list)):
+        for v in value:
+            for array in _arrays(v):
+                yield array
+    elif isinstance(getattr(value, 'data', None), np.ndarray):
+        yield value.data
+    elif isinstance(value, np.ndarray):
+        yield value
+
+
+def _traceStation(key):
+    '''
+    (network, station) of a cache key starting with a trace id
+    '''
+    return tuple(key[0].split('.')[:2])
+
+
+def formatBytes(nbytes):
+    return '%.0f MB' % (nbytes / 1024.**2)
+
+
+class MemoryManager(object):
+    '''
+    Accounts the memory held per Station() and enforces a global budget
+    for the arrays derived from the raw data
+
+    A station's footprint is split into raw data, processed display
+    traces, entries of the processing caches and graphics buffers. Shared
+    buffers are counted once. Raw data is never dropped and does not
+    count against the budget. Once the derived arrays exceed the budget,
+    those of hidden stations are dropped first, then cache entries of the
+    least recently viewed visible stations. The usage is shown in the
+    status bar if the parent has one.
+
+    Footprints are kept per station and recounted only for stations
+    passed to stationChanged() or whose cache entries changed, the caches
+    report their insertions and evictions through LRUCache.listeners.
+    '''
+    def __init__(self, parent, budget=1024**3):
+        '''
+        :param parent: wavePicker main window
+        :param budget: Budget of the derived arrays in bytes, type int
+                       (default: 1 GB)
+        '''
+        self.parent = parent
+        self.budget = budget
+        self._viewed = {}
+        self._clock = itertools.count()
+        self._stations = None   # (network, station) and Station()
+        self._footprints = {}   # Station() and dict of category and bytes
+        self._totals = dict((category, 0) for category in CATEGORIES)
+        self._dirty = set()     # stations to recount
+        self._cached = {}       # (network, station) and dict of id and
+                                # [cached array, number of entries]
+        self._watched = set()
+
+        self.label = None
+        if getattr(parent, 'statusbar', None) is not None:
+            self.label = QLabel()
+            parent.statusbar.addPermanentWidget(self.label)
+
+    def caches(self):
+        '''
+        :return: list of (LRUCache, function mapping a key to
+                 (network, station)) of the per station caches
+        '''
+        main = self.parent
+        caches = [(main.responses.cache, _traceStation),
+                  (main.rotator.cache, lambda key: key[:2])]
+        if hasattr(main, 'prefetcher'):
+            caches += [(main.prefetcher.cache, _traceStation),
+                       (main.spectrogramCache, _traceStation)]
+        return caches
+
+    def touch(self, station):
+        '''
+        Marks the Station() as viewed now
+        '''
+        self._viewed[station] = next(self._clock)
+
+    def update(self):
+        '''
+        Schedules budget enforcement and the status bar readout
+        '''
+        self.parent.scheduler.schedule(('memory', self), self._update)
+
+    def stationAdded(self, station):
+        '''
+        Accounts a Station() added to the Stations() container
+        '''
+        if self._stations is not None:
+            self._stations[(station.stats.network,
+                            station.stats.station)] = station
+        self.stationChanged(station)
+
+    def stationChanged(self, station):
+        '''
+        Marks the arrays of the Station() changed and schedules update()
+        '''
+        self._dirty.add(station)
+        self.update()
+
+    def _watch(self):
+        '''
+        Subscribes to the caches not watched yet, some are created after
+        the MemoryManager
+        '''
+        for cache, station in self.caches():
+            if id(cache) in self._watched:
+                continue
+            self._watched.add(id(cache))
+            listener = (lambda key, value, added, station=station:
+                        self._cacheChanged(station(key), value, added))
+            cache.listeners.append(listener)
+            for key, value in cache.items():
+                listener(key, value, True)
+
+    def _cacheChanged(self, codes, value, added):
+        '''
+        LRUCache listener, counts the cached arrays of (network, station)
+        '''
+        owners = self._cached.setdefault(codes, {})
+        for array in _arrays(value):
+            owner = _owner(array)
+            entry = owners.get(id(owner))
+            if added:
+                if entry is None:
+                    owners[id(owner)] = [owner, 1]
+                else:
+                    entry[1] += 1
+            elif entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del owners[id(owner)]
+        if self._stations is not None and codes in self._stations:
+            self._dirty.add(self._stations[codes])
+
+    def _update(self):
+        self.enforce()
+        self._updateLabel()
+
+    def _stationArrays(self, station):
+        '''
+        :return: dict of category and list of arrays held by the Station()
+        '''
+        arrays = dict((category, []) for category in CATEGORIES)
+        for channel in station.channels:
+            arrays['raw'].append(channel.tr.data)
+        for channel in station.channels + station.rotated:
+            if channel.plotTrace is not None:
+                arrays['processed'].append(channel.plotTrace.data)
+            if channel.traceItem is not None:
+                arrays['graphics'].extend(
+                    [getattr(channel.traceItem, 'xData', None),
+                     getattr(channel.traceItem, 'yData', None)])
+            if channel._coarse is not None:
+                arrays['graphics'].extend(channel._coarse[2:])
+        if station.spectrogram is not None:
+            arrays['graphics'].extend(image.image for image in
+                                      station.spectrogram.images.values())
+        return arrays
+
+    def _recount(self, station):
+        '''
+        Counts the bytes of the Station() per category and updates the
+        totals
+        '''
+        arrays = self._stationArrays(station)
+        arrays['cached'] = [entry[0] for entry in self._cached.get(
+            (station.stats.network, station.stats.station), {}).values()]
+        seen = set()
+        footprint = dict((category, 0) for category in CATEGORIES)
+        for category in CATEGORIES:
+            for array in arrays[category]:
+                if array is None:
+                    continue
+                owner = _owner(array)
+                if id(owner) not in seen:
+                    seen.add(id(owner))
+                    footprint[category] += owner.nbytes
+        old = self._footprints.get(station)
+        for category in CATEGORIES:
+            self._totals[category] += footprint[category] -\
+                (old[category] if old is not None else 0)
+        self._footprints[station] = footprint
+
+    def _refresh(self):
+        '''
+        Recounts the stations changed since the last call, all stations
+        on the first call
+        '''
+        self._watch()
+        if self._stations is None:
+            self._stations = dict(((station.stats.network,
+                                    station.stats.station), station)
+                                  for station in self.parent.stations)
+            self._dirty.update(self.parent.stations)
+        dirty, self._dirty = self._dirty, set()
+        for station in dirty:
+            self._recount(station)
+
+    def _reviewFootprint(self):
+        footprint = dict((category, 0) for category in CATEGORIES)
+        review = getattr(self.parent, 'review', None)
+        if review is not None:
+            footprint['cached'] = review.cache.nbytes
+        return footprint
+
+    def footprints(self):
+        '''
+        Bytes held per Station() and category, a buffer shared between
+        categories is accounted to the first of raw, processed, cached
+        and graphics
+
+        ::return::
+        dict of Station() and dict of category and bytes, the review mode
+        cache is listed under None
+        '''
+        self._refresh()
+        footprints = dict(self._footprints)
+        footprints[None] = self._reviewFootprint()
+        return footprints
+
+    def usage(self, footprints=None):
+        '''
+        :return: dict of category and total bytes
+        '''
+        if footprints is not None:
+            return dict((category, sum(footprint[category]
+                                       for footprint in footprints.values()))
+                        for category in CATEGORIES)
+        self._refresh()
+        review = self._reviewFootprint()
+        return dict((category, self._totals[category] + review[category])
+                    for category in CATEGORIES)
+
+    def _evictionOrder(self):
+        '''
+        Hidden stations before visible ones, least recently viewed first
+        '''
+        return sorted(self.parent.stations,
+                      key=lambda station: (station.visible,
+                                           self._viewed.get(station, -1)))
+
+    def release(self, station):
+        '''
+        Drops the cache entries of the Station() and, if it is hidden, its
+        processed traces
+        '''
+        codes = (station.stats.network, station.stats.station)
+        for cache, key_station in self.caches():
+            for key in cache.keys():
+                if key_station(key) == codes:
+                    cache.pop(key)
+        if station.visible:
+            return
+        for channel in station.channels + station.rotated:
+            if channel.traceItem is None:
+                channel.plotTrace = None
+                channel.plotTrace_key = None
+                channel.peak = None
+                channel._front = None
+        self._dirty.add(station)
+
+    def enforce(self):
+        '''
+        Releases stations in eviction order until the derived arrays are
+        below the budget, the review mode cache is shrunk last
+
+        :return: released bytes
+        '''
+        usage = self.usage()
+        excess = sum(usage[category] for category in DERIVED) - self.budget
+        if excess <= 0:
+            return 0
+        footprints = self.footprints()
+        released = 0
+        for station in self._evictionOrder():
+            if released >= excess:
+                break
+            footprint = footprints[station]
+            droppable = footprint['cached'] + (0 if station.visible
+                                               else footprint['processed'])
+            if droppable:
+                self.release(station)
+                released += droppable
+        review = getattr(self.parent, 'review', None)
+        if released < excess and review is not None:
+            nbytes = review.cache.nbytes
+            review.cache.evict(max(nbytes - (excess - released), 0))
+            released += nbytes - review.cache.nbytes
+        return max(released, 0)
+
+    def _updateLabel(self):
+        if self.label is None:
+            return
+        usage = self.usage()
+        footprints = self._footprints
+        self.label.setText('Memory %s, derived %s / %s' % (
+            formatBytes(sum(usage.values())),
+            formatBytes(sum(usage[category] for category in DERIVED)),
+            formatBytes(self.budget)))
+        largest = heapq.nlargest(
+            10, footprints,
+            key=lambda station: sum(footprints[station].values()))
+        lines = ['%s %s' % (category, formatBytes(usage[category]))
+                 for category in CATEGORIES]
+        lines += ['%s.%s %s' % (station.stats.network, station.stats.station,
+                                formatBytes(sum(footprints[station].values())))
+                  for station in largest]
+        self.label.setToolTip('\n'.join(lines))
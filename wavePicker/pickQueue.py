@@ -0,0 +1,121 @@
+from PySide.QtCore import *
+
+import threading
+
+
+class PickQueue(QObject):
+    '''
+    Thread safe entry point for picks of concurrent producers, e.g.
+    automatic pickers running in the WorkerPool
+
+    submit() only appends to a lock protected list and may be called from
+    any thread. The GUI thread is woken once per batch through a queued
+    signal and applies up to batch_size picks at a time, grouped by event,
+    with Event.addPicksToEvent. Each batch is one undo step and each
+    event one store transaction per batch, so undo follows the batch
+    boundaries: a batch of several events is undone at once and an event
+    split across batches takes several undo steps. The picks of the
+    affected visible stations are redrawn once per batch.
+    '''
+    _wake = Signal()
+
+    def __init__(self, events, batch_size=5000):
+        '''
+        :param events: Events() the picks are added to
+        :param batch_size: Maximum number of picks applied per pass of the
+                           event loop, type int
+        '''
+        super(PickQueue, self).__init__()
+        self.events = events
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._scheduled = False
+        self._wake.connect(self._drain, Qt.QueuedConnection)
+
+    def submit(self, event_id, pickevt):
+        '''
+        Queues a pick, thread safe
+
+        :param event_id: id of the Event(), created if missing, None adds
+                         the pick to the active event
+        :param pickevt: pickevt dictionary as for Event.addPickToEvent, the
+                        phase may be given by name
+        '''
+        self.submitMany(event_id, [pickevt])
+
+    def submitMany(self, event_id, pickevts):
+        '''
+        Queues a list of picks of one event, thread safe
+        '''
+        with self._lock:
+            self._pending.extend((event_id, pickevt) for pickevt in pickevts)
+            if self._scheduled or not self._pending:
+                return
+            self._scheduled = True
+        self._wake.emit()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _take(self, count=None):
+        with self._lock:
+            if count is None:
+                count = len(self._pending)
+            batch = self._pending[:count]
+            del self._pending[:count]
+            self._scheduled = bool(self._pending)
+            return batch, self._scheduled
+
+    def _drain(self):
+        batch, remaining = self._take(self.batch_size)
+        self.apply(batch)
+        if remaining:
+            self._wake.emit()
+
+    def flush(self):
+        '''
+        Applies all queued picks right away, e.g. without an event loop
+        '''
+        batch, _ = self._take()
+        self.apply(batch)
+
+    def apply(self, batch):
+        '''
+        Adds a list of (event_id, pickevt) to the events, GUI thread only
+        '''
+        from guiContainer import getPhase
+        if not batch:
+            return
+        events = self.events
+        groups = {}
+        for event_id, pickevt in batch:
+            if event_id is None:
+                if events.active_event is None:
+                    continue
+                event_id = events.active_event.id
+            if not hasattr(pickevt['phase'], 'name'):
+                pickevt['phase'] = getPhase(pickevt['phase'])
+            groups.setdefault(event_id, []).append(pickevt)
+
+        picked = set()
+        with events.parent.undo.group():
+            for event_id in sorted(groups):
+                event = events.getEvent(event_id)
+                if event is None:
+                    events.addEvent(event_id, activate=False)
+                    event = events.getEvent(event_id)
+                for pick in event.addPicksToEvent(groups[event_id]):
+                    picked.add((pick.network, pick.station))
+        self._updatePlots(picked)
+
+    def _updatePlots(self, picked):
+        stations = getattr(self.events.parent, 'stations', None)
+        if stations is None:
+            return
+        for station in stations.visibleStations():
+            if station.plotItem is None or\
+               (station.stats.network, station.stats.station) not in picked:
+                continue
+            (station.getSelectedChannel() or station.channels[0]).plotPickItems()
@@ -0,0 +1,70 @@
+from cache import LRUCache
+
+
+class Prefetcher(object):
+    '''
+    Prepares the next page of stations in the WorkerPool
+
+    The next page is predicted from the current sort order of Stations(),
+    its channels are corrected and filtered in the background while the
+    analyst works on the current page. Results are kept in an LRUCache
+    bounded by the memory budget until Channel.plotTraceItem picks them
+    up, so they are not held twice.
+    '''
+    def __init__(self, parent, budget=512*1024**2):
+        '''
+        :param parent: wavePicker main window
+        :param budget: Memory budget in bytes, type int (default: 512 MB)
+        '''
+        self.parent = parent
+        self.budget = budget
+        self.cache = LRUCache(maxbytes=budget)
+        self._pending = set()
+
+    @staticmethod
+    def cacheKey(channel, processing_key):
+        return (channel.tr.id, channel.tr.stats.starttime.timestamp,
+                processing_key)
+
+    def get(self, channel, processing_key):
+        '''
+        Takes the prefetched result out of the cache, the channel holds it
+        from now on
+
+        :return: prefetched (trace, peak) of Channel() or None
+        '''
+        return self.cache.pop(self.cacheKey(channel, processing_key))
+
+    def predictNext(self):
+        '''
+        :return: list of Station() of the next page in sort order
+        '''
+        stations = self.parent.stations.stations
+        visible = [i for i, station in enumerate(stations) if station.visible]
+        start = visible[-1] + 1 if visible else 0
+        return [station for station in
+                stations[start:start + self.parent.nplots]
+                if not station.visible]
+
+    def schedule(self):
+        '''
+        Submits the channels of the predicted page, stops at the budget
+        '''
+        nbytes = 0
+        for station in self.predictNext():
+            for channel in station.componentOrder():
+                nbytes += channel.tr.stats.npts * 8
+                if nbytes > self.budget:
+                    return
+                key = self.cacheKey(channel, channel.processingKey())
+                if key in self.cache or key in self._pending:
+                    continue
+                self._pending.add(key)
+                channel.processTraceData(
+                    lambda result, key=key: self._ready(key, result),
+                    errback=lambda error, key=key: self._pending.discard(key))
+
+    def _ready(self, key, result):
+        self._pending.discard(key)
+        self.cache.put(key, result)
+        self.parent.memory.update()
@@ -0,0 +1,210 @@
+import sqlite3
+
+from obspy.core import UTCDateTime
+
+
+class ProjectStore(object):
+    '''
+    SQLite backed project file holding events, picks and stations
+
+    Every pick is written incrementally as it is made, the file is never
+    rewritten as a whole. Picks are indexed by event, station and time so
+    events can be loaded lazily and queried quickly.
+    '''
+    _schema = '''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS stations (
+            network TEXT NOT NULL,
+            station TEXT NOT NULL,
+            location TEXT NOT NULL DEFAULT '',
+            latitude REAL,
+            longitude REAL,
+            elevation REAL,
+            PRIMARY KEY (network, station, location)
+        );
+        CREATE TABLE IF NOT EXISTS picks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL REFERENCES events(id),
+            network TEXT NOT NULL,
+            station TEXT NOT NULL,
+            location TEXT NOT NULL DEFAULT '',
+            channel TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            time REAL NOT NULL,
+            amplitude REAL,
+            station_lat REAL,
+            station_lon REAL
+        );
+        CREATE INDEX IF NOT EXISTS picks_event ON picks (event_id);
+        CREATE INDEX IF NOT EXISTS picks_station ON picks (network, station);
+        CREATE INDEX IF NOT EXISTS picks_time ON picks (time);
+    '''
+
+    def __init__(self, filename):
+        '''
+        Opens or creates the project file
+
+        :param filename: Path to the SQLite file, type string
+        '''
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(self._schema)
+        self.db.commit()
+
+    '''
+    Writing
+    '''
+    def addEvent(self, event_id):
+        with self.db:
+            self.db.execute('INSERT OR IGNORE INTO events (id) VALUES (?)',
+                            (event_id,))
+
+    def deleteEvent(self, event_id):
+        with self.db:
+            self.db.execute('DELETE FROM picks WHERE event_id = ?',
+                            (event_id,))
+            self.db.execute('DELETE FROM events WHERE id = ?', (event_id,))
+
+    def addPick(self, pick):
+        '''
+        Inserts a Pick() and stores the row id on pick.store_id
+        '''
+        with self.db:
+            cur = self.db.execute(
+                'INSERT INTO picks (event_id, network, station, location, '
+                'channel, phase, time, amplitude, station_lat, station_lon) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._pickRow(pick))
+        pick.store_id = cur.lastrowid
+        return pick.store_id
+
+    def addPicks(self, picks):
+        '''
+        Bulk insert of a list of Pick() in one transaction
+        '''
+        with self.db:
+            for pick in picks:
+                cur = self.db.execute(
+                    'INSERT INTO picks (event_id, network, station, location, '
+                    'channel, phase, time, amplitude, station_lat, '
+                    'station_lon) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    self._pickRow(pick))
+                pick.store_id = cur.lastrowid
+
+    def deletePick(self, pick):
+        if getattr(pick, 'store_id', None) is None:
+            return
+        with self.db:
+            self.db.execute('DELETE FROM picks WHERE id = ?',
+                            (pick.store_id,))
+        pick.store_id = None
+
+    def updateStations(self, stations):
+        '''
+        Writes the station table from a Stations() container
+        '''
+        rows = []
+        for station in stations:
+            lat, lon = station.getCoordinates()
+            try:
+                elevation = station.stats.coordinates.get('elevation', 0.0)
+            except AttributeError:
+                elevation = 0.0
+            rows.append((station.stats.network, station.stats.station,
+                         station.stats.location, lat, lon, elevation))
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO stations VALUES '
+                                '(?, ?, ?, ?, ?, ?)', rows)
+
+    @staticmethod
+    def _pickRow(pick):
+        try:
+            amplitude = float(pick.amplitude)
+        except (TypeError, ValueError):
+            amplitude = None
+        return (pick.event.id, pick.network, pick.station, pick.location,
+                pick.component, pick.phase.name, pick.time.timestamp,
+                amplitude, pick.station_lat, pick.station_lon)
+
+    '''
+    Reading
+    '''
+    def getEventSummary(self):
+        '''
+        Returns a list of (event_id, npicks, nstations) without loading picks
+        '''
+        return [tuple(row) for row in self.db.execute(
+            'SELECT e.id, COUNT(p.id), COUNT(DISTINCT p.station) '
+            'FROM events e LEFT JOIN picks p ON p.event_id = e.id '
+            'GROUP BY e.id ORDER BY e.id')]
+
+    def getStationEvents(self, network, station):
+        '''
+        Returns the ids of the events with picks of a station
+        '''
+        return [row[0] for row in self.db.execute(
+            'SELECT DISTINCT event_id FROM picks '
+            'WHERE network = ? AND station = ?', (network, station))]
+
+    def getEventPicks(self, event_id):
+        '''
+        Returns the picks of one event as pickevt dictionaries
+        '''
+        return self.queryPicks(event_id=event_id)
+
+    def queryPicks(self, event_id=None, network=None, station=None,
+                   phase=None, starttime=None, endtime=None):
+        '''
+        Query picks, all arguments are optional and combined
+
+        :param starttime: UTCDateTime
+        :param endtime: UTCDateTime
+
+        ::return::
+        list of pickevt dictionaries with 'phase' as name string
+        '''
+        where = []
+        args = []
+        for key, value in (('event_id', event_id), ('network', network),
+                           ('station', station), ('phase', phase)):
+            if value is not None:
+                where.append('%s = ?' % key)
+                args.append(value)
+        if starttime is not None:
+            where.append('time >= ?')
+            args.append(UTCDateTime(starttime).timestamp)
+        if endtime is not None:
+            where.append('time <= ?')
+            args.append(UTCDateTime(endtime).timestamp)
+        query = 'SELECT * FROM picks'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY time'
+        return [self._pickDict(row) for row in self.db.execute(query, args)]
+
+    def getStations(self):
+        return [dict(zip(row.keys(), row)) for row in
+                self.db.execute('SELECT * FROM stations')]
+
+    @staticmethod
+    def _pickDict(row):
+        return {
+            'store_id': row['id'],
+            'event_id': row['event_id'],
+            'station_id': '%s.%s.%s.%s' % (row['network'], row['station'],
+                                           row['location'], row['channel']),
+            'phase': row['phase'],
+            'time': UTCDateTime(row['time']),
+            'amplitude': row['amplitude'] if row['amplitude'] is not None
+            else '',
+            'station_lat': row['station_lat'],
+            'station_lon': row['station_lon']
+        }
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,78 @@
+from PySide.QtCore import *
+
+
+class RangeController(QObject):
+    '''
+    Shared time range of all visible Station() plots
+
+    Replaces the chain of setXLink between the station ViewBoxes. Plots
+    subscribe their ViewBox, a pan or zoom in one of them is stored and
+    applied to all others once per frame, so the cost of an interaction
+    does not grow with the number of linked views. Subscribing and
+    unsubscribing a plot is O(1).
+    '''
+    def __init__(self, parent=None, interval=16):
+        '''
+        :param interval: Minimum time between propagations in ms, type int
+                         (default: 16, about one frame)
+        '''
+        super(RangeController, self).__init__(parent)
+        self.range = None
+        self._views = {}
+        self._source = None
+        self._propagating = False
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(interval)
+        self._timer.timeout.connect(self.propagate)
+
+    def subscribe(self, viewBox):
+        '''
+        Adds a pg.ViewBox, it is set to the shared range right away. The
+        first view keeps auto ranging and defines the range
+        '''
+        if id(viewBox) in self._views:
+            return
+        self._views[id(viewBox)] = viewBox
+        viewBox.sigXRangeChanged.connect(self._rangeChanged)
+        if self.range is not None:
+            viewBox.enableAutoRange(x=False)
+            self._setRange(viewBox, self.range)
+        else:
+            self.range = tuple(viewBox.viewRange()[0])
+
+    def unsubscribe(self, viewBox):
+        if self._views.pop(id(viewBox), None) is None:
+            return
+        viewBox.sigXRangeChanged.disconnect(self._rangeChanged)
+        if self._source is viewBox:
+            self._source = None
+        if not self._views:
+            self.range = None
+
+    def _rangeChanged(self, viewBox, xrange):
+        if self._propagating:
+            return
+        self.range = tuple(xrange)
+        self._source = viewBox
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def _setRange(self, viewBox, xrange):
+        self._propagating = True
+        try:
+            viewBox.setXRange(xrange[0], xrange[1], padding=0)
+        finally:
+            self._propagating = False
+
+    def propagate(self):
+        '''
+        Applies the latest range to all views but the one it came from
+        '''
+        self._timer.stop()
+        if self.range is None:
+            return
+        for viewBox in self._views.values():
+            if viewBox is not self._source:
+                self._setRange(viewBox, self.range)
+        self._source = None
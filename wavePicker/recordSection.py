@@ -0,0 +1,378 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+import numpy as np
+import pyqtgraph as pg
+
+from guiContainer import processTrace
+from renderer import envelope
+from travelTimes import epicentralDistance
+
+
+def sectionTraces(traces, filterArgs, reference, window, npoints):
+    '''
+    Filters, normalizes and decimates traces for the RecordSection, runs
+    in the WorkerPool. One work buffer is reused for all traces, so only
+    the decimated arrays are kept
+
+    :param reference: obspy.core.UTCDateTime the times are relative to
+    :param window: (start, end) in s after reference or None for all
+    :param npoints: Envelope bins per trace, about the plot width in
+                    pixels, type int
+
+    ::return::
+    list of (times in s after reference, samples normalized to +-.5)
+    '''
+    sections = []
+    buffer = None
+    for tr in traces:
+        if window is not None:
+            tr = tr.slice(reference + window[0], reference + window[1])
+        npts = tr.stats.npts
+        if not npts:
+            sections.append((np.zeros(0), np.zeros(0, dtype=np.float32)))
+            continue
+        if buffer is None or len(buffer) < npts:
+            buffer = np.empty(npts, dtype=np.float32)
+        data, peak = processTrace(tr, filterArgs, out=buffer)
+        data = data.data
+        step = max(npts // npoints, 1)
+        x, y = (envelope(data, step) if step > 1
+                else (np.arange(npts), data.copy()))
+        y *= .5 / peak if peak else 0.
+        sections.append((x.astype(np.float64) * tr.stats.delta +
+                         (tr.stats.starttime - reference), y))
+    return sections
+
+
+class _Click(object):
+    '''
+    Mouse click at a sample index of a Channel(), as passed by the
+    trace curve to Channel.pickPhase
+    '''
+    def __init__(self, index):
+        self._pos = QPointF(index, 0.)
+
+    def pos(self):
+        return self._pos
+
+
+class RecordSection(QObject):
+    '''
+    All stations in one plot, offset by epicentral distance or by the
+    station order
+
+    The selected channel of every station is filtered, normalized and
+    decimated to the plot width in a single WorkerPool job and drawn as
+    one pg.PlotCurveItem, so the cost of a repaint does not grow with
+    the number of stations. Zooming re-decimates the visible window.
+    Picks and the predicted P and S moveouts are one curve per phase.
+    Clicks pick the nearest trace through Channel.pickPhase.
+    '''
+    OFFSETS = ('Distance', 'Station Order')
+
+    def __init__(self, parent, oversample=2, delay=200):
+        '''
+        :param parent: wavePicker main window
+        :param oversample: Envelope bins per pixel, type int
+        :param delay: Re-decimation delay after zooming in ms, type int
+        '''
+        super(RecordSection, self).__init__(parent)
+        self.parent = parent
+        self.oversample = oversample
+        self.enabled = False
+        self.offset = 'Distance'
+        self.gain = 1.
+        self.channels = []
+        self.offsets = np.zeros(0)
+        self.spacing = 1.
+        self.coordinates = np.zeros((0, 2))
+        self.reference = None
+        self._generation = 0
+        self._window = None   # time window requested from the workers
+        self._covered = None  # time span of the drawn data
+        self.extent = (0., 0.)
+        self._x = self._y = None
+        self._lengths = []
+
+        self._zoomTimer = QTimer(self)
+        self._zoomTimer.setSingleShot(True)
+        self._zoomTimer.setInterval(delay)
+        self._zoomTimer.timeout.connect(self._zoomed)
+        self._initDock()
+
+        model = parent.events.model
+        model.rowsInserted.connect(self.updateOverlay)
+        model.rowsRemoved.connect(self.updateOverlay)
+        model.modelReset.connect(self.updateOverlay)
+        model.dataChanged.connect(self.relocated)
+        parent.trialHypocenter.sigChanged.connect(self.update)
+
+    def _initDock(self):
+        self.dock = QDockWidget('Record Section', self.parent)
+        self.dock.setObjectName('recordSectionDock')
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.plot = pg.PlotWidget()
+        self.plotItem = self.plot.getPlotItem()
+        self.plotItem.setLabel('bottom', 'Time [s]')
+        self.plotItem.setLabel('left', self.offset)
+        self.curve = pg.PlotCurveItem(pen=pg.mkPen('w', width=1))
+        self.plotItem.addItem(self.curve)
+        self.pickCurves = {}
+        self.moveoutCurves = {}
+        for phase, color in (('P', 'r'), ('S', 'g')):
+            self.moveoutCurves[phase] = pg.PlotCurveItem(
+                pen=pg.mkPen(color, style=Qt.DashLine))
+            self.plotItem.addItem(self.moveoutCurves[phase])
+        self.plotItem.getViewBox().sigXRangeChanged.connect(
+            lambda *args: self._zoomTimer.start())
+        self.plot.scene().sigMouseClicked.connect(self._clicked)
+        layout.addWidget(self.plot)
+
+        form = QFormLayout()
+        self.offsetCombo = QComboBox()
+        self.offsetCombo.addItems(list(self.OFFSETS))
+        self.offsetCombo.currentIndexChanged.connect(self._offsetChanged)
+        form.addRow('Offset', self.offsetCombo)
+        self.gainSpin = QDoubleSpinBox()
+        self.gainSpin.setRange(.1, 20.)
+        self.gainSpin.setSingleStep(.5)
+        self.gainSpin.setValue(self.gain)
+        self.gainSpin.valueChanged.connect(self._gainChanged)
+        form.addRow('Gain', self.gainSpin)
+        layout.addLayout(form)
+
+        self.dock.setWidget(widget)
+        self.dock.visibilityChanged.connect(self.setEnabled)
+        self.parent.addDockWidget(Qt.BottomDockWidgetArea, self.dock)
+        self.dock.hide()
+
+    def setEnabled(self, enabled=True):
+        self.enabled = enabled
+        self.update()
+
+    def _offsetChanged(self, index):
+        self.offset = self.OFFSETS[index]
+        self.plotItem.setLabel('left', self.offset)
+        self._setOffsets()
+        self._draw()
+
+    def _gainChanged(self, gain):
+        self.gain = gain
+        self._draw()
+
+    def update(self):
+        '''
+        Schedules a redraw of the section
+        '''
+        if self.enabled:
+            self.parent.scheduler.schedule(('recordSection', self),
+                                           self._refresh)
+
+    def hypocenter(self):
+        '''
+        Location of the active event if located, else the trial hypocenter
+
+        ::return::
+        latitude, longitude, depth and origin time
+        '''
+        event = self.parent.events.active_event
+        if event is not None and event.location is not None:
+            location = event.location
+            return (location['latitude'], location['longitude'],
+                    location['depth'], location['origin_time'])
+        trial = self.parent.trialHypocenter
+        return (trial.latitude, trial.longitude, trial.depth,
+                trial.origin_time)
+
+    def distances(self):
+        '''
+        Epicentral distances of the stations to hypocenter() in km
+        '''
+        latitude, longitude = self.hypocenter()[:2]
+        return epicentralDistance(self.coordinates[:, 0],
+                                  self.coordinates[:, 1], latitude, longitude)
+
+    def _layout(self):
+        '''
+        Sets the channels, their offsets and the trace spacing
+        '''
+        stations = list(self.parent.stations)
+        self.channels = [station.getSelectedChannel() or station.channels[0]
+                         for station in stations]
+        self.coordinates = np.array([station.getCoordinates()
+                                     for station in stations]).reshape(-1, 2)
+        reference = min(channel.tr.stats.starttime
+                        for channel in self.channels)
+        if reference != self.reference:
+            self.reference = reference
+            self._window = self._covered = None
+        self.extent = (0., max(channel.tr.stats.endtime
+                               for channel in self.channels) - reference)
+        self._setOffsets()
+
+    def _setOffsets(self):
+        distances = self.distances()
+        if self.offset == 'Distance' and np.ptp(distances) > 0.:
+            self.offsets = distances
+            self.spacing = np.ptp(distances) / max(len(distances) - 1, 1)
+        else:
+            self.offsets = np.arange(len(distances), dtype=float)
+            self.spacing = 1.
+
+    def _refresh(self):
+        if not len(self.parent.stations):
+            return
+        self._layout()
+        main = self.parent
+        self._generation += 1
+        generation = self._generation
+        window = self._window
+        npoints = max(int(self.plotItem.getViewBox().width()), 100) *\
+            self.oversample
+        filterArgs = main.filterArgs
+
+        def _submit(traces):
+            main.workers.submit(
+                sectionTraces,
+                (traces, filterArgs, self.reference, window, npoints),
+                callback=lambda sections: self._ready(generation, sections))
+        traces = [channel.tr for channel in self.channels]
+        if main.responses.output is None:
+            _submit(traces)
+        else:
+            main.responses.request(traces, _submit)
+
+    def _ready(self, generation, sections):
+        '''
+        WorkerPool callback, concatenates the traces into one curve
+        '''
+        if generation != self._generation:
+            return
+        self._lengths = [len(x) for x, _ in sections]
+        self._covered = None
+        if sum(self._lengths):
+            self._x = np.concatenate([x for x, _ in sections])
+            self._y = np.concatenate([y for _, y in sections])
+            self._covered = self._window or self.extent
+        self._draw()
+
+    def _draw(self):
+        '''
+        Sets the decimated traces at their offsets and gain
+        '''
+        if self._covered is None or len(self._lengths) != len(self.offsets):
+            self.curve.setData([], [])
+        else:
+            lengths = np.array(self._lengths)
+            y = self._y * (self.gain * self.spacing)
+            y += np.repeat(self.offsets, lengths)
+            connect = np.ones(len(y), dtype=bool)
+            connect[np.cumsum(lengths)[lengths > 0] - 1] = False
+            self.curve.setData(x=self._x, y=y, connect=connect)
+        self._updateOverlay()
+
+    def _zoomed(self):
+        '''
+        Re-decimates the visible window with a margin for panning, once
+        the view leaves the drawn data or zooms in on it
+        '''
+        if not self.enabled or self._covered is None:
+            return
+        xmin, xmax = self.plotItem.getViewBox().viewRange()[0]
+        xmin, xmax = max(xmin, self.extent[0]), min(xmax, self.extent[1])
+        start, end = self._covered
+        if xmax <= xmin or start <= xmin and end >= xmax and\
+           end - start < 4. * (xmax - xmin):
+            return
+        margin = (xmax - xmin) / 2.
+        self._window = (xmin - margin, xmax + margin)
+        self.update()
+
+    def updateOverlay(self, *args):
+        '''
+        Schedules a redraw of the picks and moveouts, bulk insertions into
+        the event tree redraw once
+        '''
+        if self.enabled:
+            self.parent.scheduler.schedule(('recordSectionOverlay', self),
+                                           self._updateOverlay)
+
+    def relocated(self, *args):
+        '''
+        Schedules a redraw at the offsets of the current hypocenter, edits
+        of the active event may have relocated it
+        '''
+        if self.enabled:
+            self.parent.scheduler.schedule(('recordSectionOffsets', self),
+                                           self._relocated)
+
+    def _relocated(self):
+        if not self.enabled or self.reference is None:
+            return
+        offsets = self.offsets
+        self._setOffsets()
+        if np.array_equal(offsets, self.offsets):
+            self._updateOverlay()
+        else:
+            self._draw()
+
+    def _updateOverlay(self):
+        '''
+        Draws the picks of all events and the predicted moveouts
+        '''
+        if not self.enabled or self.reference is None:
+            return
+        rows = dict(((channel.station.stats.network,
+                      channel.station.stats.station), i)
+                    for i, channel in enumerate(self.channels))
+        ticks = {}
+        for event in self.parent.events:
+            for pick in event.picks:
+                row = rows.get((pick.network, pick.station))
+                if row is not None:
+                    ticks.setdefault(pick.phase.color, []).append(
+                        (pick.time - self.reference, self.offsets[row]))
+        for color in set(self.pickCurves) - set(ticks):
+            self.plotItem.removeItem(self.pickCurves.pop(color))
+        half = .5 * self.spacing
+        for color, points in ticks.items():
+            curve = self.pickCurves.get(color)
+            if curve is None:
+                curve = self.pickCurves[color] = pg.PlotCurveItem(
+                    pen=pg.mkPen(color, width=2))
+                self.plotItem.addItem(curve)
+            points = np.array(points)
+            curve.setData(x=np.repeat(points[:, 0], 2),
+                          y=(points[:, 1, np.newaxis] +
+                             [-half, half]).ravel(), connect='pairs')
+
+        _, _, depth, origin_time = self.hypocenter()
+        order = np.argsort(self.offsets, kind='mergesort')
+        distances = self.distances()[order]
+        table = self.parent.trialHypocenter.table
+        for phase, curve in self.moveoutCurves.items():
+            times = table.travelTimes(phase, distances, depth)
+            curve.setData(x=times + (origin_time - self.reference),
+                          y=self.offsets[order], connect='finite')
+
+    def _clicked(self, ev):
+        '''
+        Picks the trace nearest to a left click
+        '''
+        viewBox = self.plotItem.getViewBox()
+        if ev.button() != Qt.LeftButton or ev.double() or\
+           not len(self.channels) or\
+           not viewBox.sceneBoundingRect().contains(ev.scenePos()):
+            return
+        pos = viewBox.mapSceneToView(ev.scenePos())
+        row = int(np.argmin(np.abs(self.offsets - pos.y())))
+        if abs(self.offsets[row] - pos.y()) > .5 * self.spacing:
+            return
+        channel = self.channels[row]
+        index = (self.reference + pos.x() - channel.tr.stats.starttime) /\
+            channel.tr.stats.delta
+        if 0 <= index < channel.tr.stats.npts:
+            channel.pickPhase(_Click(index))
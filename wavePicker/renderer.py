@@ -0,0 +1,155 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+import numpy as np
+import pyqtgraph as pg
+
+from guiContainer import sampleIndex
+
+
+def envelope(data, step):
+    '''
+    Min/max envelope of data in bins of step samples, keeps the peaks
+    visible at a fraction of the points
+
+    ::return::
+    x, y as numpy.ndarray, two points per bin and the remaining samples
+    '''
+    nbins = len(data) // step
+    bins = data[:nbins * step].reshape(nbins, step)
+    tail = data[nbins * step:]
+    y = np.empty(2 * nbins + len(tail), dtype=data.dtype)
+    y[0:2 * nbins:2] = bins.min(axis=1)
+    y[1:2 * nbins:2] = bins.max(axis=1)
+    y[2 * nbins:] = tail
+    x = np.empty(len(y), dtype=np.float32)
+    x[:2 * nbins] = np.arange(2 * nbins) * (step / 2.)
+    x[2 * nbins:] = np.arange(nbins * step, len(data))
+    return x, y
+
+
+class StationViewBox(pg.ViewBox):
+    '''
+    ViewBox of a Station() plot reporting pan and zoom interactions to the
+    InteractionRenderer
+    '''
+    def __init__(self, renderer, *args, **kwargs):
+        super(StationViewBox, self).__init__(*args, **kwargs)
+        self.renderer = renderer
+
+    def mouseDragEvent(self, ev, axis=None):
+        if ev.isStart():
+            self.renderer.begin()
+        super(StationViewBox, self).mouseDragEvent(ev, axis)
+        if ev.isFinish():
+            self.renderer.finish()
+
+    def wheelEvent(self, ev, axis=None):
+        self.renderer.touch()
+        super(StationViewBox, self).wheelEvent(ev, axis)
+
+
+class InteractionRenderer(QObject):
+    '''
+    Level of detail of the trace curves during pan and zoom
+
+    While the user drags or zooms, the visible curves show a min/max
+    envelope at about points_per_pixel points per pixel, without
+    antialiasing. Full detail is restored on release. Repaints of the plot
+    view are capped at max_fps while interacting, so the cost of an
+    interaction frame does not grow with the number of stations.
+    '''
+    def __init__(self, parent, max_fps=30, points_per_pixel=2,
+                 wheel_timeout=200):
+        '''
+        :param parent: wavePicker main window
+        :param max_fps: Repaints per second while interacting, type int
+        :param points_per_pixel: Envelope resolution, type int
+        :param wheel_timeout: Full detail is restored this many ms after
+                              the last wheel zoom, type int
+        '''
+        super(InteractionRenderer, self).__init__(parent)
+        self.parent = parent
+        self.points_per_pixel = points_per_pixel
+        self.interacting = False
+
+        self._frameTimer = QTimer(self)
+        self._frameTimer.setInterval(int(1000 / max_fps))
+        self._frameTimer.timeout.connect(self._repaint)
+        self._wheelTimer = QTimer(self)
+        self._wheelTimer.setSingleShot(True)
+        self._wheelTimer.setInterval(wheel_timeout)
+        self._wheelTimer.timeout.connect(self.finish)
+
+    def viewBox(self):
+        '''
+        New StationViewBox for Station.initPlot
+        '''
+        return StationViewBox(self)
+
+    def _channels(self):
+        for station in self.parent.stations.visibleStations():
+            for channel in station.plotChannels():
+                if channel.traceItem is not None and\
+                   channel.plotTrace is not None:
+                    yield channel
+
+    def begin(self):
+        '''
+        Switches the visible curves to coarse rendering
+        '''
+        if self.interacting:
+            return
+        self.interacting = True
+        view = self.parent.qtGraphLayout
+        view.setViewportUpdateMode(QGraphicsView.NoViewportUpdate)
+        self._frameTimer.start()
+        for channel in self._channels():
+            self.setCoarse(channel)
+
+    def touch(self):
+        '''
+        Begins or extends an interaction without a release event, e.g.
+        zooming with the mouse wheel
+        '''
+        self.begin()
+        self._wheelTimer.start()
+
+    def finish(self):
+        '''
+        Restores full detail and normal repainting
+        '''
+        if not self.interacting:
+            return
+        self._wheelTimer.stop()
+        self._frameTimer.stop()
+        self.interacting = False
+        for channel in self._channels():
+            channel.traceItem.setData(
+                x=sampleIndex(len(channel.plotTrace.data)),
+                y=channel.plotTrace.data, antialias=True)
+            self.parent.memory.stationChanged(channel.station)
+        view = self.parent.qtGraphLayout
+        view.setViewportUpdateMode(QGraphicsView.MinimalViewportUpdate)
+        view.viewport().update()
+
+    def _repaint(self):
+        self.parent.qtGraphLayout.viewport().update()
+
+    def setCoarse(self, channel):
+        '''
+        Sets the envelope of the channel for the current zoom, envelopes
+        are kept on the channel until the data or the zoom changes
+        '''
+        viewBox = channel.station.plotItem.getViewBox()
+        xmin, xmax = viewBox.viewRange()[0]
+        width = max(viewBox.width(), 1.)
+        step = max(int((xmax - xmin) / (width * self.points_per_pixel)), 1)
+        data = channel.plotTrace.data
+        coarse = channel._coarse
+        if coarse is None or coarse[0] is not data or coarse[1] != step:
+            x, y = (envelope(data, step) if step > 1
+                    else (sampleIndex(len(data)), data))
+            coarse = channel._coarse = (data, step, x, y)
+        channel.traceItem.setData(x=coarse[2], y=coarse[3], antialias=False)
+        self.parent.memory.stationChanged(channel.station)
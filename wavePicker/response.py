@@ -0,0 +1,235 @@
+import numpy as np
+
+from cache import cacheDir, LRUCache
+
+import os
+import hashlib
+import threading
+
+_spectra = LRUCache(maxbytes=64*1024**2)
+_spectraLock = threading.Lock()
+
+
+def nextPow2(n):
+    return 1 << int(np.ceil(np.log2(max(n, 1))))
+
+
+def _describe(value):
+    '''
+    Text of a response stage attribute for hashing, objects like stages
+    or response list elements are described by their attributes
+    '''
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ','.join(_describe(v) for v in value)
+    if isinstance(value, (float, complex)):
+        return repr(value)
+    if hasattr(value, '__dict__'):
+        return '{%s}' % ','.join('%s:%s' % (name, _describe(v)) for name, v
+                                 in sorted(vars(value).items()))
+    return repr(value)
+
+
+def responseHash(response):
+    '''
+    md5 of the stages of an obspy Response, poles and zeros, gains and
+    filter coefficients, str(response) is only a summary
+    '''
+    text = _describe([response.instrument_sensitivity] +
+                     list(response.response_stages))
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def responseSpectrum(tr, nfft, output):
+    '''
+    Complex instrument response of a trace on the rfft frequencies of
+    nfft samples. Spectra are kept in an LRUCache and cached on disk per
+    channel response, nfft and sampling rate
+
+    :param output: 'DISP', 'VEL' or 'ACC'
+    '''
+    response = tr.stats.response
+    key = hashlib.md5(('%s_%s_%d_%g_%s' % (tr.id, responseHash(response),
+                                           nfft, tr.stats.sampling_rate,
+                                           output))
+                      .encode('utf-8')).hexdigest()
+    with _spectraLock:
+        spectrum = _spectra.get(key)
+    if spectrum is not None:
+        return spectrum
+    filename = os.path.join(cacheDir('responses'), 'resp_%s.npy' % key)
+    if os.path.exists(filename):
+        spectrum = np.load(filename)
+    else:
+        spectrum, _ = response.get_evalresp_response(
+            t_samp=tr.stats.delta, nfft=nfft, output=output)
+        np.save(filename, spectrum)
+    with _spectraLock:
+        _spectra.put(key, spectrum)
+    return spectrum
+
+
+def invertSpectrum(spectra, water_level):
+    '''
+    Inverse of the response spectra with the water level in dB below
+    the maximum of each spectrum applied, vectorized over rows
+    '''
+    amplitudes = np.abs(spectra)
+    level = amplitudes.max(axis=-1, keepdims=True) * 10.**(-water_level / 20.)
+    scale = np.where((amplitudes > 0.) & (amplitudes < level),
+                     level / np.where(amplitudes > 0., amplitudes, 1.), 1.)
+    spectra = spectra * scale
+    inverse = np.zeros_like(spectra)
+    nonzero = spectra != 0.
+    inverse[nonzero] = 1. / spectra[nonzero]
+    return inverse
+
+
+def removeResponses(traces, output, water_level=60., taper=.05,
+                    max_samples=2**24):
+    '''
+    Instrument correction of a batch of traces, runs in the WorkerPool.
+    Traces with the same number of samples and sampling rate are stacked
+    and deconvolved at once, traces without a response are returned
+    uncorrected
+
+    :param max_samples: Size of a stack in FFT samples, larger groups are
+                        deconvolved in several stacks, type int
+
+    ::return::
+    list of corrected obspy.core.trace copies
+    '''
+    from obspy.signal.invsim import cosine_taper
+
+    corrected = [tr.copy() for tr in traces]
+    groups = {}
+    for i, tr in enumerate(corrected):
+        if getattr(tr.stats, 'response', None) is None:
+            continue
+        groups.setdefault((tr.stats.npts, tr.stats.sampling_rate),
+                          []).append(i)
+
+    stacks = []
+    for (npts, sampling_rate), indices in groups.items():
+        nfft = nextPow2(2 * npts)
+        rows = max(max_samples // nfft, 1)
+        stacks += [(npts, nfft, indices[i:i + rows])
+                   for i in range(0, len(indices), rows)]
+
+    for npts, nfft, indices in stacks:
+        data = np.array([corrected[i].data for i in indices], dtype=float)
+        data -= data.mean(axis=1)[:, np.newaxis]
+        data *= cosine_taper(npts, taper)
+        spectra = np.array([responseSpectrum(corrected[i], nfft, output)
+                            for i in indices])
+        data = np.fft.irfft(np.fft.rfft(data, nfft, axis=1) *
+                            invertSpectrum(spectra, water_level),
+                            nfft, axis=1)[:, :npts]
+        for row, i in enumerate(indices):
+            corrected[i].data = data[row]
+    return corrected
+
+
+class ResponseCorrector(object):
+    '''
+    Optional instrument correction stage in front of the bandpass filter
+
+    Corrected traces are requested per channel, collected through the
+    UpdateScheduler and deconvolved in one WorkerPool job. They are kept
+    in an LRUCache per channel and output, so changing the filter does
+    not deconvolve again. If the correction fails the requests get their
+    errback and nothing is cached.
+    '''
+    outputs = ('DISP', 'VEL', 'ACC')
+
+    def __init__(self, parent, maxbytes=256*1024**2, water_level=60.):
+        '''
+        :param parent: wavePicker main window
+        :param maxbytes: Cache size in bytes, type int (default: 256 MB)
+        :param water_level: Water level in dB, type float (default: 60)
+        '''
+        self.parent = parent
+        self.water_level = water_level
+        self.output = None
+        self.cache = LRUCache(maxbytes=maxbytes)
+        self._queue = {}
+        self._callbacks = {}
+
+    def setOutput(self, output):
+        '''
+        :param output: 'DISP', 'VEL', 'ACC' or None to disable correction
+        '''
+        if output not in self.outputs:
+            output = None
+        self.output = output
+
+    def cacheKey(self, tr):
+        return (tr.id, tr.stats.starttime.timestamp, self.output)
+
+    def request(self, traces, callback, errback=None):
+        '''
+        Corrected copies of a list of traces, callback is called with the
+        list once all of them are ready
+
+        :param errback: called with the traceback instead of callback if
+                        the correction of any of the traces failed
+        '''
+        results = [None] * len(traces)
+        missing = []
+        for i, tr in enumerate(traces):
+            cached = self.cache.get(self.cacheKey(tr))
+            if cached is None:
+                missing.append(i)
+            results[i] = cached
+        if not missing:
+            callback(results)
+            return
+
+        remaining = [len(missing)]
+
+        def _ready(i, tr):
+            results[i] = tr
+            remaining[0] -= 1
+            if not remaining[0]:
+                callback(results)
+
+        def _failed(error):
+            # report once, the request is complete only without failures
+            if remaining[0] > 0:
+                remaining[0] = -1
+                if errback is not None:
+                    errback(error)
+
+        for i in missing:
+            key = self.cacheKey(traces[i])
+            pending = key in self._callbacks
+            self._callbacks.setdefault(key, []).append(
+                (lambda tr, i=i: _ready(i, tr), _failed))
+            if not pending:
+                self._queue[key] = traces[i]
+        self.parent.scheduler.schedule(('response', self), self._submit)
+
+    def _submit(self):
+        outputs = {}
+        for key in list(self._queue.keys()):
+            outputs.setdefault(key[-1], []).append(key)
+        for output, keys in outputs.items():
+            traces = [self._queue.pop(key) for key in keys]
+            self.parent.workers.submit(
+                removeResponses, (traces, output, self.water_level),
+                callback=lambda results, keys=keys: self._ready(keys, results),
+                errback=lambda error, keys=keys: self._failed(keys, error))
+
+    def _ready(self, keys, results):
+        for key, tr in zip(keys, results):
+            self.cache.put(key, tr)
+            for callback, _ in self._callbacks.pop(key, []):
+                callback(tr)
+
+    def _failed(self, keys, error):
+        '''
+        The correction raised, the waiting requests get their errback and
+        nothing is cached, so the next request tries again
+        '''
+        for key in keys:
+            for _, errback in self._callbacks.pop(key, []):
+                errback(error)
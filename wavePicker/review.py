@@ -0,0 +1,304 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+from cache import LRUCache
+from guiContainer import processTrace, filterKey
+from response import removeResponses
+
+
+def eventTime(event):
+    '''
+    Origin time of a located event, else its earliest pick
+
+    ::return::
+    obspy.core.UTCDateTime or None
+    '''
+    event.loadPicks()
+    if event.location is not None and 'origin_time' in event.location:
+        return event.location['origin_time']
+    if event.picks:
+        return min(pick.time for pick in event.picks)
+    return None
+
+
+def loadWindow(archive, starttime, endtime, headers, filterArgs, output,
+               water_level):
+    '''
+    Reads, corrects and filters an event window, runs in the WorkerPool
+
+    :param archive: WaveformArchive
+    :param headers: dict of trace id and the coordinates and response of
+                    the channel, traces of unknown channels are dropped
+
+    ::return::
+    (raw traces, corrected traces, list of (processed trace, peak))
+    '''
+    traces = []
+    for tr in archive.getWaveforms(starttime, endtime):
+        if tr.id not in headers or not tr.stats.npts:
+            continue
+        tr.stats.update(headers[tr.id])
+        traces.append(tr)
+    corrected = (removeResponses(traces, output, water_level)
+                 if output is not None else traces)
+    return (tuple(traces), tuple(corrected),
+            tuple(processTrace(tr, filterArgs) for tr in corrected))
+
+
+class EventReview(QObject):
+    '''
+    Steps through the Events() catalog showing each event's waveform
+    window cut from the archive
+
+    Stations() are not rebuilt, the traces of the existing channels are
+    swapped in place. The windows of the next events are read, corrected
+    and filtered in the WorkerPool ahead of time and kept in an LRUCache,
+    so stepping to a preloaded event only replots.
+    '''
+    def __init__(self, parent, before=30., after=120., npreload=3,
+                 maxbytes=512*1024**2):
+        '''
+        :param parent: wavePicker main window
+        :param before: Window start before the event time in s
+        :param after: Window end after the event time in s
+        :param npreload: Number of following events to preload, type int
+        :param maxbytes: Cache size in bytes, type int (default: 512 MB)
+        '''
+        super(EventReview, self).__init__(parent)
+        self.parent = parent
+        self.before = before
+        self.after = after
+        self.npreload = npreload
+        self.cache = LRUCache(maxbytes=maxbytes)
+        self.event = None
+        self._callbacks = {}
+        self._initDock()
+
+    def _initDock(self):
+        self.dock = QDockWidget('Event Review', self.parent)
+        self.dock.setObjectName('eventReviewDock')
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.eventLabel = QLabel('No event')
+        layout.addWidget(self.eventLabel)
+
+        form = QFormLayout()
+        self.beforeSpin = QDoubleSpinBox()
+        self.beforeSpin.setSuffix(' s')
+        self.beforeSpin.setRange(0., 3600.)
+        self.beforeSpin.setValue(self.before)
+        self.beforeSpin.valueChanged.connect(self._windowChanged)
+        form.addRow('Before', self.beforeSpin)
+        self.afterSpin = QDoubleSpinBox()
+        self.afterSpin.setSuffix(' s')
+        self.afterSpin.setRange(1., 3600.)
+        self.afterSpin.setValue(self.after)
+        self.afterSpin.valueChanged.connect(self._windowChanged)
+        form.addRow('After', self.afterSpin)
+        self.preloadSpin = QSpinBox()
+        self.preloadSpin.setRange(0, 20)
+        self.preloadSpin.setValue(self.npreload)
+        self.preloadSpin.valueChanged.connect(self._preloadChanged)
+        form.addRow('Preload', self.preloadSpin)
+        layout.addLayout(form)
+
+        buttons = QHBoxLayout()
+        self.previousButton = QPushButton('Previous')
+        self.previousButton.clicked.connect(lambda: self.step(-1))
+        buttons.addWidget(self.previousButton)
+        self.nextButton = QPushButton('Next')
+        self.nextButton.clicked.connect(lambda: self.step(1))
+        buttons.addWidget(self.nextButton)
+        layout.addLayout(buttons)
+
+        self.archiveButton = QPushButton('Open Archive...')
+        self.archiveButton.clicked.connect(self._openArchive)
+        self.archiveButton.setVisible(self.parent.archive is None)
+        layout.addWidget(self.archiveButton)
+        layout.addStretch()
+
+        self.dock.setWidget(widget)
+        self.parent.addDockWidget(Qt.RightDockWidgetArea, self.dock)
+        self.dock.hide()
+
+    def _windowChanged(self):
+        self.before = self.beforeSpin.value()
+        self.after = self.afterSpin.value()
+
+    def _preloadChanged(self, npreload):
+        self.npreload = npreload
+        self.preload()
+
+    def _openArchive(self):
+        '''
+        Open directory dialog and index a miniSEED archive
+        '''
+        from archive import WaveformArchive
+        root = QFileDialog.getExistingDirectory(self.parent,
+                                                'Open miniSEED Archive')
+        if root == u'':
+            return
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            self.parent.archive = WaveformArchive(root)
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.archiveButton.setVisible(False)
+
+    def window(self, event):
+        '''
+        :return: (starttime, endtime) of the event window or None
+        '''
+        time = eventTime(event)
+        if time is None:
+            return None
+        return time - self.before, time + self.after
+
+    def cacheKey(self, event, window):
+        main = self.parent
+        return (event.id, window[0].timestamp, window[1].timestamp,
+                main.responses.output, filterKey(main.filterArgs))
+
+    def load(self, event, callback=None):
+        '''
+        Reads and processes the event window in the WorkerPool, callback
+        is called with (key, window, result) once it is ready
+
+        :return: False if the event has no time or there is no archive
+        '''
+        main = self.parent
+        window = self.window(event)
+        if window is None or main.archive is None:
+            return False
+        key = self.cacheKey(event, window)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if callback is not None:
+                callback((key, window, cached))
+            return True
+        pending = key in self._callbacks
+        self._callbacks.setdefault(key, [])
+        if callback is not None:
+            self._callbacks[key].append(callback)
+        if pending:
+            return True
+
+        headers = {}
+        for station in main.stations:
+            for channel in station.channels:
+                headers[channel.tr.id] = dict(
+                    (attrib, channel.tr.stats[attrib])
+                    for attrib in ('coordinates', 'response')
+                    if attrib in channel.tr.stats)
+        main.workers.submit(
+            loadWindow, (main.archive, window[0], window[1], headers,
+                         main.filterArgs, main.responses.output,
+                         main.responses.water_level),
+            callback=lambda result: self._ready(key, window, result),
+            errback=lambda error: self._failed(event, key, error))
+        return True
+
+    def _ready(self, key, window, result):
+        self.cache.put(key, result)
+        for callback in self._callbacks.pop(key, []):
+            callback((key, window, result))
+
+    def _failed(self, event, key, error):
+        '''
+        Reading or processing the window raised, the key is released so
+        showing the event again retries
+        '''
+        self._callbacks.pop(key, None)
+        if event is self.event:
+            self.eventLabel.setText('Event %d - failed: %s' % (
+                event.id, error.strip().splitlines()[-1]))
+
+    def preload(self):
+        '''
+        Loads the windows of the next npreload events after the current
+        '''
+        events = self.parent.events.events
+        start = events.index(self.event) + 1 if self.event in events else 0
+        for event in events[start:start + self.npreload]:
+            self.load(event)
+
+    def step(self, direction):
+        '''
+        Shows the next or previous event of the catalog
+        '''
+        events = self.parent.events.events
+        if not events:
+            return
+        if self.event in events:
+            index = events.index(self.event) + direction
+        else:
+            index = 0 if direction > 0 else len(events) - 1
+        if 0 <= index < len(events):
+            self.show(events[index])
+
+    def show(self, event):
+        '''
+        Makes event the active event and shows its window, immediately if
+        it was preloaded
+        '''
+        self.event = event
+        self.parent.events.setActiveEvent(event)
+        if not self.dock.isVisible():
+            self.dock.show()
+        self.eventLabel.setText('Event %d - loading' % event.id)
+        if not self.load(event, lambda result: self._apply(event, result)):
+            self.eventLabel.setText('Event %d - no %s' % (
+                event.id, 'archive' if self.parent.archive is None
+                else 'picks or origin time'))
+        self.preload()
+
+    def _apply(self, event, result):
+        '''
+        Swaps the window into the Station() channels, the processed traces
+        and corrected traces are handed to the prefetcher and instrument
+        correction caches
+        '''
+        if event is not self.event:
+            return
+        key, window, (traces, corrected, processed) = result
+        main = self.parent
+        stations = main.stations
+
+        streams = {}
+        for tr in traces:
+            streams.setdefault((tr.stats.network, tr.stats.station),
+                               []).append(tr)
+        visible = stations.visibleStations()
+        stations.setStationsVisible(visible, False)
+        for station in stations:
+            station.setStream(streams.get((station.stats.network,
+                                           station.stats.station), []),
+                              window[0])
+
+        processing_key = key[-2:]
+        channels = dict((channel.tr.id, channel) for station in stations
+                        for channel in station.channels)
+        for tr, corrected_tr, result in zip(traces, corrected, processed):
+            channel = channels.get(tr.id)
+            if channel is None or channel.tr is not tr:
+                continue
+            if processing_key[0] is not None:
+                main.responses.cache.put(
+                    (tr.id, tr.stats.starttime.timestamp, processing_key[0]),
+                    corrected_tr)
+            main.prefetcher.cache.put(
+                main.prefetcher.cacheKey(channel, processing_key), result)
+
+        picked = sorted(event.picks, key=lambda pick: pick.time)
+        order = []
+        for pick in picked:
+            id = '%s.%s' % (pick.network, pick.station)
+            if id not in order:
+                order.append(id)
+        if not order:
+            order = ['%s.%s' % (network, station)
+                     for network, station in sorted(streams)][:main.nplots]
+        stations.restoreOrder(order, order)
+        self.eventLabel.setText('Event %d - %s' % (event.id, window[0] +
+                                                    self.before))
@@ -0,0 +1,181 @@
+import numpy as np
+
+from guiContainer import processTrace
+from travelTimes import backAzimuth
+from cache import LRUCache
+
+
+def rotateNE(north, east, baz):
+    '''
+    Rotates north and east components to radial and transverse
+
+    :param north, east: arrays of shape (nstations, npts) or (npts,)
+    :param baz: back azimuths in degrees, one per row
+
+    ::return::
+    radial and transverse components as numpy.ndarray
+    '''
+    ba = np.radians(np.asarray(baz, dtype=float))[..., np.newaxis]
+    sin, cos = np.sin(ba), np.cos(ba)
+    return -east * sin - north * cos, -east * cos + north * sin
+
+
+def rotateBatch(jobs):
+    '''
+    Filters and rotates a batch of stations, runs in the WorkerPool.
+    Stations with the same number of samples are stacked and rotated
+    at once
+
+    :param jobs: list of (north trace, east trace, back azimuth, filterArgs)
+
+    ::return::
+    list of ((radial trace, peak), (transverse trace, peak))
+    '''
+    processed = []
+    for north, east, baz, filterArgs in jobs:
+        start = max(north.stats.starttime, east.stats.starttime)
+        end = min(north.stats.endtime, east.stats.endtime)
+        north, _ = processTrace(north.slice(start, end), filterArgs)
+        east, _ = processTrace(east.slice(start, end), filterArgs)
+        processed.append((north, east, baz))
+
+    groups = {}
+    for i, (north, east, baz) in enumerate(processed):
+        npts = min(north.stats.npts, east.stats.npts)
+        groups.setdefault(npts, []).append(i)
+
+    results = [None] * len(jobs)
+    for npts, indices in groups.items():
+        radial, transverse = rotateNE(
+            np.array([processed[i][0].data[:npts] for i in indices]),
+            np.array([processed[i][1].data[:npts] for i in indices]),
+            [processed[i][2] for i in indices])
+        peaks = (np.abs(radial).max(axis=1), np.abs(transverse).max(axis=1))
+        for row, i in enumerate(indices):
+            north, east, _ = processed[i]
+            components = []
+            for tr, data, peak, code in ((north, radial, peaks[0], 'R'),
+                                         (east, transverse, peaks[1], 'T')):
+                tr.data = data[row]
+                tr.stats.channel = tr.stats.channel[:-1] + code
+                components.append((tr, peak[row]))
+            results[i] = tuple(components)
+    return results
+
+
+class Rotator(object):
+    '''
+    Radial and transverse components of all visible stations
+
+    Requests are collected through the UpdateScheduler and rotated in one
+    WorkerPool job. Results are cached per station, back azimuth and
+    filter, so toggling between ZNE and ZRT or returning to an earlier
+    hypocenter does not recompute anything.
+    '''
+    def __init__(self, parent, maxbytes=256*1024**2):
+        '''
+        :param parent: wavePicker main window
+        :param maxbytes: Cache size in bytes, type int (default: 256 MB)
+        '''
+        self.parent = parent
+        self.cache = LRUCache(maxbytes=maxbytes)
+        self._queue = {}
+        self._callbacks = {}
+
+    def source(self):
+        '''
+        Epicenter the components are rotated to, the location of the
+        active event or else the trial hypocenter
+
+        ::return::
+        :lat, lon: as Tuple
+        '''
+        event = self.parent.events.active_event
+        if event is not None and event.location is not None:
+            return event.location['latitude'], event.location['longitude']
+        hypocenter = self.parent.trialHypocenter
+        return hypocenter.latitude, hypocenter.longitude
+
+    def backAzimuth(self, station):
+        '''
+        Back azimuth of the station in full degrees
+        '''
+        lat, lon = self.source()
+        return int(round(float(backAzimuth(station.getCoordinates()[0],
+                                           station.getCoordinates()[1],
+                                           lat, lon)))) % 360
+
+    @staticmethod
+    def cacheKey(station, baz, processing_key):
+        return (station.stats.network, station.stats.station,
+                station.stats.location, station.stats.starttime.timestamp,
+                baz, processing_key)
+
+    def request(self, station, filterArgs, baz, callback, errback=None):
+        '''
+        Rotated components of a Station(), callback is called with the
+        ((radial, peak), (transverse, peak)) tuple once they are ready
+
+        :param errback: called without arguments if the rotation failed
+        '''
+        sources = [channel.source for channel in station.rotated]
+        key = self.cacheKey(station, baz, sources[0].processingKey())
+        cached = self.cache.get(key)
+        if cached is not None:
+            callback(cached)
+            return
+        pending = key in self._callbacks
+        self._callbacks.setdefault(key, []).append((callback, errback))
+        if pending:
+            return
+
+        def _queue(traces):
+            self._queue[key] = (traces[0], traces[1], baz, filterArgs)
+            self.parent.scheduler.schedule(('rotate', self), self._submit)
+        responses = self.parent.responses
+        if responses.output is None:
+            _queue([channel.tr for channel in sources])
+        else:
+            responses.request([channel.tr for channel in sources], _queue,
+                              errback=lambda error: self._failed([key]))
+
+    def _submit(self):
+        keys = list(self._queue.keys())
+        jobs = [self._queue.pop(key) for key in keys]
+        if not jobs:
+            return
+        self.parent.workers.submit(
+            rotateBatch, (jobs,),
+            callback=lambda results: self._ready(keys, results),
+            errback=lambda error: self._failed(keys))
+
+    def _ready(self, keys, results):
+        for key, result in zip(keys, results):
+            self.cache.put(key, result)
+            for callback, _ in self._callbacks.pop(key, []):
+                callback(result)
+
+    def _failed(self, keys):
+        '''
+        The rotation raised, the keys are released so the next request
+        submits them again
+        '''
+        for key in keys:
+            for _, errback in self._callbacks.pop(key, []):
+                if errback is not None:
+                    errback()
+
+    def update(self):
+        '''
+        Schedules the rotation of all visible stations after the back
+        azimuth source changed
+        '''
+        self.parent.scheduler.schedule(('rotation', self), self._update)
+
+    def _update(self):
+        if not self.parent.rotatedComponents:
+            return
+        for station in self.parent.stations.visibleStations():
+            for channel in station.rotated:
+                if channel.traceItem is not None:
+                    channel.plotTraceItem()
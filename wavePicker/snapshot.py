@@ -0,0 +1,182 @@
+import numpy as np
+
+import os
+import json
+import hashlib
+
+SNAPSHOT_VERSION = 2
+
+
+def _stringWidth(values):
+    return max([len(value) for value in values] + [1])
+
+
+def eventTable(events):
+    '''
+    Events() as structured array, one row per event. Locations and
+    magnitudes which are not set are NaN
+    '''
+    table = np.zeros(len(events), dtype=[
+        ('id', 'i8'), ('latitude', 'f8'), ('longitude', 'f8'),
+        ('depth', 'f8'), ('origin_time', 'f8'), ('rms', 'f8'),
+        ('npicks', 'i8'), ('magnitude', 'f8')])
+    for row, event in zip(table, events):
+        location = event.location or {}
+        row['id'] = event.id
+        for key in ('latitude', 'longitude', 'depth', 'rms'):
+            row[key] = location.get(key, np.nan)
+        row['origin_time'] = (location['origin_time'].timestamp
+                              if 'origin_time' in location else np.nan)
+        row['npicks'] = location.get('npicks', 0)
+        row['magnitude'] = (event.magnitude if event.magnitude is not None
+                            else np.nan)
+    return table
+
+
+def pickTable(events):
+    '''
+    Picks of all Events() as structured array, one row per pick
+    '''
+    picks = [pick for event in events for pick in event.picks]
+    table = np.zeros(len(picks), dtype=[
+        ('event_id', 'i8'),
+        ('station_id', 'U%d' % _stringWidth([p.station_id for p in picks])),
+        ('phase', 'U%d' % _stringWidth([p.phase.name for p in picks])),
+        ('time', 'f8'),
+        ('amplitude', 'U%d' % _stringWidth([p.amplitude for p in picks])),
+        ('station_lat', 'f8'),
+        ('station_lon', 'f8'), ('wa_amplitude', 'f8')])
+    for row, pick in zip(table, picks):
+        row['event_id'] = pick.event.id
+        row['station_id'] = pick.station_id
+        row['phase'] = pick.phase.name
+        row['time'] = pick.time.timestamp
+        row['amplitude'] = pick.amplitude
+        row['station_lat'] = pick.station_lat
+        row['station_lon'] = pick.station_lon
+        row['wa_amplitude'] = (pick.wa_amplitude
+                               if pick.wa_amplitude is not None else np.nan)
+    return table
+
+
+def _tuples(value):
+    '''
+    Turns the lists of a JSON decoded key back into tuples
+    '''
+    if isinstance(value, list):
+        return tuple(_tuples(v) for v in value)
+    return value
+
+
+class Snapshot(object):
+    '''
+    Session snapshot directory
+
+        meta.json      view and filter state, station order and visibility
+        events.npy     events as structured array
+        picks.npy      picks as structured array
+        traces/*.npy   processed display arrays as float32
+
+    Writing is incremental, tables are only rewritten if their content
+    changed and display arrays are written once. Everything is loaded
+    memory mapped.
+    '''
+    def __init__(self, path):
+        '''
+        :param path: Snapshot directory, created if necessary
+        '''
+        self.path = path
+        self.trace_path = os.path.join(path, 'traces')
+        if not os.path.isdir(self.trace_path):
+            os.makedirs(self.trace_path)
+        self.meta = {}
+        filename = os.path.join(path, 'meta.json')
+        if os.path.exists(filename):
+            with open(filename, 'r') as meta_file:
+                self.meta = json.load(meta_file)
+            if self.meta.get('version', 0) > SNAPSHOT_VERSION:
+                raise ValueError('Snapshot %s was written by a newer '
+                                 'wavePicker' % path)
+
+    def _replace(self, filename, write):
+        '''
+        Writes to a temporary file first, so an interrupted write never
+        leaves a broken snapshot
+        '''
+        tmp = filename + '.tmp'
+        write(tmp)
+        os.rename(tmp, filename)
+
+    def writeTable(self, name, table):
+        '''
+        Writes a structured array unless it is unchanged
+        '''
+        signature = hashlib.md5(table.tobytes() +
+                                str(table.dtype).encode('utf-8')).hexdigest()
+        signatures = self.meta.setdefault('signatures', {})
+        filename = os.path.join(self.path, '%s.npy' % name)
+        if signatures.get(name) == signature and os.path.exists(filename):
+            return False
+
+        def _write(tmp):
+            with open(tmp, 'wb') as npy_file:
+                np.save(npy_file, table)
+        self._replace(filename, _write)
+        signatures[name] = signature
+        return True
+
+    def table(self, name):
+        '''
+        :return: memory mapped structured array or None
+        '''
+        filename = os.path.join(self.path, '%s.npy' % name)
+        if not os.path.exists(filename):
+            return None
+        return np.load(filename, mmap_mode='r')
+
+    @staticmethod
+    def traceFile(key):
+        return 'trace_%s.npy' % hashlib.md5(repr(key).encode('utf-8'))\
+            .hexdigest()
+
+    def writeTrace(self, key, data):
+        '''
+        Writes a display array once, returns its file name
+        '''
+        name = self.traceFile(key)
+        filename = os.path.join(self.trace_path, name)
+        if not os.path.exists(filename):
+            def _write(tmp):
+                with open(tmp, 'wb') as npy_file:
+                    np.save(npy_file, np.asarray(data, dtype=np.float32))
+            self._replace(filename, _write)
+        return name
+
+    def traces(self):
+        '''
+        Yields the processing key, peak and memory mapped data of all
+        display arrays listed in meta.json
+        '''
+        for entry in self.meta.get('traces', []):
+            filename = os.path.join(self.trace_path, entry['file'])
+            if os.path.exists(filename):
+                yield (_tuples(entry['key']), entry['peak'],
+                       np.load(filename, mmap_mode='r'))
+
+    def writeMeta(self, meta):
+        '''
+        Writes meta.json, the table signatures are kept. Display arrays
+        no longer listed are removed
+        '''
+        meta = dict(meta, version=SNAPSHOT_VERSION,
+                    signatures=self.meta.get('signatures', {}))
+
+        def _write(tmp):
+            with open(tmp, 'w') as meta_file:
+                json.dump(meta, meta_file, indent=0)
+        self._replace(os.path.join(self.path, 'meta.json'), _write)
+        self.meta = meta
+        listed = set(entry['file'] for entry in meta.get('traces', []))
+        for name in os.listdir(self.trace_path):
+            if name not in listed:
+                os.remove(os.path.join(self.trace_path, name))
@@ -0,0 +1,201 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+import numpy as np
+import pyqtgraph as pg
+from numpy.lib.stride_tricks import as_strided
+
+
+def computeTile(data, nfft, overlap, tile, tile_frames):
+    '''
+    Computes one STFT tile of tile_frames frames, runs in a worker
+
+    :param data: trace samples, type numpy.ndarray
+    :param nfft: FFT length in samples, type int
+    :param overlap: Overlap of neighbouring frames in samples, type int
+    :param tile: Tile number, type int
+
+    ::return::
+    power in dB as float32 array (frames, nfft/2+1) and its display levels
+    '''
+    hop = nfft - overlap
+    start = tile * tile_frames * hop
+    segment = np.array(data[start:start + (tile_frames - 1) * hop + nfft],
+                       dtype=np.float64)
+    if segment.size < nfft:
+        return None
+    nframes = 1 + (segment.size - nfft) // hop
+    frames = as_strided(segment, shape=(nframes, nfft),
+                        strides=(segment.strides[0] * hop, segment.strides[0]))
+    frames = frames - frames.mean(axis=1)[:, np.newaxis]
+    power = np.abs(np.fft.rfft(frames * np.hanning(nfft), axis=1))**2
+    power = (10. * np.log10(power + 1e-20)).astype(np.float32)
+    levels = (np.percentile(power, 5), np.percentile(power, 99.5))
+    return power, levels
+
+
+class SpectrogramView(object):
+    '''
+    Tiled spectrogram drawn behind a Station() plot
+
+    The STFT resolution follows the zoom level, tiles are computed in the
+    WorkerPool and kept in a shared LRUCache keyed by
+    (channel, nfft, overlap, tile). Panning only computes missing tiles.
+    '''
+    tile_frames = 256
+    min_nfft = 64
+    max_nfft = 8192
+
+    def __init__(self, station):
+        '''
+        :param station: Station() with an initialised plotItem
+        '''
+        self.station = station
+        self.main = station.parent.parent
+        self.channel = None
+        self.images = {}
+        self.levels = None
+        self.current_level = None
+        self._pending = set()
+
+        self.plotItem = station.plotItem
+        self.viewBox = pg.ViewBox(enableMouse=False)
+        self.viewBox.setZValue(-100)
+        self.plotItem.scene().addItem(self.viewBox)
+        self.viewBox.setXLink(self.plotItem)
+        self.plotItem.getViewBox().sigResized.connect(self._updateGeometry)
+        self._updateGeometry()
+
+        self._updateTimer = QTimer()
+        self._updateTimer.setSingleShot(True)
+        self._updateTimer.setInterval(50)
+        self._updateTimer.timeout.connect(self.updateView)
+        self.plotItem.getViewBox().sigXRangeChanged.connect(
+            self._updateTimer.start)
+
+        self.lut = pg.ColorMap([0., .5, 1.],
+                               [(0, 0, 40), (200, 60, 40), (255, 255, 120)]
+                               ).getLookupTable(nPts=256)
+
+    def _updateGeometry(self):
+        self.viewBox.setGeometry(
+            self.plotItem.getViewBox().sceneBoundingRect())
+        self.viewBox.linkedViewChanged(self.plotItem.getViewBox(),
+                                       self.viewBox.XAxis)
+
+    def setChannel(self, channel):
+        '''
+        Shows the spectrogram of Channel()
+        '''
+        if channel is self.channel:
+            return
+        self.channel = channel
+        self.levels = None
+        self._clearImages()
+        self.viewBox.setYRange(0, .5 / channel.tr.stats.delta, padding=0)
+        self.updateView()
+
+    def _channelKey(self):
+        tr = self.channel.tr
+        return (tr.id, tr.stats.starttime.timestamp)
+
+    def _key(self, nfft, tile):
+        return self._channelKey() + (nfft, nfft // 2, tile)
+
+    def _resolution(self, nsamples):
+        '''
+        nfft so the visible range holds about one frame per pixel
+        '''
+        width = max(self.plotItem.getViewBox().width(), 100)
+        hop = max(nsamples / width, 1)
+        nfft = 2**int(np.ceil(np.log2(2 * hop)))
+        return int(np.clip(nfft, self.min_nfft, self.max_nfft))
+
+    def updateView(self):
+        '''
+        Displays the tiles covering the visible range at the current zoom
+        '''
+        if self.channel is None:
+            return
+        xmin, xmax = self.plotItem.getViewBox().viewRange()[0]
+        npts = self.channel.tr.stats.npts
+        xmin, xmax = max(int(xmin), 0), min(int(xmax), npts)
+        if xmax <= xmin:
+            return
+        nfft = self._resolution(xmax - xmin)
+        if nfft != self.current_level:
+            self._clearImages()
+            self.current_level = nfft
+        hop = nfft // 2
+        tile_samples = self.tile_frames * hop
+        wanted = set(self._key(nfft, tile) for tile in
+                     range(xmin // tile_samples, xmax // tile_samples + 1))
+
+        for key in list(self.images.keys()):
+            if key not in wanted:
+                self.viewBox.removeItem(self.images.pop(key))
+                self.main.memory.stationChanged(self.station)
+
+        cache = self.main.spectrogramCache
+        for key in wanted:
+            if key in self.images:
+                continue
+            result = cache.get(key)
+            if result is not None:
+                self._showTile(key, result)
+            elif key not in self._pending:
+                self._pending.add(key)
+                self.main.workers.submit(
+                    computeTile,
+                    (self.channel.tr.data, nfft, nfft - hop, key[-1],
+                     self.tile_frames),
+                    callback=lambda result, key=key: self._tileReady(key,
+                                                                     result),
+                    errback=lambda error, key=key: self._pending.discard(key))
+
+    def _tileReady(self, key, result):
+        self._pending.discard(key)
+        if result is None:
+            return
+        self.main.spectrogramCache.put(key, result)
+        if self.channel is not None and key[:2] == self._channelKey()\
+           and key[2] == self.current_level:
+            self._showTile(key, result)
+
+    def _showTile(self, key, result):
+        power, levels = result
+        nfft, tile = key[2], key[-1]
+        hop = nfft // 2
+        nyquist = .5 / self.channel.tr.stats.delta
+
+        image = pg.ImageItem(power, lut=self.lut)
+        image.setTransform(QTransform.fromScale(hop,
+                                                nyquist / power.shape[1]))
+        image.setPos(tile * self.tile_frames * hop + nfft / 2. - hop / 2., 0)
+        self.viewBox.addItem(image)
+        self.images[key] = image
+        self.main.memory.stationChanged(self.station)
+
+        if self.levels is None:
+            self.levels = levels
+        else:
+            self.levels = (min(self.levels[0], levels[0]),
+                           max(self.levels[1], levels[1]))
+        for image in self.images.values():
+            image.setLevels(self.levels)
+
+    def _clearImages(self):
+        for image in self.images.values():
+            self.viewBox.removeItem(image)
+        self.images = {}
+        self.main.memory.stationChanged(self.station)
+
+    def remove(self):
+        '''
+        Removes the spectrogram from the plot scene
+        '''
+        self._updateTimer.stop()
+        self._clearImages()
+        self.channel = None
+        if self.viewBox.scene() is not None:
+            self.viewBox.scene().removeItem(self.viewBox)
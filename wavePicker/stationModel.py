@@ -0,0 +1,234 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+from obspy.core import AttribDict
+
+from guiContainer import Station
+
+import os
+from bisect import bisect_left
+
+
+class StationSearchIndex(object):
+    '''
+    Prefix index over the station and channel codes and the string
+    attributes of Station.stats
+
+    The tokens are kept in a sorted list, a prefix query is a bisect plus a
+    scan over the matching tokens.
+    '''
+    ignore_attribs = ['mseed', 'SAC', '_format', 'processing']
+
+    def __init__(self, stations):
+        '''
+        :param stations: list of Station()
+        '''
+        token_stations = {}
+        for i, station in enumerate(stations):
+            for token in self._stationTokens(station):
+                token_stations.setdefault(token, set()).add(i)
+        self.tokens = sorted(token_stations.keys())
+        self.token_stations = [token_stations[token] for token in self.tokens]
+        self.nstations = len(stations)
+
+    def _stationTokens(self, station):
+        stats = station.stats
+        tokens = set([stats.network, stats.station, stats.location,
+                      '%s.%s' % (stats.network, stats.station)])
+        for channel in station.channels:
+            tokens.add(channel.channel)
+            tokens.add(channel.tr.id)
+        for key, value in stats.items():
+            if key in self.ignore_attribs:
+                continue
+            if isinstance(value, AttribDict):
+                tokens.update(str(v) for v in value.values()
+                              if isinstance(v, basestring))
+            elif isinstance(value, basestring):
+                tokens.add(value)
+        return set(token.lower() for token in tokens if token)
+
+    def prefixMatch(self, prefix):
+        '''
+        :return: set of station indices with a token starting with prefix
+        '''
+        matches = set()
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            matches.update(self.token_stations[i])
+            i += 1
+        return matches
+
+    def query(self, text, candidates=None):
+        '''
+        All whitespace separated terms of text have to match a prefix
+
+        :param candidates: optional set of station indices to narrow down,
+                           used for incremental filtering
+        :return: set of station indices
+        '''
+        matches = (set(range(self.nstations)) if candidates is None
+                   else set(candidates))
+        for term in text.lower().split():
+            if not matches:
+                break
+            matches &= self.prefixMatch(term)
+        return matches
+
+
+class StationTreeModel(QAbstractItemModel):
+    '''
+    Item model presenting Stations() as filterable tree Station > Channel
+    '''
+    def __init__(self, stations):
+        '''
+        :param stations: Stations() container backing the model
+        '''
+        super(StationTreeModel, self).__init__()
+        self._icons = None
+        self._small_font = None
+        self.stations = stations
+        self.filter_text = ''
+        self.rebuildIndex()
+
+    @property
+    def icons(self):
+        '''
+        Visibility icons, created on first paint so the model also works
+        without a QApplication in batch mode
+        '''
+        if self._icons is None:
+            basedir = os.path.dirname(__file__)
+            self._icons = {
+                True: QIcon(os.path.join(basedir, 'icons/eye-24.png')),
+                False: QIcon(os.path.join(basedir, 'icons/eye-hidden-24.png'))
+            }
+        return self._icons
+
+    @property
+    def small_font(self):
+        if self._small_font is None:
+            self._small_font = QFont('', 7)
+        return self._small_font
+
+    def rebuildIndex(self):
+        '''
+        Rebuilds the search index, called when stations are added or sorted
+        '''
+        self.beginResetModel()
+        self.index_stations = list(self.stations.stations)
+        self.search_index = StationSearchIndex(self.index_stations)
+        self._matches = None
+        self._applyFilter(self.filter_text)
+        self.endResetModel()
+
+    def setFilter(self, text):
+        '''
+        Filters the stations, extending the previous query only searches
+        through the previous matches
+        '''
+        text = text.strip()
+        if text == self.filter_text:
+            return
+        self.beginResetModel()
+        self._applyFilter(text)
+        self.endResetModel()
+
+    def _applyFilter(self, text):
+        candidates = None
+        if self._matches is not None and self.filter_text and\
+           text.startswith(self.filter_text):
+            candidates = self._matches
+        if text:
+            self._matches = self.search_index.query(text, candidates)
+            self.rows = [station for i, station in
+                         enumerate(self.index_stations) if i in self._matches]
+        else:
+            self._matches = None
+            self.rows = list(self.index_stations)
+        self.filter_text = text
+        self._row_of = dict((station, row) for row, station
+                            in enumerate(self.rows))
+
+    def filteredStations(self):
+        '''
+        :return: list of Station() matching the current filter
+        '''
+        return list(self.rows)
+
+    def itemFromIndex(self, index):
+        if not index.isValid():
+            return None
+        return index.internalPointer()
+
+    def stationIndex(self, station, column=0):
+        row = self._row_of.get(station)
+        if row is None:
+            return QModelIndex()
+        return self.createIndex(row, column, station)
+
+    def stationChanged(self, station):
+        '''
+        Emits dataChanged for the row of station
+        '''
+        row = self._row_of.get(station)
+        if row is None:
+            return
+        self.dataChanged.emit(self.createIndex(row, 0, station),
+                              self.createIndex(row, 2, station))
+
+    '''
+    QAbstractItemModel interface
+    '''
+    def index(self, row, column, parent=QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        item = self.itemFromIndex(parent)
+        if item is None:
+            return self.createIndex(row, column, self.rows[row])
+        return self.createIndex(row, column, item.channels[row])
+
+    def parent(self, index):
+        item = self.itemFromIndex(index)
+        if item is None or isinstance(item, Station):
+            return QModelIndex()
+        return self.stationIndex(item.station)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        item = self.itemFromIndex(parent)
+        if item is None:
+            return len(self.rows)
+        if isinstance(item, Station):
+            return len(item.channels)
+        return 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 3
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def data(self, index, role=Qt.DisplayRole):
+        item = self.itemFromIndex(index)
+        if item is None:
+            return None
+        column = index.column()
+        if isinstance(item, Station):
+            if role == Qt.DisplayRole and column == 1:
+                return '%s.%s' % (item.stats.network, item.stats.station)
+            if role == Qt.DecorationRole and column == 0:
+                return self.icons[item.visible]
+            return None
+        if role == Qt.DisplayRole:
+            if column == 1:
+                return '%s @ %d Hz' % (item.tr.stats.channel,
+                                       1./item.tr.stats.delta)
+            if column == 2:
+                return '%s\n%s' % (item.tr.stats.starttime,
+                                   item.tr.stats.endtime)
+        if role == Qt.FontRole and column > 0:
+            return self.small_font
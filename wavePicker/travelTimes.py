@@ -0,0 +1,176 @@
+import numpy as np
+
+from cache import cacheDir
+
+import os
+import hashlib
+
+EARTH_RADIUS = 6371.
+
+
+def epicentralDistance(lat1, lon1, lat2, lon2):
+    '''
+    Great circle distance in km, all arguments broadcast as NumPy arrays
+    '''
+    lat1, lon1, lat2, lon2 = [np.radians(a) for a in (lat1, lon1, lat2, lon2)]
+    a = np.sin((lat2 - lat1) / 2.)**2 +\
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.)**2
+    return 2. * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0., 1.)))
+
+
+def backAzimuth(lat_station, lon_station, lat_event, lon_event):
+    '''
+    Back azimuth in degrees from station to event, arguments broadcast
+    '''
+    lat1, lon1, lat2, lon2 = [np.radians(a) for a in
+                              (lat_station, lon_station, lat_event, lon_event)]
+    y = np.sin(lon2 - lon1) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) -\
+        np.sin(lat1) * np.cos(lat2) * np.cos(lon2 - lon1)
+    return np.degrees(np.arctan2(y, x)) % 360.
+
+
+class VelocityModel(object):
+    '''
+    Layered 1-D velocity model
+
+    :param layers: list of (depth of layer top in km, vp, vs) in km/s,
+                   the last layer is a half space
+    '''
+    default_layers = [(0., 5.8, 3.36), (20., 6.5, 3.75), (35., 8.04, 4.47)]
+    version = 2  # bump when firstArrivals changes, invalidates cached tables
+
+    def __init__(self, layers=None):
+        layers = sorted(layers or self.default_layers)
+        self.tops = np.array([layer[0] for layer in layers], dtype=float)
+        self.vp = np.array([layer[1] for layer in layers], dtype=float)
+        self.vs = np.array([layer[2] if len(layer) > 2 and layer[2]
+                            else layer[1] / 1.73 for layer in layers],
+                           dtype=float)
+
+    def velocities(self, phase):
+        return self.vp if phase == 'P' else self.vs
+
+    def hash(self):
+        return hashlib.md5(np.concatenate([[self.version], self.tops,
+                                           self.vp, self.vs])
+                           .tobytes()).hexdigest()
+
+    def firstArrivals(self, phase, distances, depth):
+        '''
+        First arrival times of the direct and all head waves for a source
+        at depth, vectorized over distances in km
+
+        :return: travel times in s, type numpy.ndarray
+        '''
+        v = self.velocities(phase)
+        bottoms = np.append(self.tops[1:], np.inf)
+        # thickness of each layer above the source
+        h_up = np.clip(np.minimum(bottoms, depth) - self.tops, 0., None)
+        src = np.searchsorted(self.tops, depth, side='right') - 1
+
+        if depth <= 0. or not h_up.any():
+            times = distances / v[0]
+        else:
+            up = h_up > 0
+            hs, vs = h_up[up], v[up]
+            p = np.sin(np.linspace(0., np.pi / 2., 2000))[:-1] / vs.max()
+            eta = np.sqrt(1. / vs[:, np.newaxis]**2 - p**2)
+            x = (hs[:, np.newaxis] * p / eta).sum(axis=0)
+            t = (hs[:, np.newaxis] / (vs[:, np.newaxis]**2 * eta)).sum(axis=0)
+            times = np.interp(distances, x, t, right=np.inf)
+
+        # head waves along the top of every faster layer below the source,
+        # down from the source to the refractor and up through all layers
+        thickness = bottoms - self.tops
+        h_down = np.zeros_like(h_up)
+        for j in range(src + 1, len(v)):
+            h_down[j - 1] = bottoms[j - 1] - max(self.tops[j - 1], depth)
+            if v[j] <= v[:j].max():
+                continue
+            h = thickness[:j] + h_down[:j]
+            q = np.sqrt(1. / v[:j]**2 - 1. / v[j]**2)
+            crossover = (h / (v[j] * q)).sum()
+            head = distances / v[j] + (h * q).sum()
+            times = np.where(distances >= crossover,
+                             np.minimum(times, head), times)
+        return times
+
+
+class TravelTimeTable(object):
+    '''
+    Precomputed P and S first arrival times over epicentral distance and
+    source depth, cached on disk per velocity model and grid. The tables
+    are built or loaded on the first travelTimes() call, the grid axes
+    are available right away
+    '''
+    def __init__(self, model=None, max_distance=300., distance_step=1.,
+                 max_depth=50., depth_step=1.):
+        self.model = model or VelocityModel()
+        self.distances = np.arange(0., max_distance + distance_step,
+                                   distance_step)
+        self.depths = np.arange(0., max_depth + depth_step, depth_step)
+        self._tables = None
+
+    @property
+    def tables(self):
+        '''
+        dict of phase and travel times over (depth, distance)
+        '''
+        if self._tables is None:
+            self._tables = self._load()
+        return self._tables
+
+    def _cacheFile(self):
+        grid = '%s_%g_%g_%g_%g' % (self.model.hash(), self.distances[-1],
+                                   self.distances[1] - self.distances[0],
+                                   self.depths[-1],
+                                   self.depths[1] - self.depths[0])
+        return os.path.join(cacheDir('traveltimes'), 'tt_%s.npz'
+                            % hashlib.md5(grid.encode('utf-8')).hexdigest())
+
+    def _load(self):
+        filename = self._cacheFile()
+        if os.path.exists(filename):
+            cached = np.load(filename)
+            return {'P': cached['P'], 'S': cached['S']}
+        tables = {}
+        for phase in ('P', 'S'):
+            tables[phase] = np.array([
+                self.model.firstArrivals(phase, self.distances, depth)
+                for depth in self.depths])
+        np.savez(filename, **tables)
+        return tables
+
+    def travelTimes(self, phase, distances, depths):
+        '''
+        Bilinear interpolation of the table, distances and depths in km
+        broadcast against each other
+
+        :return: travel times in s, type numpy.ndarray, NaN outside of
+                 the table
+        '''
+        table = self.tables[phase]
+        fd = self._fractionalIndex(distances, self.distances)
+        fz = self._fractionalIndex(depths, self.depths)
+        fd, fz = np.broadcast_arrays(fd, fz)
+        outside = np.isnan(fd) | np.isnan(fz)
+        fd, fz = np.where(outside, 0., fd), np.where(outside, 0., fz)
+        i, j = fd.astype(int), fz.astype(int)
+        wd, wz = fd - i, fz - j
+        times = (table[j, i] * (1. - wd) * (1. - wz) +
+                 table[j, i + 1] * wd * (1. - wz) +
+                 table[j + 1, i] * (1. - wd) * wz +
+                 table[j + 1, i + 1] * wd * wz)
+        return np.where(outside, np.nan, times)
+
+    @staticmethod
+    def _fractionalIndex(values, axis):
+        '''
+        Fractional index of values on the regular axis, NaN outside
+        '''
+        step = axis[1] - axis[0]
+        index = (np.asarray(values, dtype=float) - axis[0]) / step
+        last = len(axis) - 1.
+        return np.where((index >= 0.) & (index <= last),
+                        np.minimum(index, last - .000001), np.nan)
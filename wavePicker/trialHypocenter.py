@@ -0,0 +1,222 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+import numpy as np
+import pyqtgraph as pg
+
+from travelTimes import TravelTimeTable, epicentralDistance
+
+
+class TrialHypocenter(QObject):
+    '''
+    Predicted P and S arrivals of a trial hypocenter on all visible stations
+
+    The epicenter is dragged on a station map, depth is set in a spin box
+    and the origin time is shifted by dragging a predicted P marker.
+    Travel times come from a TravelTimeTable and are evaluated for all
+    visible stations at once.
+    '''
+    sigChanged = Signal()
+
+    def __init__(self, parent):
+        '''
+        :param parent: wavePicker main window
+        '''
+        super(TrialHypocenter, self).__init__(parent)
+        self.parent = parent
+        self.enabled = False
+        self._table = None
+        self.markers = {}
+
+        stations = parent.stations.stations
+        coordinates = np.array([station.getCoordinates()
+                                for station in stations])
+        self.latitude, self.longitude = coordinates.mean(axis=0)
+        self.depth = 10.
+        self.origin_time = min(station.stats.starttime for station in stations)
+
+        self._initDock(coordinates)
+
+    @property
+    def table(self):
+        '''
+        TravelTimeTable, its travel times are built or loaded from the
+        disk cache on the first prediction
+        '''
+        if self._table is None:
+            self._table = TravelTimeTable()
+        return self._table
+
+    def _initDock(self, coordinates):
+        self.dock = QDockWidget('Trial Hypocenter', self.parent)
+        self.dock.setObjectName('trialHypocenterDock')
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+
+        self.mapPlot = pg.PlotWidget()
+        self.mapPlot.setAspectLocked(True)
+        self.mapPlot.setLabel('left', 'Latitude')
+        self.mapPlot.setLabel('bottom', 'Longitude')
+        self.mapPlot.plot(coordinates[:, 1], coordinates[:, 0], pen=None,
+                          symbol='t', symbolSize=8, symbolBrush='w')
+        size = max(np.ptp(coordinates, axis=0).max() / 30., 1e-3)
+        self.epicenterRoi = pg.ROI([self.longitude - size / 2.,
+                                    self.latitude - size / 2.],
+                                   [size, size], pen=pg.mkPen('r', width=2))
+        self.epicenterRoi.sigRegionChanged.connect(self._epicenterDragged)
+        self.mapPlot.addItem(self.epicenterRoi)
+        layout.addWidget(self.mapPlot)
+
+        form = QFormLayout()
+        self.depthSpin = QDoubleSpinBox()
+        self.depthSpin.setSuffix(' km')
+        self.depthSpin.setRange(0., self.table.depths[-1])
+        self.depthSpin.setValue(self.depth)
+        self.depthSpin.valueChanged.connect(self._depthChanged)
+        form.addRow('Depth', self.depthSpin)
+        self.originLabel = QLabel()
+        form.addRow('Origin', self.originLabel)
+        layout.addLayout(form)
+
+        self.fitButton = QPushButton('Fit origin time to P picks')
+        self.fitButton.clicked.connect(self.fitOriginTime)
+        layout.addWidget(self.fitButton)
+
+        self.dock.setWidget(widget)
+        self.dock.visibilityChanged.connect(self.setEnabled)
+        self.parent.addDockWidget(Qt.RightDockWidgetArea, self.dock)
+        self.dock.hide()
+        self._updateLabel()
+
+    def setEnabled(self, enabled=True):
+        self.enabled = enabled
+        self.updateOverlay()
+
+    def setHypocenter(self, latitude=None, longitude=None, depth=None,
+                      origin_time=None):
+        '''
+        Sets the trial hypocenter and updates the predicted arrivals
+        '''
+        if latitude is not None:
+            self.latitude = latitude
+        if longitude is not None:
+            self.longitude = longitude
+        if depth is not None:
+            self.depth = depth
+        if origin_time is not None:
+            self.origin_time = origin_time
+        self._updateLabel()
+        self.updateOverlay()
+        self.sigChanged.emit()
+
+    def _epicenterDragged(self):
+        pos, size = self.epicenterRoi.pos(), self.epicenterRoi.size()
+        self.setHypocenter(latitude=pos.y() + size.y() / 2.,
+                           longitude=pos.x() + size.x() / 2.)
+
+    def _depthChanged(self, depth):
+        self.setHypocenter(depth=depth)
+
+    def _updateLabel(self):
+        self.originLabel.setText('%s\n%.4f N, %.4f E' %
+                                 (self.origin_time, self.latitude,
+                                  self.longitude))
+
+    def predictedArrivals(self, stations):
+        '''
+        Predicted P and S arrival times for a list of Station()
+
+        ::return::
+        P and S arrival offsets to the origin time in s as numpy.ndarray,
+        NaN for stations outside of the travel-time table
+        '''
+        coordinates = np.array([station.getCoordinates()
+                                for station in stations]).reshape(-1, 2)
+        distances = epicentralDistance(coordinates[:, 0], coordinates[:, 1],
+                                       self.latitude, self.longitude)
+        return (self.table.travelTimes('P', distances, self.depth),
+                self.table.travelTimes('S', distances, self.depth))
+
+    def fitOriginTime(self):
+        '''
+        Sets the origin time to the mean P residual of the active event
+        '''
+        event = self.parent.events.active_event
+        if event is None:
+            return
+        picks = [pick for pick in event.picks if pick.phase.name == 'P']
+        stations = dict(((station.stats.network, station.stats.station),
+                         station) for station in self.parent.stations)
+        picks = [pick for pick in picks
+                 if (pick.network, pick.station) in stations]
+        if not picks:
+            return
+        tp, _ = self.predictedArrivals([stations[(pick.network, pick.station)]
+                                        for pick in picks])
+        offsets = np.array([pick.time - self.origin_time for pick in picks])
+        residuals = (offsets - tp)[np.isfinite(tp)]
+        if not len(residuals):
+            return
+        self.setHypocenter(origin_time=self.origin_time +
+                           float(np.mean(residuals)))
+
+    def updateOverlay(self):
+        '''
+        Draws or moves the predicted arrival markers of all visible stations
+        '''
+        if not self.enabled:
+            self._removeMarkers(list(self.markers.keys()))
+            return
+        stations = [station for station in self.parent.stations.visibleStations()
+                    if station.plotItem is not None]
+        self._removeMarkers([station for station in self.markers
+                             if station not in stations])
+        if not stations:
+            return
+        tp, ts = self.predictedArrivals(stations)
+        for station, p, s in zip(stations, tp, ts):
+            channel = station.getSelectedChannel() or station.channels[0]
+            offset = (self.origin_time - channel.tr.stats.starttime)
+            markers = self.markers.get(station)
+            if markers is None or markers[2] is not station.plotItem:
+                markers = self._addMarkers(station)
+            # stations beyond the travel-time table get no marker
+            for marker, time in zip(markers[:2], (p, s)):
+                marker.setVisible(bool(np.isfinite(time)))
+                if np.isfinite(time):
+                    marker.setValue((offset + time) / channel.tr.stats.delta)
+
+    def _addMarkers(self, station):
+        '''
+        :return: tuple (P marker, S marker, plotItem they are drawn in)
+        '''
+        if station in self.markers:
+            self._removeMarkers([station])
+        markers = (pg.InfiniteLine(movable=True,
+                                   pen=pg.mkPen('r', style=Qt.DashLine)),
+                   pg.InfiniteLine(pen=pg.mkPen('g', style=Qt.DashLine)),
+                   station.plotItem)
+        for marker in markers[:2]:
+            station.plotItem.addItem(marker)
+        markers[0].sigDragged.connect(
+            lambda line: self._originDragged(station, line))
+        self.markers[station] = markers
+        return markers
+
+    def _originDragged(self, station, line):
+        '''
+        Dragging a predicted P marker shifts the origin time
+        '''
+        channel = station.getSelectedChannel() or station.channels[0]
+        tp, _ = self.predictedArrivals([station])
+        if not np.isfinite(tp[0]):
+            return
+        arrival = channel.tr.stats.starttime +\
+            line.value() * channel.tr.stats.delta
+        self.setHypocenter(origin_time=arrival - float(tp[0]))
+
+    def _removeMarkers(self, stations):
+        for station in stations:
+            for marker in self.markers.pop(station)[:2]:
+                if marker.getViewBox() is not None:
+                    marker.getViewBox().removeItem(marker)
@@ -0,0 +1,153 @@
+from PySide.QtCore import *
+
+from contextlib import contextmanager
+
+
+def pickFields(pick):
+    '''
+    Constant size record of a Pick(), enough to recreate and find it. The
+    amplitude is kept as stored by the pick, picks loaded from the project
+    store may have none
+    '''
+    return (pick.station_id, pick.phase.name, pick.time, pick.amplitude,
+            pick.station_lat, pick.station_lon)
+
+
+def pickEvt(fields):
+    '''
+    pickevt dictionary for Event.addPickToEvent from pickFields()
+    '''
+    from guiContainer import getPhase
+    station_id, phase, time, amplitude, lat, lon = fields
+    return {'station_id': station_id, 'phase': getPhase(phase), 'time': time,
+            'amplitude': amplitude, 'station_lat': lat, 'station_lon': lon}
+
+
+class UndoStack(QObject):
+    '''
+    Undo and redo of picking operations as a command log
+
+    Operations are recorded as small (command, event id, data) tuples
+    instead of copies of Events(), a pick costs one pickFields() record.
+    Commands recorded inside group() are undone and redone as one step,
+    so a bulk insertion of thousands of picks is reverted at once.
+    Undoing replays the inverse operations through Events() and Event(),
+    the project store, locator and views are updated as for edits made
+    in the GUI.
+    '''
+    sigChanged = Signal()
+
+    def __init__(self, parent, limit=1000):
+        '''
+        :param parent: wavePicker main window
+        :param limit: Number of undo steps kept, 0 disables recording
+        '''
+        super(UndoStack, self).__init__()
+        self.parent = parent
+        self.limit = limit
+        self._undo = []
+        self._redo = []
+        self._group = None
+        self._depth = 0
+        self._replaying = False
+
+    def record(self, command, event_id, data=None):
+        '''
+        Records an operation, ignored while undoing or redoing
+
+        :param command: 'addPick', 'deletePick', 'addEvent' or 'deleteEvent'
+        :param data: pickFields() of the pick, or a tuple of those for the
+                     picks of a deleted event
+        '''
+        if self._replaying or not self.limit:
+            return
+        if self._group is not None:
+            self._group.append((command, event_id, data))
+            return
+        self._push([(command, event_id, data)])
+
+    def _push(self, step):
+        self._undo.append(step)
+        del self._undo[:-self.limit]
+        self._redo = []
+        self.sigChanged.emit()
+
+    @contextmanager
+    def group(self):
+        '''
+        Records all operations of the with block as one undo step, groups
+        may be nested
+        '''
+        if self._depth == 0:
+            self._group = []
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                step, self._group = self._group, None
+                if step:
+                    self._push(step)
+
+    def canUndo(self):
+        return bool(self._undo)
+
+    def canRedo(self):
+        return bool(self._redo)
+
+    def clear(self):
+        self._undo = []
+        self._redo = []
+        self.sigChanged.emit()
+
+    def undo(self):
+        if not self._undo:
+            return
+        step = self._undo.pop()
+        self._replay([(self._inverse[command], event_id, data)
+                      for command, event_id, data in reversed(step)])
+        self._redo.append(step)
+        self.sigChanged.emit()
+
+    def redo(self):
+        if not self._redo:
+            return
+        step = self._redo.pop()
+        self._replay(step)
+        self._undo.append(step)
+        self.sigChanged.emit()
+
+    _inverse = {'addPick': 'deletePick', 'deletePick': 'addPick',
+                'addEvent': 'deleteEvent', 'deleteEvent': 'addEvent'}
+
+    def _replay(self, commands):
+        events = self.parent.events
+        self._replaying = True
+        try:
+            for command, event_id, data in commands:
+                event = events.getEvent(event_id)
+                if command == 'addEvent':
+                    events.addEvent(event_id)
+                    event = events.getEvent(event_id)
+                    for fields in data or ():
+                        event.addPickToEvent(pickEvt(fields))
+                elif command == 'deleteEvent' and event is not None:
+                    events.deleteEvent(event)
+                elif command == 'addPick' and event is not None:
+                    event.addPickToEvent(pickEvt(data))
+                elif command == 'deletePick' and event is not None:
+                    pick = self._findPick(event, data)
+                    if pick is not None:
+                        event.deletePick(pick)
+        finally:
+            self._replaying = False
+
+    @staticmethod
+    def _findPick(event, fields):
+        event.loadPicks()
+        station_id, phase, time = fields[:3]
+        for pick in event.picks:
+            if pick.station_id == station_id and pick.phase.name == phase\
+               and pick.time == time:
+                return pick
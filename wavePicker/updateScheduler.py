@@ -0,0 +1,45 @@
+from PySide.QtCore import *
+
+from collections import OrderedDict
+
+
+class UpdateScheduler(QObject):
+    '''
+    Coalesces UI refreshes
+
+    Objects mark themselves dirty with a key and a flush callback, every
+    key is flushed once when control returns to the Qt event loop. Bulk
+    operations like deleting an event or importing picks therefore
+    trigger a single repaint.
+    '''
+    def __init__(self, parent=None):
+        super(UpdateScheduler, self).__init__(parent)
+        self._dirty = OrderedDict()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
+
+    def schedule(self, key, callback):
+        '''
+        Marks key dirty, callback is called on the next flush
+
+        :param key: hashable, e.g. ('event', Event())
+        :param callback: callable without arguments
+        '''
+        self._dirty[key] = callback
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def isDirty(self, key):
+        return key in self._dirty
+
+    def flush(self):
+        '''
+        Runs all pending callbacks, callbacks may schedule new updates
+        which are run in the next iteration
+        '''
+        self._timer.stop()
+        dirty, self._dirty = self._dirty, OrderedDict()
+        for callback in dirty.values():
+            callback()
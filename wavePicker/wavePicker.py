@@ -4,6 +4,25 @@ from PySide.QtCore import *
 
 from guiContainer import *
 import mainWindow
+from updateScheduler import UpdateScheduler
+from workers import WorkerPool
+from cache import LRUCache
+from prefetch import Prefetcher
+from trialHypocenter import TrialHypocenter
+from locator import GridLocator
+from rotation import Rotator
+from response import ResponseCorrector
+from magnitude import MagnitudeEngine
+from review import EventReview
+from memory import MemoryManager
+from undo import UndoStack
+from rangeController import RangeController
+from renderer import InteractionRenderer
+from comparison import ComparisonOverlay, formatReport
+from recordSection import RecordSection
+from associator import associate, addEvents, readCandidates,\
+    stationCoordinates
+from snapshot import Snapshot, eventTable, pickTable
 
 pickButtonMap = {
     'P': pickP(),
@@ -16,7 +35,9 @@ pickButtonMap = {
 
 class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
     def __init__(self, stream=None, nplots=5,
-                 project_name='Untitled', parent=None):
+                 project_name='Untitled', snapshot=None, archive=None,
+                 starttime=None, endtime=None, memory_budget=1024**3,
+                 parent=None):
         '''
         A Seismic Wave Time Arrival Picker for ObsPy Stream Objects
 
@@ -25,6 +46,13 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         :param stream: Stream object, type obspy.core.Stream
         :param nplots: Number of plots to initialise, type int (default: 5)
         :param project_name: Project name, type string (default: 'Untitled')
+        :param snapshot: Session snapshot directory to restore, type string
+        :param archive: miniSEED archive directory or WaveformArchive, the
+                        stream is read from starttime to endtime if no
+                        stream is given, event windows in review mode
+                        are cut from it
+        :param memory_budget: Budget of the processed, cached and graphics
+                              arrays in bytes, type int (default: 1 GB)
         '''
         # Initialising Qt
         QLocale.setDefault(QLocale.c())
@@ -34,6 +62,13 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         super(wavePicker, self).__init__(parent)
         self.setupUi(self)
 
+        if archive is not None:
+            from archive import WaveformArchive
+            if not isinstance(archive, WaveformArchive):
+                archive = WaveformArchive(archive)
+            if stream is None:
+                stream = archive.getWaveforms(starttime, endtime)
+        self.archive = archive
         if stream is None or not isinstance(stream, Stream):
             raise AttributeError('Define stream as obspy.core.Stream object')
         self.stream = stream
@@ -43,6 +78,8 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         '''
         self.nplots = nplots               # init gui with 5 traces
         self.visibleChannel = 'Z'     # init with channel z
+        self.stackedComponents = False  # three component view
+        self.rotatedComponents = False  # ZRT instead of ZNE
         self.activePicker = pickP()   # init with P picker
         self.project_name = project_name
 
@@ -51,10 +88,29 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         '''
         Init internal objects
         '''
+        self.scheduler = UpdateScheduler(self)  # coalesced UI updates
+        self.workers = WorkerPool(parent=self)  # background processing
+        self.responses = ResponseCorrector(self)  # instrument correction
+        self.spectrogramEnabled = False
+        self.spectrogramCache = LRUCache(maxbytes=256*1024**2)
+        self.prefetcher = Prefetcher(self)
+        self.rangeController = RangeController(self)  # shared time axis
+        self.renderer = InteractionRenderer(self)  # level of detail
+        self.memory = MemoryManager(self, memory_budget)  # per station usage
+        self.rotator = Rotator(self)
+        self.undo = UndoStack(self)  # undo/redo of picking operations
         self.events = Events(self)  # init event class
         self.filterArgs = None      # start with blank filter
         # init stations from self.stream
         self.stations = Stations(self.stream, self)
+        self.trialHypocenter = TrialHypocenter(self)
+        self.locator = GridLocator(self)
+        self.magnitudes = MagnitudeEngine(self)
+        self.review = EventReview(self)  # catalog review from self.archive
+        self.comparison = ComparisonOverlay(self)  # picks of another catalog
+        self.recordSection = RecordSection(self)  # all stations in one plot
+        self.trialHypocenter.sigChanged.connect(self.rotator.update)
+        self.snapshot = None
 
         '''
         Set GUI parameters and setup connections
@@ -64,6 +120,8 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         self._initEventTree()
 
         self._connectFileMenu()
+        self._initEditMenu()
+        self._initViewMenu()
 
         self._initStationTree()
 
@@ -74,6 +132,8 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         for i, sta in enumerate(self.stations):
             if i < self.nplots:
                 sta.setVisible(True)
+        if snapshot is not None:
+            self._restoreSnapshot(snapshot)
         # Executing Qt
         self.show()
         app.exec_()
@@ -82,22 +142,56 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         '''
         Save backup of active picks
         '''
+        self.workers.close()
+        if self.snapshot is not None:
+            self._writeSnapshot()
+        if self.events.store is not None:
+            self.events._setStore(None)
+            return
         self.events.exportJSON('.~wavePicker.bak.json')
 
     def _initStationTree(self):
         '''
-        Setup stationtree :QTreeWidgetItem:
+        Setup stationtree :QTreeView: on the StationTreeModel
         '''
-        self.stationTree.setColumnCount(3)
+        self.stationTree.setModel(self.stations.model)
+        self.stationTree.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.stationTree.setColumnWidth(0, 40)
         self.stationTree.setColumnWidth(1, 90)
         self.stationTree.setColumnWidth(2, 150)
         self.stationTree.setExpandsOnDoubleClick(False)
-        self.stationTree.itemDoubleClicked.connect(self._changeStationVisibility)
+        self.stationTree.doubleClicked.connect(self._changeStationVisibility)
 
         self.stationTree.setContextMenuPolicy(Qt.CustomContextMenu)
         self.stationTree.customContextMenuRequested.connect(self.stations.showSortQMenu)
 
+        # Search line and bulk visibility of the matches
+        self.stationFilter = QLineEdit()
+        self.stationFilter.setPlaceholderText('Search stations')
+        self.stationFilter.setStatusTip('Filter by network, station, location,'
+                                        ' channel codes or stats attributes')
+        self.stationFilter.textChanged.connect(self.stations.model.setFilter)
+        self.showMatchesBtn = QPushButton('Show')
+        self.showMatchesBtn.setStatusTip('Show all matching stations')
+        self.showMatchesBtn.clicked.connect(
+            lambda: self._setFilteredStationsVisible(True))
+        self.hideMatchesBtn = QPushButton('Hide')
+        self.hideMatchesBtn.setStatusTip('Hide all matching stations')
+        self.hideMatchesBtn.clicked.connect(
+            lambda: self._setFilteredStationsVisible(False))
+        filterLayout = QHBoxLayout()
+        filterLayout.addWidget(self.stationFilter)
+        filterLayout.addWidget(self.showMatchesBtn)
+        filterLayout.addWidget(self.hideMatchesBtn)
+        self.verticalLayout.insertLayout(0, filterLayout)
+
+    def _setFilteredStationsVisible(self, visible):
+        '''
+        Show or hide all stations matching the station filter
+        '''
+        self.stations.setStationsVisible(
+            self.stations.model.filteredStations(), visible)
+
     def _connectStationButtons(self):
         '''
         Setup Station Buttons - Select visible channel
@@ -106,12 +200,47 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         self.compEbtn.clicked.connect(self._changeSelectedChannel)
         self.compNbtn.clicked.connect(self._changeSelectedChannel)
 
-    def _changeStationVisibility(self, item):
+        self.compStackbtn = QPushButton('3C', self.layoutWidget1)
+        self.compStackbtn.setCheckable(True)
+        self.compStackbtn.setToolTip('Shortcut three component view: 4')
+        self.compStackbtn.setStatusTip('Shortcut three component view: 4')
+        self.compStackbtn.setShortcut('4')
+        self.gridLayout_3.addWidget(self.compStackbtn, 0, 3, 1, 1)
+        self.compStackbtn.toggled.connect(self._changeStackedComponents)
+
+        self.compRotatebtn = QPushButton('ZRT', self.layoutWidget1)
+        self.compRotatebtn.setCheckable(True)
+        self.compRotatebtn.setToolTip('Shortcut rotated components: 5')
+        self.compRotatebtn.setStatusTip('Shortcut rotated components: 5')
+        self.compRotatebtn.setShortcut('5')
+        self.gridLayout_3.addWidget(self.compRotatebtn, 0, 4, 1, 1)
+        self.compRotatebtn.toggled.connect(self._changeRotatedComponents)
+
+    def _changeStackedComponents(self, stacked):
+        '''
+        Toggle the stacked three component view
+        '''
+        self.stackedComponents = stacked
+        self._changeSelectedChannel()
+
+    def _changeRotatedComponents(self, rotated):
+        '''
+        Toggle between ZNE and radial/transverse components, the N and E
+        buttons select R and T
+        '''
+        self.rotatedComponents = rotated
+        self.compNbtn.setText('R' if rotated else 'N')
+        self.compEbtn.setText('T' if rotated else 'E')
+        self._changeSelectedChannel()
+
+    def _changeStationVisibility(self, index):
         '''
         Change selected stations visibility
         '''
-        for station in self.stations:
-            if station.QStationItem.isSelected():
+        model = self.stations.model
+        for index in self.stationTree.selectionModel().selectedRows():
+            station = model.itemFromIndex(index)
+            if isinstance(station, Station):
                 station.setVisible(not station.visible)
 
     def _changeSelectedChannel(self):
@@ -124,24 +253,34 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         for station in self.stations:
             if station.visible:
                 station.plotSelectedChannel()
+        self.trialHypocenter.updateOverlay()
+        self.recordSection.update()
 
     '''
     Event Tree Frunctions
     '''
     def _initEventTree(self):
         '''
-        Init the event tree :QTreeWidgetItem:
+        Init the event tree :QTreeView: on the EventTreeModel
         '''
-        self.eventTree.setColumnCount(2)
+        self.eventTree.setModel(self.events.model)
+        self.eventTree.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.eventTree.setUniformRowHeights(False)
         self.eventTree.setColumnWidth(0, 100)
-        self.eventTree.itemDoubleClicked.connect(self._highlightPick)
-        #self.eventTree.itemClicked.connect()
+        self.eventTree.doubleClicked.connect(self._highlightPick)
+
+    def _selectedEventItems(self):
+        '''
+        :return: list of selected Event(), EventStation() and Pick()
+        '''
+        model = self.events.model
+        return [model.itemFromIndex(index) for index in
+                self.eventTree.selectionModel().selectedRows()]
 
-    def _highlightPick(self):
-        picks = self.events.getAllPicks()
-        for pick in picks:
-            if pick.QPickItem.isSelected():
-                pick.highlightPickLineItem()
+    def _highlightPick(self, index):
+        item = self.events.model.itemFromIndex(index)
+        if isinstance(item, Pick):
+            item.highlightPickLineItem()
 
     def _connectFileMenu(self):
         '''
@@ -153,6 +292,296 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         self.actionExport_stat.triggered.connect(self._stationsExportSta)
         self.actionExport_phs.triggered.connect(self._eventsExportPhs)
 
+        self.actionNew_project = QAction('Save Project', self)
+        self.actionNew_project.setStatusTip('Save picks to a SQLite project '
+                                            'file, new picks are written '
+                                            'immediately')
+        self.actionOpen_project = QAction('Open Project', self)
+        self.actionOpen_project.setStatusTip('Open a SQLite project file')
+        self.menuFile.insertActions(self.actionAs_JSON,
+                                    [self.actionNew_project,
+                                     self.actionOpen_project])
+        self.menuFile.insertSeparator(self.actionAs_JSON)
+        self.actionNew_project.triggered.connect(self._projectSave)
+        self.actionOpen_project.triggered.connect(self._projectOpen)
+
+        self.actionSave_snapshot = QAction('Save Snapshot', self)
+        self.actionSave_snapshot.setStatusTip('Save the session state and '
+                                              'display data, the snapshot '
+                                              'is updated on exit')
+        self.actionOpen_snapshot = QAction('Open Snapshot', self)
+        self.actionOpen_snapshot.setStatusTip('Restore a session snapshot')
+        self.menuFile.insertActions(self.actionAs_JSON,
+                                    [self.actionSave_snapshot,
+                                     self.actionOpen_snapshot])
+        self.menuFile.insertSeparator(self.actionAs_JSON)
+        self.actionSave_snapshot.triggered.connect(self._snapshotSave)
+        self.actionOpen_snapshot.triggered.connect(self._snapshotOpen)
+
+        self.actionCompare_picks = QAction('Compare Picks', self)
+        self.actionCompare_picks.setStatusTip('Match the picks of a JSON '
+                                              'file against the current '
+                                              'events')
+        self.menuFile.insertAction(self.actionExport_CSV,
+                                   self.actionCompare_picks)
+        self.actionCompare_picks.triggered.connect(self._picksCompare)
+
+        self.actionAssociate_picks = QAction('Associate Picks', self)
+        self.actionAssociate_picks.setStatusTip('Group the picks of a JSON '
+                                                'file into new events')
+        self.menuFile.insertAction(self.actionExport_CSV,
+                                   self.actionAssociate_picks)
+        self.actionAssociate_picks.triggered.connect(self._picksAssociate)
+
+    def _projectSave(self):
+        '''
+        Open file dialog and create a SQLite project
+        '''
+        filename = QFileDialog.getSaveFileName(self, 'Save Project',
+                                               self.project_name + '.wpdb',
+                                               filter='wavePicker Project (*.wpdb)')[0]
+        if filename != u'':
+            if filename[-5:].lower() != '.wpdb':
+                filename += '.wpdb'
+            self.events.saveProject(filename)
+
+    def _projectOpen(self):
+        '''
+        Open file dialog and attach a SQLite project
+        '''
+        filename = QFileDialog.getOpenFileName(self, 'Open Project',
+                                               filter='wavePicker Project (*.wpdb)',
+                                               options=QFileDialog.ReadOnly)
+        if filename[0] != u'':
+            self.events.openProject(filename[0])
+            self._changeSelectedChannel()
+
+    def _snapshotSave(self):
+        '''
+        Open file dialog and write a session snapshot
+        '''
+        filename = QFileDialog.getSaveFileName(self, 'Save Snapshot',
+                                               self.project_name + '.wps',
+                                               filter='wavePicker Snapshot (*.wps)')[0]
+        if filename != u'':
+            if filename[-4:].lower() != '.wps':
+                filename += '.wps'
+            self.snapshot = Snapshot(filename)
+            self._writeSnapshot()
+
+    def _snapshotOpen(self):
+        '''
+        Open directory dialog and restore a session snapshot
+        '''
+        filename = QFileDialog.getExistingDirectory(self, 'Open Snapshot')
+        if filename != u'':
+            self._restoreSnapshot(filename)
+
+    def _writeSnapshot(self):
+        '''
+        Writes the session to self.snapshot, unchanged tables and display
+        arrays already in the snapshot are skipped
+        '''
+        self.events.loadAllEvents()
+        self.snapshot.writeTable('events', eventTable(self.events))
+        self.snapshot.writeTable('picks', pickTable(self.events))
+        traces = []
+        for station in self.stations:
+            for channel in station.channels:
+                if channel.plotTrace is None or channel.plotTrace_key is None:
+                    continue
+                key = self.prefetcher.cacheKey(channel, channel.plotTrace_key)
+                traces.append({'key': key, 'peak': float(channel.peak),
+                               'file': self.snapshot.writeTrace(
+                                   key, channel.plotTrace.data)})
+        station_ids = ['%s.%s' % (station.stats.network, station.stats.station)
+                       for station in self.stations]
+        self.snapshot.writeMeta({
+            'project_name': self.project_name,
+            'stations': station_ids,
+            'visible': [id for id, station in zip(station_ids, self.stations)
+                        if station.visible],
+            'filter': {'freqmin': self.fminSpin.value(),
+                       'freqmax': self.fmaxSpin.value(),
+                       'corners': self.cornersSpin.value(),
+                       'zerophase': self.zerophaseCheck.isChecked(),
+                       'enabled': self.filterButton.isChecked()},
+            'response': self.responses.output,
+            'visible_channel': self.visibleChannel,
+            'stacked': self.stackedComponents,
+            'rotated': self.rotatedComponents,
+            'active_event': (self.events.active_event.id
+                             if self.events.active_event else None),
+            'traces': traces
+        })
+
+    def _restoreSnapshot(self, filename):
+        '''
+        Restores a session snapshot, the memory mapped display arrays are
+        handed to the prefetcher so visible stations are not reprocessed
+        '''
+        self.snapshot = Snapshot(filename)
+        meta = self.snapshot.meta
+        headers = dict(((channel.tr.id, channel.tr.stats.starttime.timestamp),
+                        channel.tr.stats)
+                       for station in self.stations
+                       for channel in station.channels)
+        for key, peak, data in self.snapshot.traces():
+            if key[:2] in headers:
+                self.prefetcher.cache.put(
+                    key, (Trace(data=data, header=headers[key[:2]].copy()),
+                          peak))
+
+        self._setProcessingState(meta.get('filter'), meta.get('response'))
+        self.stations.restoreOrder(meta.get('stations', []),
+                                   meta.get('visible', []))
+        self.compStackbtn.setChecked(meta.get('stacked', False))
+        self.compRotatebtn.setChecked(meta.get('rotated', False))
+        for btn in [self.compZbtn, self.compNbtn, self.compEbtn]:
+            if btn.text() == meta.get('visible_channel', 'Z'):
+                btn.setChecked(True)
+        self._changeSelectedChannel()
+
+        events, picks = self.snapshot.table('events'), self.snapshot.table('picks')
+        if events is not None and picks is not None:
+            self.events.restoreSnapshot(events, picks,
+                                        meta.get('active_event'))
+
+    def _setProcessingState(self, filter_state=None, output=None):
+        '''
+        Sets the filter widgets and instrument correction at once, so the
+        traces are reprocessed a single time
+        '''
+        widgets = [self.fminSpin, self.fmaxSpin, self.fminSlider,
+                   self.fmaxSlider, self.cornersSpin, self.zerophaseCheck,
+                   self.filterButton, self.responseCombo]
+        for widget in widgets:
+            widget.blockSignals(True)
+        if filter_state is not None:
+            self.fminSpin.setValue(filter_state['freqmin'])
+            self.fmaxSpin.setValue(filter_state['freqmax'])
+            self.fminSlider.setValue(int(filter_state['freqmin'] * 10))
+            self.fmaxSlider.setValue(int(filter_state['freqmax'] * 10))
+            self.cornersSpin.setValue(filter_state['corners'])
+            self.zerophaseCheck.setChecked(filter_state['zerophase'])
+            self.filterButton.setChecked(filter_state['enabled'])
+        self.responseCombo.setCurrentIndex(
+            max(self.responseCombo.findData(output), 0))
+        self.responses.setOutput(output)
+        for widget in widgets:
+            widget.blockSignals(False)
+        self._updateFilterArgs()
+        self._reprocessTraces()
+
+    def _initEditMenu(self):
+        '''
+        Setup the Edit QMenu
+        '''
+        self.menuEdit = QMenu('Edit', self.menubar)
+        self.menubar.insertMenu(self.menuInfo.menuAction(), self.menuEdit)
+
+        self.actionUndo = self.menuEdit.addAction('Undo')
+        self.actionUndo.setShortcut(QKeySequence.Undo)
+        self.actionUndo.setStatusTip('Undo the last picking operation')
+        self.actionUndo.triggered.connect(self.undo.undo)
+        self.actionRedo = self.menuEdit.addAction('Redo')
+        self.actionRedo.setShortcut(QKeySequence.Redo)
+        self.actionRedo.setStatusTip('Redo the last undone operation')
+        self.actionRedo.triggered.connect(self.undo.redo)
+        self.undo.sigChanged.connect(self._updateUndoActions)
+        self._updateUndoActions()
+
+    def _updateUndoActions(self):
+        self.actionUndo.setEnabled(self.undo.canUndo())
+        self.actionRedo.setEnabled(self.undo.canRedo())
+
+    def _initViewMenu(self):
+        '''
+        Setup the View QMenu
+        '''
+        self.menuView = QMenu('View', self.menubar)
+        self.menubar.insertMenu(self.menuInfo.menuAction(), self.menuView)
+
+        self.actionSpectrogram = self.menuView.addAction('Spectrogram')
+        self.actionSpectrogram.setCheckable(True)
+        self.actionSpectrogram.setStatusTip('Show the spectrogram of the '
+                                            'selected component behind the '
+                                            'traces')
+        self.actionSpectrogram.toggled.connect(self._toggleSpectrogram)
+
+        self.actionTrialHypocenter = self.trialHypocenter.dock.toggleViewAction()
+        self.actionTrialHypocenter.setStatusTip('Show predicted P and S '
+                                                'arrivals of a trial '
+                                                'hypocenter')
+        self.menuView.addAction(self.actionTrialHypocenter)
+
+        self.actionEventReview = self.review.dock.toggleViewAction()
+        self.actionEventReview.setStatusTip('Step through the events with '
+                                            'their waveform windows cut from '
+                                            'the archive')
+        self.menuView.addAction(self.actionEventReview)
+        self.actionRecordSection = self.recordSection.dock.toggleViewAction()
+        self.actionRecordSection.setShortcut('Ctrl+R')
+        self.actionRecordSection.setStatusTip('Show all stations in one plot '
+                                              'offset by distance, click to '
+                                              'pick')
+        self.menuView.addAction(self.actionRecordSection)
+        self.actionComparison = self.menuView.addAction('Pick Comparison')
+        self.actionComparison.setCheckable(True)
+        self.actionComparison.setEnabled(False)
+        self.actionComparison.setStatusTip('Show the compared picks, matched '
+                                           'in green and unmatched in red')
+        self.actionComparison.toggled.connect(self.comparison.setEnabled)
+        self.actionNextEvent = self.menuView.addAction('Next Event')
+        self.actionNextEvent.setShortcut('Ctrl+PgDown')
+        self.actionNextEvent.setStatusTip('Review the next event')
+        self.actionNextEvent.triggered.connect(lambda: self.review.step(1))
+        self.actionPreviousEvent = self.menuView.addAction('Previous Event')
+        self.actionPreviousEvent.setShortcut('Ctrl+PgUp')
+        self.actionPreviousEvent.setStatusTip('Review the previous event')
+        self.actionPreviousEvent.triggered.connect(
+            lambda: self.review.step(-1))
+
+        self.menuView.addSeparator()
+        self.actionNextPage = self.menuView.addAction('Next Stations')
+        self.actionNextPage.setShortcut('PgDown')
+        self.actionNextPage.setStatusTip('Show the next page of stations')
+        self.actionNextPage.triggered.connect(lambda: self._flipStationPage(1))
+        self.actionPreviousPage = self.menuView.addAction('Previous Stations')
+        self.actionPreviousPage.setShortcut('PgUp')
+        self.actionPreviousPage.setStatusTip('Show the previous page of '
+                                             'stations')
+        self.actionPreviousPage.triggered.connect(
+            lambda: self._flipStationPage(-1))
+
+    def _flipStationPage(self, direction):
+        '''
+        Replace the visible stations by the next or previous nplots
+        stations in sort order
+        '''
+        stations = self.stations.stations
+        visible = [i for i, station in enumerate(stations) if station.visible]
+        if not visible:
+            start = 0
+        elif direction > 0:
+            start = visible[-1] + 1
+        else:
+            start = max(visible[0] - self.nplots, 0)
+        page = stations[start:start + self.nplots]
+        if not page:
+            return
+        self.stations.setStationsVisible(
+            [stations[i] for i in visible if stations[i] not in page], False)
+        self.stations.setStationsVisible(page, True)
+
+    def _toggleSpectrogram(self, enabled):
+        '''
+        Show or hide the spectrograms of all visible stations
+        '''
+        self.spectrogramEnabled = enabled
+        for station in self.stations.visibleStations():
+            station.setSpectrogramVisible(enabled)
+
     def _picksSaveJSON(self):
         '''
         Open file dialog and save JSON
@@ -177,6 +606,51 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
             self.events.importJSON(filename[0])
             self._changeSelectedChannel()
 
+    def _picksAssociate(self):
+        '''
+        Open file dialog and associate the picks into new events
+        '''
+        filename = QFileDialog.getOpenFileName(self, 'Associate Picks',
+                                               filter='JSON File (*.json)',
+                                               options=QFileDialog.ReadOnly)
+        if filename[0] == u'':
+            return
+        min_stations = QInputDialog.getInteger(self, 'Associate Picks',
+                                               'Minimum Stations', value=4,
+                                               minValue=1, step=1)
+        if not min_stations[1]:
+            return
+        coordinates = stationCoordinates(self.stations)
+        groups = associate(readCandidates(filename[0]),
+                           min_stations=min_stations[0],
+                           coordinates=coordinates)
+        addEvents(self.events, groups, coordinates)
+        self._changeSelectedChannel()
+        self.statusbar.showMessage('%d events associated' % len(groups), 5000)
+
+    def _picksCompare(self):
+        '''
+        Open file dialog, compare and show the report
+        '''
+        filename = QFileDialog.getOpenFileName(self, 'Compare Picks',
+                                               filter='JSON File (*.json)',
+                                               options=QFileDialog.ReadOnly)
+        if filename[0] == u'':
+            return
+        report = self.comparison.load(filename[0])
+        self.actionComparison.setEnabled(True)
+        self.actionComparison.setChecked(True)
+        total = report[-1]
+        box = QMessageBox(self)
+        box.setWindowTitle('Pick Comparison')
+        box.setText('%d of %d picks matched, precision %.3f, recall %.3f\n'
+                    'residual median %.3f s, std %.3f s'
+                    % (total['n_matched'], total['n_candidate'],
+                       total['precision'], total['recall'],
+                       total['median'], total['std']))
+        box.setDetailedText(formatReport(report))
+        box.show()
+
     def _picksExportCSV(self):
         '''
         Open file dialog and save CSV
@@ -240,14 +714,19 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         '''
         Called when the delete Item button is triggered
         '''
-        for event in self.events:
-            if event.QEventItem.isSelected():
+        items = self._selectedEventItems()
+        deleted_events = [item for item in items if isinstance(item, Event)]
+        with self.undo.group():
+            for event in deleted_events:
                 self.events.deleteEvent(event)
-                continue
-            for pick in event.picks:
-                if pick.QPickItem.isSelected():
-                    event.deletePick(pick)
+            for item in items:
+                if isinstance(item, Event) or item.event in deleted_events:
                     continue
+                picks = ([item] if isinstance(item, Pick) else
+                         item.event.station_picks.get(item.station, []))
+                for pick in list(picks):
+                    if pick in item.event.picks:
+                        item.event.deletePick(pick)
 
     def _addEventDialog(self):
         init_id = (max([event.id for event in self.events])+1
@@ -273,6 +752,18 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
         self.zerophaseCheck.stateChanged.connect(self._updateFilterArgs)
         self.filterButton.clicked.connect(self._updateFilterArgs)
 
+        self.responseCombo = QComboBox(self.pageFilter)
+        self.responseCombo.setGeometry(QRect(10, 200, 241, 27))
+        self.responseCombo.setStatusTip('Remove the instrument response '
+                                        'attached to the traces')
+        for label, output in [('Raw Counts', None),
+                              ('Displacement', 'DISP'),
+                              ('Velocity', 'VEL'),
+                              ('Acceleration', 'ACC')]:
+            self.responseCombo.addItem(label, output)
+        self.responseCombo.currentIndexChanged.connect(
+            self._updateResponseOutput)
+
     def _spinMaxChanged(self):
         '''
         Called when QSpinBox fmax is changed
@@ -321,6 +812,21 @@ class wavePicker(mainWindow.Ui_MainWindow, QMainWindow):
                 return
             self.filterArgs = None
             self.filterButton.setText('Filter On')
+        self._reprocessTraces()
+
+    def _updateResponseOutput(self, index):
+        '''
+        Called when the instrument correction output is changed
+        '''
+        self.responses.setOutput(self.responseCombo.itemData(index))
+        self._reprocessTraces()
+
+    def _reprocessTraces(self):
+        '''
+        Passes changed processing parameters on to the visible stations
+        '''
         for station in self.stations:
             if station.visible:
                 station.updateTraceFilter()
+        self.prefetcher.schedule()
+        self.recordSection.update()
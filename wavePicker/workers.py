@@ -0,0 +1,65 @@
+from PySide.QtCore import *
+
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+import sys
+import traceback
+
+
+def _runJob(func, args):
+    '''
+    Runs func in the worker thread, exceptions are returned instead of
+    raised so they can be reported on the GUI thread
+    '''
+    try:
+        return True, func(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+class WorkerPool(QObject):
+    '''
+    Thread pool for NumPy heavy jobs off the GUI thread
+
+    Results are delivered through a queued signal, so callbacks always
+    run on the GUI thread and may touch Qt items and pyqtgraph objects.
+    '''
+    _resultReady = Signal(object, object, object)
+
+    def __init__(self, nworkers=None, parent=None):
+        '''
+        :param nworkers: Number of threads, type int (default: cpu count)
+        '''
+        super(WorkerPool, self).__init__(parent)
+        self.nworkers = nworkers or cpu_count()
+        self.pool = ThreadPool(self.nworkers)
+        self.npending = 0
+        self._resultReady.connect(self._deliver, Qt.QueuedConnection)
+
+    def submit(self, func, args=(), callback=None, errback=None):
+        '''
+        Runs func(*args) in the pool
+
+        :param callback: called as callback(result) on the GUI thread
+        :param errback: called as errback(traceback) on the GUI thread if
+                        func raised, so callers can clean up pending state
+        '''
+        self.npending += 1
+
+        def _done(result):
+            self._resultReady.emit((callback, errback), result[0], result[1])
+        self.pool.apply_async(_runJob, (func, args), callback=_done)
+
+    def _deliver(self, callbacks, ok, result):
+        self.npending -= 1
+        callback, errback = callbacks
+        if not ok:
+            sys.stderr.write('wavePicker worker failed:\n%s' % result)
+            if errback is not None:
+                errback(result)
+            return
+        if callback is not None:
+            callback(result)
+
+    def close(self):
+        self.pool.terminate()